@@ -0,0 +1,140 @@
+# accounts.py
+# 玩家账号开通：User / Player / Plot / Inventory 在一个 BEGIN IMMEDIATE 事务里用固定条数的
+# executemany 写入，语句数量与开通的账号数无关；用户名重复由 User.Username 的 UNIQUE 约束判断。
+# 初始物品来自 StarterKit 表（经目录缓存读取）。
+#
+# 命令行批量开通（活动 / 压测用）：
+#   python accounts.py --prefix event_ --count 5000 --password 123456
+#   python accounts.py --csv accounts.csv            # 每行 username,password
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import economy
+
+STARTER_GOLD = 100
+STARTER_PLOTS = 1
+
+
+class RegistrationError(Exception):
+    pass
+
+
+def create_players(conn, accounts, starter_kit, gold=STARTER_GOLD, plots=STARTER_PLOTS):
+    """开通一批玩家账号。accounts 为 [(username, 密码哈希), ...]，返回 [(UserID, PlayerID), ...]。
+
+    整批在一个事务里完成：任一用户名已存在时整批回滚并抛出 RegistrationError。
+    """
+    accounts = list(accounts)
+    if not accounts:
+        return []
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # 持有写锁期间预先分配好 UserID / PlayerID，后面全部用 executemany 写入
+        ids = list(zip(db.reserve_ids(conn, 'User', 'UserID', len(accounts)),
+                       db.reserve_ids(conn, 'Player', 'PlayerID', len(accounts))))
+
+        conn.executemany("INSERT INTO User (UserID, Username, Password, Role) VALUES (?, ?, ?, 'player')",
+                         [(user_id, username, pw_hash) for (user_id, _), (username, pw_hash) in zip(ids, accounts)])
+        conn.executemany("INSERT INTO Player (PlayerID, CurrentGold, UserID) VALUES (?, ?, ?)",
+                         [(player_id, gold, user_id) for user_id, player_id in ids])
+        # 初始金币已写在 Player 行里，这里只补流水
+        economy.record(conn, [(player_id, gold, economy.reference('register')) for _, player_id in ids])
+        conn.executemany("INSERT INTO Plot (PlayerID, Status) VALUES (?, 'Empty')",
+                         [(player_id,) for _, player_id in ids for _ in range(plots)])
+        if starter_kit:
+            conn.executemany("INSERT INTO Inventory (PlayerID, ItemID, Quantity) VALUES (?, ?, ?)",
+                             [(player_id, item_id, qty) for _, player_id in ids for item_id, qty in starter_kit])
+        conn.commit()
+    except db.IntegrityError as e:
+        conn.rollback()
+        if 'Username' in str(e):
+            raise RegistrationError('用户名已存在！')
+        raise
+    except Exception:
+        conn.rollback()
+        raise
+    return ids
+
+
+def register_player(conn, catalog, username, pw_hash):
+    """注册单个玩家，返回 (UserID, PlayerID)。"""
+    return create_players(conn, [(username, pw_hash)], catalog.starter_kit)[0]
+
+
+def describe_starter_kit(catalog, gold=STARTER_GOLD, plots=STARTER_PLOTS):
+    """注册成功提示里的初始物品说明。"""
+    parts = ['💰{}金币'.format(gold)]
+    if catalog.starter_kit:
+        parts.append('🧺' + '、'.join('{}×{}'.format(catalog.items[item_id]['ItemName'], qty)
+                                       for item_id, qty in catalog.starter_kit))
+    parts.append('🏡{}块土地'.format(plots))
+    return '、'.join(parts)
+
+
+# ===== 批量开通 =====
+
+def _read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return [(row[0].strip(), row[1]) for row in csv.reader(f) if row and row[0].strip()]
+
+
+def provision(conn, accounts, batch_size=1000, hash_workers=None):
+    """批量开通 [(username, 明文密码), ...]，相同密码只计算一次哈希，每 batch_size 个账号一个事务。"""
+    from werkzeug.security import generate_password_hash
+
+    import catalog as catalog_module
+    import passwords
+
+    kit = catalog_module.load(conn, catalog_module.read_version(conn)).starter_kit
+    distinct = sorted({password for _, password in accounts})
+    with ThreadPoolExecutor(max_workers=hash_workers or os.cpu_count() or 2) as pool:
+        hashes = dict(zip(distinct, pool.map(
+            lambda pw: generate_password_hash(pw, passwords.HASH_METHOD, passwords.SALT_LENGTH), distinct)))
+
+    created = 0
+    for start in range(0, len(accounts), batch_size):
+        batch = accounts[start:start + batch_size]
+        create_players(conn, [(username, hashes[password]) for username, password in batch], kit)
+        created += len(batch)
+    return created
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='批量开通玩家账号')
+    parser.add_argument('--db', help='数据库路径（默认 FARM_DB_PATH 或 farm_game.db）')
+    parser.add_argument('--prefix', default='player_', help='用户名前缀，生成 <prefix><序号>')
+    parser.add_argument('--start', type=int, default=1, help='起始序号')
+    parser.add_argument('--count', type=int, default=0)
+    parser.add_argument('--password', help='--count 模式下所有账号共用的密码')
+    parser.add_argument('--csv', help='从 CSV 读取账号，每行 username,password')
+    parser.add_argument('--batch', type=int, default=1000, help='每个事务开通的账号数')
+    args = parser.parse_args(argv)
+
+    if args.csv:
+        accounts = _read_csv(args.csv)
+    elif args.count and args.password:
+        accounts = [('{}{}'.format(args.prefix, i), args.password) for i in range(args.start, args.start + args.count)]
+    else:
+        parser.error('需要 --csv，或同时指定 --count 和 --password')
+
+    import migrations
+    conn = db.connect(args.db)
+    migrations.migrate(conn)
+    started = time.monotonic()
+    try:
+        created = provision(conn, accounts, args.batch)
+    except RegistrationError as e:
+        sys.exit('开通失败：{}（该批次已回滚）'.format(e))
+    finally:
+        conn.close()
+    print('✅ 已开通 {} 个账号，用时 {:.1f}s'.format(created, time.monotonic() - started))
+
+
+if __name__ == '__main__':
+    main()
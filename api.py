@@ -0,0 +1,188 @@
+# api.py
+# /api/v1：玩家操作的 JSON 接口。业务逻辑与 HTML 路由共用 game.py，
+# 响应里只带受影响的地块、库存行和当前金币，页面据此局部更新，不必整页跳转重新渲染。
+# 防 CSRF：写操作（POST）必须带 X-Requested-With 头，带 Origin 时必须和本站同源。
+# 跨站页面的表单发不出自定义头，跨站 fetch 带自定义头会先发预检请求，而本接口不开放 CORS。
+from urllib.parse import urlsplit
+
+from flask import Blueprint, jsonify, request, session
+
+import auth
+import game
+import growth
+import orders
+import purchase
+import writebehind
+from catalog import get_catalog
+from db import get_db
+
+api = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+
+def _payload():
+    return request.get_json(silent=True) or request.form
+
+
+def _error(message, status=409):
+    return jsonify(ok=False, error=message), status
+
+
+def _same_origin():
+    origin = request.headers.get('Origin')
+    if origin is None:
+        return True
+    # 只比较主机名和端口：部署在 TLS 终止的代理后面时，应用看到的 scheme 是 http
+    return urlsplit(origin).netloc == request.host
+
+
+@api.before_request
+def require_player():
+    if request.method == 'POST' and (request.headers.get('X-Requested-With') != 'XMLHttpRequest'
+                                     or not _same_origin()):
+        return _error('请求来源无效', 403)
+    if session.get('role') != 'player' or auth.load_player() is None:
+        return _error('请先登录', 401)
+
+
+def _plot_json(plot, catalog, now):
+    plant = catalog.plant(plot['PlantedPlantID']) if plot['PlantedPlantID'] else None
+    row = growth.derive(plot, plant, now)
+    return {
+        'PlotID': row['PlotID'],
+        'Status': row['Status'],
+        'PlantedPlantID': row['PlantedPlantID'],
+        'PlantName': plant['PlantName'] if plant else None,
+        'CurrentGrowthTimeLeft': row['CurrentGrowthTimeLeft'],
+        'TimesWatered': row['TimesWatered'],
+        'MaxWaterTimes': plant['MaxWaterTimes'] if plant else None,
+    }
+
+
+def _state(conn, result=None, full=False):
+    """组装响应：full=True 返回全部地块和库存，否则只返回 result 中受影响的部分。"""
+    catalog = get_catalog()
+    player = auth.load_player()
+    now = growth.player_clock(conn, player)
+    result = result or {}
+
+    if full or result.get('all_plots'):
+        plots = conn.execute("SELECT * FROM Plot WHERE PlayerID = ?", (player['PlayerID'],)).fetchall()
+    elif result.get('plot_ids'):
+        marks = ','.join('?' * len(result['plot_ids']))
+        plots = conn.execute("SELECT * FROM Plot WHERE PlayerID = ? AND PlotID IN ({})".format(marks),
+                             [player['PlayerID']] + result['plot_ids']).fetchall()
+    else:
+        plots = []
+
+    if full:
+        inventory = conn.execute("SELECT ItemID, Quantity FROM Inventory WHERE PlayerID = ?",
+                                 (player['PlayerID'],)).fetchall()
+        quantities = {row['ItemID']: row['Quantity'] for row in inventory}
+    else:
+        item_ids = [item_id for item_id in result.get('item_ids', []) if item_id is not None]
+        quantities = dict.fromkeys(item_ids, 0)
+        if item_ids:
+            marks = ','.join('?' * len(item_ids))
+            for row in conn.execute("SELECT ItemID, Quantity FROM Inventory WHERE PlayerID = ? AND ItemID IN ({})"
+                                    .format(marks), [player['PlayerID']] + item_ids):
+                quantities[row['ItemID']] = row['Quantity']
+
+    body = {
+        'ok': True,
+        'gold': player['CurrentGold'],
+        'clock': now,
+        'plots': [_plot_json(plot, catalog, now) for plot in plots],
+        'inventory': [
+            {'ItemID': item_id, 'ItemName': catalog.items[item_id]['ItemName'] if item_id in catalog.items else None,
+             'Quantity': qty}
+            for item_id, qty in quantities.items()
+        ],
+    }
+    if 'message' in result:
+        body['message'] = result['message']
+    if result.get('warning'):
+        body['warning'] = result['warning']
+    if full:
+        body['full'] = True
+    return body
+
+
+def _run(action, batched=False):
+    """batched=True 的操作在 WRITE_BEHIND=on 时交给写线程批量提交（见 writebehind.py），
+    action 里不能再调用 get_catalog() 等依赖请求上下文的函数。"""
+    conn = get_db()
+    player = auth.load_player()
+    try:
+        if batched:
+            result = writebehind.run(lambda batch_conn: action(batch_conn, player))
+        else:
+            result = action(conn, player)
+    except (game.GameError, purchase.PurchaseError) as e:
+        return _error(str(e))
+    except writebehind.WriterBusy as e:
+        return _error(str(e), 503)
+    # 操作可能改了金币 / 时钟，重新读一次玩家行
+    auth.refresh_player()
+    return jsonify(_state(conn, result))
+
+
+@api.route('/state')
+def state():
+    return jsonify(_state(get_db(), full=True))
+
+
+@api.route('/plots/<int:plot_id>/water', methods=['POST'])
+def water(plot_id):
+    catalog = get_catalog()
+    return _run(lambda conn, player: game.water(conn, catalog, player, plot_id), batched=True)
+
+
+@api.route('/plots/water_all', methods=['POST'])
+def water_all():
+    return _run(lambda conn, player: game.water_all(conn, get_catalog(), player))
+
+
+@api.route('/plots/plant_all', methods=['POST'])
+def plant_all():
+    plant_id = _payload().get('plant_id')
+    return _run(lambda conn, player: game.plant_all(conn, get_catalog(), player, plant_id))
+
+
+@api.route('/plots/<int:plot_id>/harvest', methods=['POST'])
+def harvest(plot_id):
+    return _run(lambda conn, player: game.harvest_plot(conn, get_catalog(), player, plot_id))
+
+
+@api.route('/plots/harvest_all', methods=['POST'])
+def harvest_all():
+    return _run(lambda conn, player: game.harvest_all(conn, get_catalog(), player))
+
+
+@api.route('/next_day', methods=['POST'])
+def next_day():
+    return _run(lambda conn, player: game.next_day(conn, player), batched=True)
+
+
+@api.route('/shop/buy', methods=['POST'])
+def shop_buy():
+    # {"item_id": 5, "quantity": 3} 或 {"cart": [[5, 3], [1, 2]]}
+    data = _payload()
+    cart = data.get('cart') or [(data.get('item_id'), data.get('quantity', 1))]
+    prices = get_catalog().shop_prices
+
+    def action(conn, player):
+        lines, total = purchase.buy(conn, player['PlayerID'], cart, prices)
+        return {'message': '购买成功，共 {} 件，花费 {} 金币'.format(sum(lines.values()), total),
+                'item_ids': list(lines)}
+    return _run(action, batched=True)
+
+
+@api.route('/orders')
+def order_board():
+    player = auth.load_player()
+    return jsonify(ok=True, orders=orders.board(get_db(), get_catalog(), player['PlayerID']))
+
+
+@api.route('/orders/<int:order_id>/complete', methods=['POST'])
+def complete_order(order_id):
+    return _run(lambda conn, player: game.complete_order(conn, player['PlayerID'], order_id))
@@ -1,27 +1,84 @@
 # app.py
-from flask import Flask, render_template, redirect, url_for, request, session, flash
-from werkzeug.security import generate_password_hash, check_password_hash
-import sqlite3
+from flask import Flask, Response, make_response, render_template, stream_with_context, redirect, url_for, request, session, flash, jsonify, abort
+import csv
+import hashlib
+import io
 import os
 
+import accounts
+import assets
+import auth
+import db
+import fragments
+import metrics
+import migrations
+import orders
+import paging
+import passwords
+import game
+import growth
+import purchase
+import replica
+import scheduler
+import writebehind
+from api import api
+from catalog import ORDERS_KEY, USERS_KEY, get_catalog, link_plant_items, read_version, unlink_item, invalidate as invalidate_catalog
+from db import get_db
+
 app = Flask(__name__)
-app.secret_key = 'secret-key'  # 用于 session 加密
+app.secret_key = os.environ.get('SECRET_KEY', 'secret-key')  # 用于 session 签名，session 里的 PlayerID 依赖它防篡改
 
-DB_PATH = 'farm_game.db'
+# 连接在请求结束时自动归还连接池，路由里不需要再 conn.close()
+db.init_app(app)
 
-def get_current_player():
-    if 'user_id' not in session:
-        return None
-    conn = get_db()
-    user_id = session['user_id']
-    player = conn.execute("SELECT * FROM Player WHERE UserID = ?", (user_id,)).fetchone()
-    conn.close()
-    return player
+# 每个请求的耗时 / SQL 条数 / 行数统计，见 /admin/metrics
+metrics.init_app(app)
+
+# 带内容哈希的静态资源（/assets/...，长期缓存），模板里用 asset_url() 取地址
+assets.init_app(app)
+
+# 模板字节码缓存 + {% cache %} 片段缓存
+fragments.init_app(app)
+
+# 只读页面走只读连接池或定期快照（DB_READ_MODE，默认关闭）
+replica.init_app(app)
+
+# 启动时执行未应用的数据库迁移（索引等）
+with app.app_context():
+    migrations.migrate(get_db(primary=True))
+
+# JSON 接口 /api/v1，页面可局部更新；原有 HTML 路由保留作为回退
+app.register_blueprint(api)
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+
+@app.before_request
+def start_world_scheduler():
+    # 每个 worker 第一次处理请求时启动世界时钟线程（只有抢到租约的那个会真正推进）
+    scheduler.ensure_started()
+
+@app.before_request
+def load_logged_in_player():
+    # 玩家请求先取一次玩家行（缓存在 g.player）；账号已被删除时这里会清掉 session，后面的角色检查随之失败
+    # 静态资源不读 session，响应里就不会带 Vary: Cookie，可以被共享缓存
+    if request.endpoint not in ('static', 'assets.dist') and session.get('role') == 'player':
+        auth.load_player()
+
+def get_current_player():
+    return auth.load_player()
+
+def _conditional(render, *key):
+    """读多写少的页面：key（连同资源 / 模板指纹）没变就返回 304，不查询也不渲染。
+    页面内容必须完全由 key 决定（不能显示 flash 消息等一次性内容）。"""
+    etag = hashlib.sha1('|'.join(map(str, (assets.build_id, session.get('user_id')) + key)).encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    # 页面因人而异，只允许浏览器缓存，且每次使用前都要带 If-None-Match 来确认
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/')
 def index():
@@ -33,50 +90,53 @@ def index():
             return redirect(url_for('player_dashboard'))
     return redirect(url_for('login'))
 
+@app.route('/healthz')
+def healthz():
+    # 存活检查：进程能处理请求即可，不碰数据库
+    return jsonify(status='ok')
+
+
+@app.route('/readyz')
+def readyz():
+    # 就绪检查：数据库可读、迁移已执行到最新版本、目录缓存能加载
+    try:
+        conn = get_db()
+        version = migrations.current_version(conn)
+        get_catalog()
+    except db.Error as e:
+        return jsonify(status='unavailable', error=str(e)), 503
+    latest = migrations.MIGRATIONS[-1][0]
+    if version < latest:
+        return jsonify(status='migrating', schema_version=version, expected=latest), 503
+    return jsonify(status='ok', schema_version=version, pid=os.getpid())
+
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
 
-        conn = get_db()
-        cur = conn.cursor()
+        # 哈希在有上限的线程池里算，繁忙时让用户稍后再试
+        try:
+            hashed_pw = passwords.hash_password(password)
+        except passwords.PasswordBusy as e:
+            flash(str(e), 'danger')
+            return render_template('register.html'), 503, {'Retry-After': str(passwords.RETRY_AFTER)}
 
-        # 检查用户名是否已存在
-        cur.execute("SELECT * FROM User WHERE Username = ?", (username,))
-        if cur.fetchone():
-            flash('用户名已存在！')
+        # 用户、玩家、土地、初始物品在一个事务里写入；用户名重复由 UNIQUE 约束报出
+        catalog = get_catalog()
+        try:
+            accounts.register_player(get_db(), catalog, username, hashed_pw)
+        except accounts.RegistrationError as e:
+            flash(str(e))
             return redirect(url_for('register'))
 
-        # 插入新用户
-        hashed_pw = generate_password_hash(password)
-        cur.execute("INSERT INTO User (Username, Password, Role) VALUES (?, ?, 'player')", (username, hashed_pw))
-        user_id = cur.lastrowid
-
-        # 创建玩家并初始化金币
-        cur.execute("INSERT INTO Player (CurrentGold, UserID) VALUES (?, ?)", (100, user_id))
-        player_id = cur.lastrowid
-
-        # 给新玩家添加一块空地
-        cur.execute("INSERT INTO Plot (PlayerID, Status) VALUES (?, 'Empty')", (player_id,))
-
-        # 添加种子库存：假设有种子物品 ID 是 1 和 2
-        init_seeds = [(1, 3), (3, 2)]  # [(ItemID, 数量)]
-        for item_id, quantity in init_seeds:
-            cur.execute("INSERT INTO Inventory (PlayerID, ItemID, Quantity) VALUES (?, ?, ?)", (player_id, item_id, quantity))
-
-        conn.commit()
-        conn.close()
-
-        flash('注册成功，已为你分配：💰100金币、🧺种子、🏡一块土地，请登录游戏查看！')
+        flash('注册成功，已为你分配：{}，请登录游戏查看！'.format(accounts.describe_starter_kit(catalog)))
         return redirect(url_for('login'))
 
     return render_template('register.html')
 
-from werkzeug.security import check_password_hash  # 确保已经导入
-
-from werkzeug.security import check_password_hash
-
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -87,13 +147,18 @@ def login():
 
         # 查询用户信息（只根据用户名）
         user = cursor.execute("SELECT * FROM User WHERE Username=?", (username,)).fetchone()
-        conn.close()
 
         # 验证密码哈希
-        if user and check_password_hash(user['Password'], password):
-            session['user_id'] = user['UserID']
-            session['username'] = user['Username']
-            session['role'] = user['Role']
+        try:
+            valid = user is not None and passwords.verify_password(user['Password'], password)
+        except passwords.PasswordBusy as e:
+            flash(str(e), 'danger')
+            return render_template('login.html'), 503, {'Retry-After': str(passwords.RETRY_AFTER)}
+
+        if valid:
+            # 哈希参数和当前配置不一致时在后台按新参数重新哈希
+            passwords.rehash_if_needed(user['UserID'], user['Password'], password)
+            auth.login_user(conn, user)
             flash('登录成功！', 'success')
             if user['Role'] == 'admin':
                 return redirect(url_for('admin_dashboard'))
@@ -120,49 +185,40 @@ def player_dashboard():
     if session.get('role') != 'player':
         return redirect(url_for('login'))
 
-    user_id = session['user_id']
     conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute("SELECT PlayerID, CurrentGold FROM Player WHERE UserID = ?", (user_id,))
-    player = cur.fetchone()
+    player = get_current_player()
 
-    cur.execute("""
-        SELECT i.ItemName, inv.Quantity
+    # 库存和地块列表在模板里按 Player.Revision 做片段缓存，命中时这两个查询都不执行
+    inventory = fragments.Deferred(lambda: conn.execute("""
+        SELECT inv.ItemID, i.ItemName, inv.Quantity
         FROM Inventory inv
         JOIN Item i ON inv.ItemID = i.ItemID
         WHERE inv.PlayerID = ?
-    """, (player['PlayerID'],))
-    inventory = cur.fetchall()
+    """, (player['PlayerID'],)).fetchall())
 
-    cur.execute("SELECT * FROM Plot WHERE PlayerID = ?", (player['PlayerID'],))
-    plots = cur.fetchall()
+    # 成熟状态和剩余时间按玩家时钟推算
+    catalog = get_catalog()
+    now = growth.player_clock(conn, player)
+    plots = fragments.Deferred(lambda: [
+        growth.derive(plot, catalog.plant(plot['PlantedPlantID']), now)
+        for plot in conn.execute("SELECT * FROM Plot WHERE PlayerID = ?", (player['PlayerID'],))])
 
-    conn.close()
-    return render_template('player_dashboard.html', player=player, inventory=inventory, plots=plots)
+    return render_template('player_dashboard.html', player=player, inventory=inventory, plots=plots,
+                           catalog_version=catalog.version, now=now)
 
 @app.route('/shop', methods=['GET'])
 def shop():
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    # 获取玩家信息
-    cur.execute("SELECT PlayerID, CurrentGold FROM Player WHERE UserID = ?", (session['user_id'],))
-    player = cur.fetchone()
-
-    # 获取商店可售物品
-    cur.execute("""
-        SELECT si.ItemID, i.ItemName, si.SellPrice
-        FROM ShopItem si
-        JOIN Item i ON si.ItemID = i.ItemID
-    """)
-    items = cur.fetchall()
+    # 玩家信息（管理员查看商店时为 None）
+    player = get_current_player()
+    catalog = get_catalog()
 
-    conn.close()
-    return render_template('shop.html', player=player, items=items)
+    # 页面只取决于目录版本和当前金币
+    return _conditional(
+        lambda: render_template('shop.html', player=player, items=catalog.shop_items),
+        'shop', catalog.version, player['CurrentGold'] if player else None)
 
 
 @app.route('/shop/buy/<int:item_id>', methods=['POST'])
@@ -170,34 +226,33 @@ def shop_buy(item_id):
     if session.get('role') != 'player':
         return redirect(url_for('login'))
 
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT PlayerID, CurrentGold FROM Player WHERE UserID = ?", (session['user_id'],))
-    player = cur.fetchone()
+    # 数量可以来自单独的 quantity 字段，也可以来自商店页整表提交的 qty_<ItemID>
+    quantity = request.form.get('quantity') or request.form.get('qty_{}'.format(item_id)) or 1
+    return _checkout([(item_id, quantity)])
 
-    cur.execute("SELECT SellPrice FROM ShopItem WHERE ItemID = ?", (item_id,))
-    item = cur.fetchone()
-    if not item:
-        flash('商品不存在')
-        return redirect(url_for('shop'))
 
-    if player['CurrentGold'] < item['SellPrice']:
-        flash('金币不足')
-        return redirect(url_for('shop'))
+@app.route('/shop/checkout', methods=['POST'])
+def shop_checkout():
+    if session.get('role') != 'player':
+        return redirect(url_for('login'))
 
-    new_gold = player['CurrentGold'] - item['SellPrice']
-    cur.execute("UPDATE Player SET CurrentGold = ? WHERE PlayerID = ?", (new_gold, player['PlayerID']))
+    # 购物车：表单里每个 qty_<ItemID> 字段是一行
+    cart = [(key[len('qty_'):], value) for key, value in request.form.items()
+            if key.startswith('qty_') and value]
+    return _checkout(cart)
 
-    cur.execute("SELECT Quantity FROM Inventory WHERE PlayerID = ? AND ItemID = ?", (player['PlayerID'], item_id))
-    inv = cur.fetchone()
-    if inv:
-        cur.execute("UPDATE Inventory SET Quantity = Quantity + 1 WHERE PlayerID = ? AND ItemID = ?", (player['PlayerID'], item_id))
-    else:
-        cur.execute("INSERT INTO Inventory (PlayerID, ItemID, Quantity) VALUES (?, ?, 1)", (player['PlayerID'], item_id))
 
-    conn.commit()
-    conn.close()
-    flash('购买成功')
+def _checkout(cart):
+    player_id = get_current_player()['PlayerID']
+    prices = get_catalog().shop_prices
+
+    try:
+        lines, total = writebehind.run(lambda conn: purchase.buy(conn, player_id, cart, prices))
+    except (purchase.PurchaseError, writebehind.WriterBusy) as e:
+        flash(str(e))
+        return redirect(url_for('shop'))
+
+    flash('购买成功，共 {} 件，花费 {} 金币'.format(sum(lines.values()), total))
     return redirect(url_for('shop'))
 
 @app.route('/plant', methods=['GET', 'POST'])
@@ -205,45 +260,38 @@ def plant():
     if session.get('role') != 'player':
         return redirect(url_for('login'))
 
-    user_id = session['user_id']
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("SELECT PlayerID FROM Player WHERE UserID = ?", (user_id,))
-    player = cur.fetchone()
+    player = get_current_player()
 
     if request.method == 'POST':
-        plot_id = request.form['plot_id']
-        plant_id = request.form['plant_id']
-
-        cur.execute("SELECT Quantity FROM Inventory WHERE PlayerID = ? AND ItemID = ?", (player['PlayerID'], plant_id))
-        seed = cur.fetchone()
-        if not seed or seed['Quantity'] < 1:
-            flash('你没有这个种子的库存')
+        try:
+            result = game.plant(conn, get_catalog(), player, request.form['plot_id'], request.form['plant_id'])
+        except game.GameError as e:
+            flash(str(e))
             return redirect(url_for('plant'))
 
-        cur.execute("SELECT BaseGrowthTime FROM Plant WHERE PlantID = ?", (plant_id,))
-        base_time = cur.fetchone()['BaseGrowthTime']
-
-        cur.execute("UPDATE Plot SET PlantedPlantID = ?, Status = 'Growing', CurrentGrowthTimeLeft = ?, TimesWatered = 0 WHERE PlotID = ? AND PlayerID = ?", (plant_id, base_time, plot_id, player['PlayerID']))
-        cur.execute("UPDATE Inventory SET Quantity = Quantity - 1 WHERE PlayerID = ? AND ItemID = ?", (player['PlayerID'], plant_id))
-        conn.commit()
-        conn.close()
-        flash('种植成功')
+        flash(result['message'])
         return redirect(url_for('player_dashboard'))
 
     cur.execute("SELECT * FROM Plot WHERE PlayerID = ? AND Status = 'Empty'", (player['PlayerID'],))
     empty_plots = cur.fetchall()
 
-    cur.execute("""
-        SELECT p.PlantID, p.PlantName, i.ItemID, i.ItemName AS SeedName, inv.Quantity
-        FROM Plant p
-        JOIN Item i ON p.PlantName = REPLACE(i.ItemName, '种子', '')
-        JOIN Inventory inv ON inv.ItemID = i.ItemID AND inv.PlayerID = ?
-        WHERE inv.Quantity > 0
-    """, (player['PlayerID'],))
-    seeds = cur.fetchall()
+    # 库存里的种子 -> 对应植物（Plant.SeedItemID），映射关系来自目录缓存
+    catalog = get_catalog()
+    cur.execute("SELECT ItemID, Quantity FROM Inventory WHERE PlayerID = ? AND Quantity > 0", (player['PlayerID'],))
+    seeds = []
+    for inv in cur.fetchall():
+        seed_plant = catalog.plant_for_seed(inv['ItemID'])
+        if seed_plant:
+            seeds.append({
+                'PlantID': seed_plant['PlantID'],
+                'PlantName': seed_plant['PlantName'],
+                'ItemID': inv['ItemID'],
+                'SeedName': catalog.items[inv['ItemID']]['ItemName'],
+                'Quantity': inv['Quantity'],
+            })
 
-    conn.close()
     return render_template('plant.html', plots=empty_plots, seeds=seeds)
 
 @app.route('/water/<int:plot_id>', methods=['POST'])
@@ -251,90 +299,63 @@ def water(plot_id):
     if session.get('role') != 'player':
         return redirect(url_for('login'))
 
-    user_id = session['user_id']
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT PlayerID FROM Player WHERE UserID = ?", (user_id,))
-    player = cur.fetchone()
-
-    cur.execute("SELECT PlantedPlantID, CurrentGrowthTimeLeft, TimesWatered FROM Plot WHERE PlotID = ? AND PlayerID = ? AND Status = 'Growing'", (plot_id, player['PlayerID']))
-    plot = cur.fetchone()
-    if not plot:
-        flash('无法浇水：该土地不可操作')
+    catalog, player = get_catalog(), get_current_player()
+    try:
+        result = writebehind.run(lambda conn: game.water(conn, catalog, player, plot_id))
+    except (game.GameError, writebehind.WriterBusy) as e:
+        flash(str(e))
         return redirect(url_for('player_dashboard'))
 
-    cur.execute("SELECT MaxWaterTimes, WaterEffectPerTime FROM Plant WHERE PlantID = ?", (plot['PlantedPlantID'],))
-    plant_info = cur.fetchone()
+    flash(result['message'])
+    return redirect(url_for('player_dashboard'))
 
-    if plot['TimesWatered'] >= plant_info['MaxWaterTimes']:
-        flash('已达最大浇水次数')
-        return redirect(url_for('player_dashboard'))
+@app.route('/harvest_all', methods=['GET', 'POST'])
+def harvest():
+    player = get_current_player()
+    if not player:
+        return redirect(url_for('login'))
+    conn = get_db()
 
-    cur.execute("SELECT Quantity FROM Inventory WHERE PlayerID = ? AND ItemID = (SELECT ItemID FROM Item WHERE ItemName = '水滴')", (player['PlayerID'],))
-    water = cur.fetchone()
-    if not water or water['Quantity'] < 1:
-        flash('没有足够的水滴')
+    # 所有已成熟地块一次性收获，产物按物品汇总入库
+    try:
+        result = game.harvest_all(conn, get_catalog(), player)
+    except game.GameError as e:
+        flash(str(e), "warning")
         return redirect(url_for('player_dashboard'))
 
-    new_time = max(0, plot['CurrentGrowthTimeLeft'] - plant_info['WaterEffectPerTime'])
-    cur.execute("""
-        UPDATE Plot SET
-            CurrentGrowthTimeLeft = ?,
-            TimesWatered = TimesWatered + 1
-        WHERE PlotID = ?
-    """, (new_time, plot_id))
+    if result['warning']:
+        flash(result['warning'], "danger")
+    flash(result['message'], "success")
+    return redirect(url_for('player_dashboard'))
 
-    cur.execute("UPDATE Inventory SET Quantity = Quantity - 1 WHERE PlayerID = ? AND ItemID = (SELECT ItemID FROM Item WHERE ItemName = '水滴')", (player['PlayerID'],))
-    conn.commit()
-    conn.close()
 
-    flash('浇水成功')
-    return redirect(url_for('player_dashboard'))
+@app.route('/water_all', methods=['POST'])
+def water_all():
+    if session.get('role') != 'player':
+        return redirect(url_for('login'))
 
-from flask import flash
+    try:
+        result = game.water_all(get_db(), get_catalog(), get_current_player())
+    except game.GameError as e:
+        flash(str(e))
+        return redirect(url_for('player_dashboard'))
 
-@app.route('/harvest_all', methods=['GET', 'POST'])
-def harvest():
-    player = get_current_player()
-    conn = get_db()
-    cur = conn.cursor()
+    flash(result['message'])
+    return redirect(url_for('player_dashboard'))
 
-    # 查询所有可收获地块
-    ready_plots = cur.execute("""
-        SELECT * FROM Plot WHERE PlayerID = ? AND Status = 'Ready'
-    """, (player['PlayerID'],)).fetchall()
 
-    if not ready_plots:
-        flash("当前没有可收获的作物！", "warning")
-        return redirect(url_for('player_dashboard'))
+@app.route('/plant_all', methods=['POST'])
+def plant_all():
+    if session.get('role') != 'player':
+        return redirect(url_for('login'))
 
-    for plot in ready_plots:
-        # 查作物信息
-        plant = cur.execute("SELECT * FROM Plant WHERE PlantID = ?", (plot['PlantedPlantID'],)).fetchone()
-
-        # 找对应的 Item（比如“萝卜”）
-        item = cur.execute("SELECT ItemID FROM Item WHERE ItemName = ?", (plant['PlantName'],)).fetchone()
-        if not item:
-            flash(f"作物 {plant['PlantName']} 无对应物品，跳过。", "danger")
-            continue
-
-        # 插入或更新 Inventory
-        cur.execute("""
-            INSERT INTO Inventory (PlayerID, ItemID, Quantity)
-            VALUES (?, ?, ?)
-            ON CONFLICT(PlayerID, ItemID) DO UPDATE SET Quantity = Quantity + excluded.Quantity
-        """, (player['PlayerID'], item['ItemID'], plant['HarvestYield']))
-
-        # 清空地块
-        cur.execute("""
-            UPDATE Plot SET Status = 'Empty', PlantedPlantID = NULL,
-                            CurrentGrowthTimeLeft = NULL, TimesWatered = 0
-            WHERE PlotID = ?
-        """, (plot['PlotID'],))
+    try:
+        result = game.plant_all(get_db(), get_catalog(), get_current_player(), request.form['plant_id'])
+    except game.GameError as e:
+        flash(str(e))
+        return redirect(url_for('plant'))
 
-    conn.commit()
-    conn.close()
-    flash("作物已成功收获 ✅", "success")
+    flash(result['message'])
     return redirect(url_for('player_dashboard'))
 
 
@@ -345,35 +366,13 @@ def do_harvest(plot_id):
     if session.get('role') != 'player':
         return redirect(url_for('login'))
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    # 找到当前玩家 ID
-    cur.execute("SELECT PlayerID FROM Player WHERE UserID = ?", (session['user_id'],))
-    player = cur.fetchone()
-
-    # 查询该地块是否可收获
-    cur.execute("""
-        SELECT pl.SellPrice, pl.HarvestYield
-        FROM Plot p
-        JOIN Plant pl ON p.PlantedPlantID = pl.PlantID
-        WHERE p.PlotID = ? AND p.PlayerID = ? AND p.Status = 'Ready'
-    """, (plot_id, player['PlayerID']))
-    plant_info = cur.fetchone()
-
-    if not plant_info:
-        flash("❌ 无法收获：该地块未成熟或不存在。")
+    try:
+        result = game.harvest_plot(get_db(), get_catalog(), get_current_player(), plot_id)
+    except game.GameError as e:
+        flash(str(e))
         return redirect(url_for('player_dashboard'))
 
-    # 收获逻辑：获得金币 + 清除地块
-    total_gold = plant_info['SellPrice'] * plant_info['HarvestYield']
-    cur.execute("UPDATE Player SET CurrentGold = CurrentGold + ? WHERE PlayerID = ?", (total_gold, player['PlayerID']))
-    cur.execute("UPDATE Plot SET Status = 'Empty', PlantedPlantID = NULL, CurrentGrowthTimeLeft = NULL, TimesWatered = 0 WHERE PlotID = ?", (plot_id,))
-
-    conn.commit()
-    conn.close()
-
-    flash(f"✅ 收获成功，获得金币 {total_gold}！")
+    flash(result['message'])
     return redirect(url_for('player_dashboard'))
 
 @app.route('/next_day', methods=['POST'])
@@ -381,28 +380,11 @@ def next_day():
     if session.get('role') != 'player':
         return redirect(url_for('login'))
 
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT PlayerID FROM Player WHERE UserID = ?", (session['user_id'],))
-    player = cur.fetchone()
-
-    # 所有生长中的地块减少成长时间
-    cur.execute("""
-        UPDATE Plot
-        SET 
-            CurrentGrowthTimeLeft = CASE 
-                WHEN CurrentGrowthTimeLeft - 1 <= 0 THEN 0
-                ELSE CurrentGrowthTimeLeft - 1
-            END,
-            Status = CASE 
-                WHEN CurrentGrowthTimeLeft - 1 <= 0 THEN 'Ready'
-                ELSE 'Growing'
-            END
-        WHERE PlayerID = ? AND Status = 'Growing'
-    """, (player['PlayerID'],))
-
-    conn.commit()
-    conn.close()
+    player = get_current_player()
+    try:
+        writebehind.run(lambda conn: game.next_day(conn, player))
+    except writebehind.WriterBusy as e:
+        flash(str(e))
     return redirect(url_for('player_dashboard'))
 
 
@@ -413,74 +395,18 @@ def submit_order():
 
     order_id = int(request.form['order_id'])
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    # 获取玩家 ID
-    cur.execute("SELECT PlayerID FROM Player WHERE UserID = ?", (session['user_id'],))
-    player = cur.fetchone()
+    player = get_current_player()
     if not player:
         flash("未找到玩家。")
         return redirect(url_for('index'))
 
-    player_id = player['PlayerID']
-
-    # 获取订单详情
-    cur.execute("""
-        SELECT vo.RequiredItemID, vo.RequiredQuantity, vo.RewardGold, vo.RewardAffection,
-               v.VillagerID
-        FROM VillagerOrder vo
-        JOIN Villager v ON vo.VillagerID = v.VillagerID
-        WHERE vo.OrderID = ? AND vo.Status = 'Available'
-    """, (order_id,))
-    order = cur.fetchone()
-
-    if not order:
-        flash("订单无效或已完成。")
-        return redirect(url_for('index'))
-
-    # 检查背包是否足够
-    cur.execute("""
-        SELECT Quantity FROM Inventory
-        WHERE PlayerID = ? AND ItemID = ?
-    """, (player_id, order['RequiredItemID']))
-    inv = cur.fetchone()
-
-    if not inv or inv['Quantity'] < order['RequiredQuantity']:
-        flash("仓库物品不足，无法完成订单。")
+    try:
+        result = game.complete_order(get_db(), player['PlayerID'], order_id)
+    except game.GameError as e:
+        flash(str(e))
         return redirect(url_for('index'))
 
-    # 减去物品、加金币、加好感、更新订单状态
-    cur.execute("""
-        UPDATE Inventory SET Quantity = Quantity - ?
-        WHERE PlayerID = ? AND ItemID = ?
-    """, (order['RequiredQuantity'], player_id, order['RequiredItemID']))
-
-    cur.execute("""
-        UPDATE Player SET CurrentGold = CurrentGold + ?
-        WHERE PlayerID = ?
-    """, (order['RewardGold'], player_id))
-
-    cur.execute("""
-        INSERT INTO Affection (PlayerID, VillagerID, AffectionLevel)
-        VALUES (?, ?, ?)
-        ON CONFLICT(PlayerID, VillagerID) DO UPDATE SET AffectionLevel = AffectionLevel + excluded.AffectionLevel
-    """, (player_id, order['VillagerID'], order['RewardAffection']))
-
-    cur.execute("""
-        UPDATE VillagerOrder SET Status = 'Completed', PlayerID = ?
-        WHERE OrderID = ?
-    """, (player_id, order_id))
-
-    # 记录收入
-    cur.execute("""
-        INSERT INTO GoldTransaction (PlayerID, Type, Amount, SourceReference)
-        VALUES (?, 'Income', ?, '完成订单 {}')
-    """.format(order_id), (player_id, order['RewardGold']))
-
-    conn.commit()
-    conn.close()
-    flash("订单完成，奖励已发放！")
+    flash(result['message'])
     return redirect(url_for('index'))
 
 @app.route('/orders')
@@ -490,78 +416,30 @@ def view_orders():
         return redirect('/login')
 
     conn = get_db()
-    orders = conn.execute("""
-        SELECT vo.OrderID, v.VillagerName AS VillagerName, i.ItemName, vo.RequiredQuantity,
-               vo.RewardGold, vo.RewardAffection, vo.Status
-        FROM VillagerOrder vo
-        JOIN Villager v ON vo.VillagerID = v.VillagerID
-        JOIN Item i ON vo.RequiredItemID = i.ItemID
-        WHERE vo.Status = 'Available'
-    """).fetchall()
-    conn.close()
-    return render_template('orders.html', orders=orders, player=player)
+
+    def render():
+        board = orders.board(conn, get_catalog(), player['PlayerID'])
+        return render_template('orders.html', orders=board, player=player,
+                               near_percent=int(orders.NEAR_RATIO * 100))
+
+    # 村民 / 物品名称随目录版本变，订单列表随订单版本变（发布、完成、过期时 +1），
+    # 能接哪些订单随玩家库存变（Player.Revision），订单到期不一定写库，再带上最早的过期时间
+    return _conditional(render, 'orders', get_catalog().version, read_version(conn, ORDERS_KEY),
+                        player['Revision'], player['CurrentGold'], orders.next_expiry(conn))
 
 @app.route('/orders/complete/<int:order_id>', methods=['POST'])
 def complete_order(order_id):
     player = get_current_player()
     if not player:
         return redirect('/login')
-    player_id = player['PlayerID']
-
-    conn = get_db()
-    # 查询订单详情
-    order = conn.execute("""
-        SELECT * FROM VillagerOrder WHERE OrderID = ? AND Status = 'Available'
-    """, (order_id,)).fetchone()
-
-    if not order:
-        flash("订单不存在或已完成")
-        return redirect('/orders')
 
-    item_id = order['RequiredItemID']
-    quantity = order['RequiredQuantity']
-    reward_gold = order['RewardGold']
-    reward_affection = order['RewardAffection']
-    villager_id = order['VillagerID']
-
-    # 检查背包是否足够
-    inv = conn.execute("""
-        SELECT Quantity FROM Inventory WHERE PlayerID = ? AND ItemID = ?
-    """, (player_id, item_id)).fetchone()
-
-    if not inv or inv['Quantity'] < quantity:
-        flash("背包物品不足，无法完成订单")
+    try:
+        result = game.complete_order(get_db(), player['PlayerID'], order_id)
+    except game.GameError as e:
+        flash(str(e))
         return redirect('/orders')
 
-    # 扣除物品
-    conn.execute("""
-        UPDATE Inventory SET Quantity = Quantity - ?
-        WHERE PlayerID = ? AND ItemID = ?
-    """, (quantity, player_id, item_id))
-
-    # 增加金币
-    conn.execute("""
-        UPDATE Player SET CurrentGold = CurrentGold + ?
-        WHERE PlayerID = ?
-    """, (reward_gold, player_id))
-
-    # 增加好感度（若无记录先插入）
-    conn.execute("""
-        INSERT INTO Affection (PlayerID, VillagerID, AffectionLevel)
-        VALUES (?, ?, ?)
-        ON CONFLICT(PlayerID, VillagerID)
-        DO UPDATE SET AffectionLevel = AffectionLevel + ?
-    """, (player_id, villager_id, reward_affection, reward_affection))
-
-    # 标记订单已完成
-    conn.execute("""
-        UPDATE VillagerOrder SET Status = 'Completed', PlayerID = ?
-        WHERE OrderID = ?
-    """, (player_id, order_id))
-
-    conn.commit()
-    conn.close()
-    flash("订单完成，已获得奖励！")
+    flash(result['message'])
     return redirect('/orders')
 
 
@@ -575,7 +453,6 @@ def delete_user(user_id):
     # 删除关联的玩家、物品等应加级联（或前提处理）
     conn.execute("DELETE FROM User WHERE UserID = ?", (user_id,))
     conn.commit()
-    conn.close()
     flash("用户已删除")
     return redirect(url_for('admin_dashboard'))
 
@@ -585,30 +462,135 @@ def admin_dashboard():
         return redirect(url_for('login'))
 
     conn = get_db()
-    cur = conn.cursor()
+    args = _user_list_args()
+
+    # 页面只显示用户列表（玩家 / 植物 / 物品 / 村民在 /admin/manage_all 管理）。
+    # 键集分页，每页只读 limit + 1 行；列表按用户表版本号 + 分页参数做片段缓存，命中时不查询
+    users = fragments.Deferred(lambda: _user_page(conn, args))
+
+    return render_template('admin_dashboard.html', users=users, args=args,
+                           users_version=read_version(conn, USERS_KEY))
+
+
+# 用户列表可以按这些列排序：(SQL 列, 结果行里的列名, 游标类型)，都是主键或 UNIQUE 列
+USER_SORTS = {
+    'id': ('u.UserID', 'UserID', int),
+    'username': ('u.Username', 'Username', str),
+}
+USER_LIST_SQL = "SELECT u.UserID, u.Username, u.Role FROM User u"
+EXPORT_CHUNK_SIZE = 1000
+
+
+def _user_list_args():
+    """从查询参数里取搜索 / 排序 / 游标，非法值按默认处理。"""
+    sort = request.args.get('sort') if request.args.get('sort') in USER_SORTS else 'id'
+    cast = USER_SORTS[sort][2]
+
+    def cursor(name):
+        value = request.args.get(name)
+        try:
+            return cast(value) if value not in (None, '') else None
+        except ValueError:
+            return None
+
+    return {
+        'q': request.args.get('q', '').strip(),
+        'sort': sort,
+        'order': 'desc' if request.args.get('order') == 'desc' else 'asc',
+        'after': cursor('after'),
+        'before': cursor('before'),
+        'limit': request.args.get('limit', paging.PAGE_SIZE, type=int),
+    }
+
+
+def _user_filters(q):
+    # 用户名前缀搜索，走 Username 的唯一索引
+    return [("u.Username >= ? AND u.Username < ?", paging.prefix_range(q))] if q else []
+
+
+def _user_page(conn, args):
+    column, key, _ = USER_SORTS[args['sort']]
+    return paging.keyset(conn, USER_LIST_SQL, column, key, _user_filters(args['q']),
+                         after=args['after'], before=args['before'],
+                         desc=args['order'] == 'desc', limit=args['limit'])
 
-    cur.execute("SELECT * FROM User")
-    users = cur.fetchall()
 
-    cur.execute("SELECT * FROM Player")
-    players = cur.fetchall()
+@app.route('/admin/users/export.csv')
+def admin_export_users():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    q = request.args.get('q', '').strip()
+
+    def generate():
+        # 按 UserID 分批查询、边查边输出，内存占用与用户总数无关
+        conn = get_db()
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['UserID', 'Username', 'Role', 'PlayerID', 'CurrentGold'])
+        after = None
+        while True:
+            page = paging.keyset(conn, """
+                SELECT u.UserID, u.Username, u.Role, p.PlayerID, p.CurrentGold
+                FROM User u LEFT JOIN Player p ON p.UserID = u.UserID
+            """, 'u.UserID', 'UserID', _user_filters(q), after=after, limit=EXPORT_CHUNK_SIZE)
+            writer.writerows(tuple(row) for row in page)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            if page.next_after is None:
+                break
+            after = page.next_after
+
+    response = Response(stream_with_context(generate()), mimetype='text/csv')
+    response.headers['Content-Disposition'] = 'attachment; filename=users.csv'
+    return response
+
+
+@app.route('/admin/db_stats')
+def admin_db_stats():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+    # 当前 worker 进程的连接池命中/未命中统计
+    return jsonify(dict(db.pool_stats(), read=replica.stats()))
+
+
+@app.route('/admin/scheduler')
+def admin_scheduler():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+    # 世界时钟及最近几次 tick 的耗时、处理行数、延迟
+    return jsonify(scheduler.metrics(get_db()))
 
-    cur.execute("SELECT * FROM Plant")
-    plants = cur.fetchall()
 
-    cur.execute("SELECT * FROM Item")
-    items = cur.fetchall()
+@app.route('/admin/write_behind')
+def admin_write_behind():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+    # 批量写入模式的批次数、平均批大小、排队中的操作数
+    return jsonify(writebehind.stats())
 
-    cur.execute("SELECT * FROM Villager")
-    villagers = cur.fetchall()
 
-    conn.close()
-    return render_template('admin_dashboard.html',
-                           users=users,
-                           players=players,
-                           plants=plants,
-                           items=items,
-                           villagers=villagers)
+@app.route('/admin/metrics')
+def admin_metrics():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+    data = metrics.collect()
+    endpoints = sorted(data['endpoints'].items(), key=lambda kv: kv[1]['wall_ms'], reverse=True)
+    slow_queries = sorted(data['slow_queries'].items(), key=lambda kv: kv[1]['total_ms'], reverse=True)
+    return render_template('admin_metrics.html', workers=data['workers'], endpoints=endpoints,
+                           slow_queries=slow_queries, profiles=data['profiles'],
+                           concurrency=sorted(data['concurrency'].items()),
+                           slow_query_ms=metrics.SLOW_QUERY_MS, profile_rate=metrics.PROFILE_RATE)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # 管理员登录后可直接访问；Prometheus 抓取时带 Authorization: Bearer $METRICS_TOKEN
+    token = os.environ.get('METRICS_TOKEN')
+    if session.get('role') != 'admin' and not (token and request.headers.get('Authorization') == 'Bearer ' + token):
+        abort(403)
+    return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/admin/manage_all', methods=['GET', 'POST'])
@@ -637,6 +619,8 @@ def admin_manage_all():
                         request.form['yield'],
                         request.form['price']
                     ))
+                    link_plant_items(conn)
+                    invalidate_catalog(conn)
                     conn.commit()
                     flash('植物添加成功', 'success')
 
@@ -654,6 +638,8 @@ def admin_manage_all():
                         request.form['item_type'],
                         request.form['item_desc']
                     ))
+                    link_plant_items(conn)
+                    invalidate_catalog(conn)
                     conn.commit()
                     flash('物品添加成功', 'success')
 
@@ -674,6 +660,7 @@ def admin_manage_all():
                         gender,
                         description
                     ))
+                    invalidate_catalog(conn)
                     conn.commit()
                     flash('村民添加成功', 'success')
 
@@ -681,30 +668,28 @@ def admin_manage_all():
             conn.rollback()
             flash(f'发生错误：{e}', 'danger')
 
-    # 获取所有数据用于展示
-    plants = cur.execute("SELECT * FROM Plant").fetchall()
-    items = cur.execute("SELECT * FROM Item").fetchall()
-    villagers = cur.execute("SELECT * FROM Villager").fetchall()
-    conn.close()
-
-    return render_template('admin_manage_all.html', plants=plants, items=items, villagers=villagers)
+    # 植物 / 物品 / 村民是配置表，行数由管理员维护、不随玩家增长，整个表已经在目录缓存里，不再查询
+    catalog = get_catalog()
+    return render_template('admin_manage_all.html', plants=catalog.plants.values(), items=catalog.items.values(),
+                           villagers=catalog.villagers.values())
 
 
 @app.route('/admin/delete_plant/<int:plant_id>', methods=['POST'])
 def delete_plant(plant_id):
     conn = get_db()
     conn.execute("DELETE FROM Plant WHERE PlantID = ?", (plant_id,))
+    invalidate_catalog(conn)
     conn.commit()
-    conn.close()
     flash('植物已删除','success')
     return redirect(url_for('admin_manage_all'))
 
 @app.route('/admin/delete_item/<int:item_id>', methods=['POST'])
 def delete_item(item_id):
     conn = get_db()
+    unlink_item(conn, item_id)
     conn.execute("DELETE FROM Item WHERE ItemID = ?", (item_id,))
+    invalidate_catalog(conn)
     conn.commit()
-    conn.close()
     flash('物品已删除','success')
     return redirect(url_for('admin_manage_all'))
 
@@ -712,11 +697,12 @@ def delete_item(item_id):
 def delete_villager(villager_id):
     conn = get_db()
     conn.execute("DELETE FROM Villager WHERE VillagerID = ?", (villager_id,))
+    invalidate_catalog(conn)
     conn.commit()
-    conn.close()
     flash('村民已删除','success')
     return redirect(url_for('admin_manage_all'))
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # 本地开发用；线上走 gunicorn -c gunicorn.conf.py
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1')
@@ -0,0 +1,182 @@
+# asgi.py
+# ASGI 入口，和 WSGI 模式（gunicorn app:app）跑的是同一个 Flask 应用、同一套路由和模板：
+#   uvicorn asgi:app --workers 2
+#   gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+# 事件循环只负责收发 HTTP，大量空闲 / 慢速连接不会各占一个线程；
+# 每个请求的 Flask 处理（SQLite 读写、密码校验都是阻塞调用）放到一个有上限的线程池里执行。
+import asyncio
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+from app import app as flask_app
+
+THREADS = int(os.environ.get('ASGI_THREADS', 16))              # 同时执行 Flask 处理的线程数
+MAX_PENDING = int(os.environ.get('ASGI_MAX_PENDING', 1024))    # 排队等线程的请求上限，超出返回 503
+STREAM_BUFFER = int(os.environ.get('ASGI_STREAM_BUFFER', 8))   # 每个响应在线程和事件循环之间最多缓冲的块数
+
+
+def build_environ(scope, body):
+    """把 ASGI http scope 转成 WSGI environ（PEP 3333）。"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            key = name
+        else:
+            key = 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    # 请求体已经整个读进内存：按实际长度设置 Content-Length，分块上传（没有 Content-Length、
+    # Transfer-Encoding: chunked）时 Flask 才读得到表单，否则会当作空请求体
+    environ['CONTENT_LENGTH'] = str(len(body))
+    environ.pop('HTTP_TRANSFER_ENCODING', None)
+    return environ
+
+
+def run_wsgi(wsgi_app, environ, loop, queue, cancelled):
+    """在线程池里执行：往 queue 里依次放 (status, headers)、每一块响应体，最后放 None。
+
+    整个响应都在同一个线程里迭代（stream_with_context 的请求上下文绑定在线程上），
+    queue 有上限，客户端收得慢时这里会等，不会把整个响应体攒在内存里。
+    应用抛出的异常也放进 queue，由事件循环一侧处理。cancelled 置位（客户端断开）后停止迭代。
+    """
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in headers]
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    try:
+        result = wsgi_app(environ, start_response)
+        try:
+            head_sent = False
+            for chunk in result:
+                if cancelled.is_set():
+                    break
+                if not head_sent:
+                    put((started['status'], started['headers']))
+                    head_sent = True
+                if chunk:
+                    put(chunk)
+            if not head_sent and not cancelled.is_set():
+                put((started['status'], started['headers']))
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+    except Exception as e:
+        put(e)
+    finally:
+        put(None)
+
+
+class FarmASGI:
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.executor = None
+        self.pending = 0
+
+    def startup(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='asgi-wsgi')
+            # 每个线程在一个请求里占一个连接，连接池至少要留得下这么多空闲连接
+            pool = db.get_pool()
+            pool.size = max(pool.size, THREADS)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        # websocket 等其它类型不处理
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        if self.pending >= MAX_PENDING:
+            await send({'type': 'http.response.start', 'status': 503,
+                        'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+            await send({'type': 'http.response.body', 'body': '服务器繁忙'.encode()})
+            return
+
+        self.startup()
+        self.pending += 1
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=STREAM_BUFFER)
+        cancelled = threading.Event()
+        loop.run_in_executor(self.executor, run_wsgi, self.wsgi_app, build_environ(scope, bytes(body)),
+                             loop, queue, cancelled)
+        finished = False
+        try:
+            head = await queue.get()
+            if isinstance(head, Exception):
+                raise head
+            await send({'type': 'http.response.start', 'status': head[0], 'headers': head[1]})
+            # 每一块都立刻发出去（more_body=True），流式响应（如 CSV 导出）不会先在内存里攒成一整块
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    finished = True
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if not finished:
+                # 出错或客户端断开：通知线程停止，并把队列读空，让它能放完剩下的东西退出
+                cancelled.set()
+                while await queue.get() is not None:
+                    pass
+            self.pending -= 1
+
+
+app = FarmASGI(flask_app)
@@ -0,0 +1,221 @@
+# assets.py
+# 静态资源：构建时给文件名加内容哈希，运行时按哈希文件名长期缓存。
+#
+#   python assets.py build     # 需要 Pillow / brotli（只在构建时用，运行时不依赖）
+#
+# 构建把 static/ 下的文件（和 BUNDLES 里拼接的文件）写到 static/dist/<名字>.<哈希><后缀>：
+#   - 内容相同的文件只保留一份（bg.jpg 和 R.jpg 指向同一个文件）；
+#   - css / js 额外生成 .gz / .br，按 Accept-Encoding 直接返回，不在请求里压缩；
+#   - jpg / png 重新压缩成渐进式 JPEG（比原图小时才替换），并生成 WebP；
+#   - 对应关系写进 static/dist/manifest.json，和构建结果一起提交。
+# 模板里用 asset_url('bg.jpg') 取地址；manifest 里没有的文件回退到普通的 /static/ 地址。
+# /assets/ 下的文件名随内容变化，所以可以 Cache-Control: immutable 缓存一年。
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import Blueprint, abort, request, send_from_directory, url_for
+from markupsafe import Markup
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+MAX_AGE = 365 * 24 * 3600
+COMPRESS_EXTENSIONS = ('.css', '.js', '.svg')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+# 多个文件拼成一个请求：和 CDN 上的 bootstrap.bundle.min.js 一样是 Popper + Bootstrap
+BUNDLES = {
+    'vendor/bootstrap/bootstrap.bundle.min.js': ['vendor/bootstrap/popper.min.js',
+                                                 'vendor/bootstrap/bootstrap.min.js'],
+}
+
+# 没有发布 .map 文件，去掉引用，免得浏览器开发者工具去请求
+_SOURCE_MAP = re.compile(rb'\n?(//# sourceMappingURL=\S+|/\*# sourceMappingURL=\S+ \*/)\s*$')
+
+assets = Blueprint('assets', __name__)
+
+_manifest = {}
+# 资源清单 + 模板内容的指纹，页面 ETag 的一部分：部署了新模板或新资源，旧 ETag 全部失效
+build_id = ''
+
+
+def load_manifest():
+    global _manifest
+    try:
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            _manifest = json.load(f)
+    except FileNotFoundError:
+        _manifest = {}
+
+
+def _fingerprint(template_dir):
+    digest = hashlib.sha1(json.dumps(_manifest, sort_keys=True).encode())
+    for root, dirs, files in os.walk(template_dir):
+        dirs.sort()
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def asset_url(name):
+    entry = _manifest.get(name)
+    if entry is None:
+        return url_for('static', filename=name)
+    return url_for('assets.dist', filename=entry['file'])
+
+
+def asset_image_set(name):
+    """背景图的 image-set 写法：支持的浏览器取 WebP，其余仍用前面 background 里的 JPEG。"""
+    entry = _manifest.get(name)
+    if not entry or 'webp' not in entry:
+        return ''
+    mimetype = mimetypes.guess_type(entry['file'])[0]
+    return Markup('background-image: image-set(url("{}") type("image/webp"), url("{}") type("{}"));').format(
+        url_for('assets.dist', filename=entry['webp']), url_for('assets.dist', filename=entry['file']), mimetype)
+
+
+@assets.route('/assets/<path:filename>')
+def dist(filename):
+    if filename == 'manifest.json':
+        abort(404)
+    path = filename
+    encoding = None
+    if filename.endswith(COMPRESS_EXTENSIONS):
+        accepted = request.accept_encodings
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if accepted[candidate] and os.path.exists(os.path.join(DIST_DIR, filename + suffix)):
+                path, encoding = filename + suffix, candidate
+                break
+
+    response = send_from_directory(DIST_DIR, path, mimetype=mimetypes.guess_type(filename)[0],
+                                   max_age=MAX_AGE, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    if filename.endswith(COMPRESS_EXTENSIONS):
+        response.vary.add('Accept-Encoding')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    global build_id
+    load_manifest()
+    build_id = _fingerprint(os.path.join(app.root_path, app.template_folder))
+    app.register_blueprint(assets)
+    app.jinja_env.globals.update(asset_url=asset_url, asset_image_set=asset_image_set)
+
+
+# ===== 构建 =====
+
+def _sources():
+    """[(static 下的相对路径, 内容), ...]，不含 dist 本身；拼进 BUNDLES 的文件不单独输出。"""
+    found = []
+    for root, dirs, files in os.walk(STATIC_DIR):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != DIST_DIR)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                found.append((os.path.relpath(path, STATIC_DIR).replace(os.sep, '/'), f.read()))
+    contents = dict(found)
+    bundled = set()
+    for name, parts in BUNDLES.items():
+        found.append((name, b'\n'.join(_SOURCE_MAP.sub(b'', contents[part]) for part in parts) + b'\n'))
+        bundled.update(parts)
+    found = [(name, data) for name, data in found if name not in bundled]
+    return [(name, _SOURCE_MAP.sub(b'\n', data) if name.endswith(COMPRESS_EXTENSIONS) else data)
+            for name, data in found]
+
+
+def _recompress(data, ext):
+    """(JPEG 或原图, WebP)；没有 Pillow 时原样返回、不生成 WebP。"""
+    try:
+        from io import BytesIO
+        from PIL import Image
+    except ImportError:
+        print('  未安装 Pillow，跳过图片重新压缩和 WebP')
+        return data, None
+    image = Image.open(BytesIO(data))
+    image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    if ext in ('.jpg', '.jpeg'):
+        out = BytesIO()
+        image.convert('RGB').save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        if out.tell() < len(data):
+            data = out.getvalue()
+    webp = BytesIO()
+    image.save(webp, 'WEBP', quality=WEBP_QUALITY, method=6)
+    return data, webp.getvalue()
+
+
+def _write(name, data):
+    with open(os.path.join(DIST_DIR, name), 'wb') as f:
+        f.write(data)
+
+
+def _compress(name, data):
+    _write(name + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        print('  未安装 brotli，只生成 .gz：', name)
+        return
+    _write(name + '.br', brotli.compress(data, quality=11))
+
+
+def build():
+    os.makedirs(DIST_DIR, exist_ok=True)
+    for name in os.listdir(DIST_DIR):
+        os.remove(os.path.join(DIST_DIR, name))
+
+    manifest = {}
+    by_hash = {}
+    for name, data in _sources():
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in by_hash:
+            manifest[name] = by_hash[digest]
+            print('  {} 与 {} 内容相同，共用一个文件'.format(name, by_hash[digest]['file']))
+            continue
+
+        stem, ext = os.path.splitext(os.path.basename(name))
+        ext = ext.lower()
+        entry = {'file': '{}.{}{}'.format(stem, digest[:12], ext)}
+        if ext in IMAGE_EXTENSIONS:
+            data, webp = _recompress(data, ext)
+            if webp is not None:
+                entry['webp'] = '{}.{}.webp'.format(stem, digest[:12])
+                _write(entry['webp'], webp)
+        _write(entry['file'], data)
+        if ext in COMPRESS_EXTENSIONS:
+            _compress(entry['file'], data)
+        manifest[name] = by_hash[digest] = entry
+
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+    for name in sorted(os.listdir(DIST_DIR)):
+        print('  {:<48} {:>8.1f} KB'.format(name, os.path.getsize(os.path.join(DIST_DIR, name)) / 1024))
+    print('✅ 已生成 {} 个资源'.format(len(manifest)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='静态资源构建')
+    parser.add_argument('command', choices=['build'])
+    parser.parse_args(argv)
+    build()
+
+
+if __name__ == '__main__':
+    main()
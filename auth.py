@@ -0,0 +1,59 @@
+# auth.py
+# 登录态：登录时把 PlayerID 一起写进 session（Flask session 是签名 cookie，客户端无法篡改），
+# 请求里通过 load_player() 取当前玩家行，结果缓存在 g.player，同一请求最多查一次数据库。
+from flask import g, session
+
+from db import get_db
+
+# 按主键取玩家；JOIN User 是为了在管理员删除用户后让旧 session 失效
+_PLAYER_BY_ID = """
+    SELECT p.* FROM Player p
+    JOIN User u ON u.UserID = p.UserID
+    WHERE p.PlayerID = ? AND u.UserID = ?
+"""
+
+
+def login_user(conn, user):
+    """写入登录态；玩家账号同时记下 PlayerID。"""
+    session.clear()
+    session['user_id'] = user['UserID']
+    session['username'] = user['Username']
+    session['role'] = user['Role']
+    if user['Role'] == 'player':
+        player = conn.execute("SELECT PlayerID FROM Player WHERE UserID = ?", (user['UserID'],)).fetchone()
+        if player:
+            session['player_id'] = player['PlayerID']
+    g.pop('player', None)
+
+
+def load_player():
+    """当前请求的玩家行（sqlite3.Row），未登录、不是玩家或账号已被删除时返回 None。"""
+    if 'player' in g:
+        return g.player
+
+    player = None
+    if session.get('role') == 'player':
+        conn = get_db()
+        if 'player_id' in session:
+            player = conn.execute(_PLAYER_BY_ID, (session['player_id'], session['user_id'])).fetchone()
+        else:
+            # 旧版本登录的 session 里没有 PlayerID，补查一次后写回
+            player = conn.execute("""
+                SELECT p.* FROM Player p
+                JOIN User u ON u.UserID = p.UserID
+                WHERE p.UserID = ?
+            """, (session['user_id'],)).fetchone()
+            if player:
+                session['player_id'] = player['PlayerID']
+        if player is None:
+            # 用户已被删除，登录态作废
+            session.clear()
+
+    g.player = player
+    return player
+
+
+def refresh_player():
+    """丢弃本请求缓存的玩家行并重新读取（操作改了金币、时钟之后用）。"""
+    g.pop('player', None)
+    return load_player()
@@ -0,0 +1,560 @@
+# benchmark.py
+# 压测工具：生成一个带大量合成玩家的数据库，按真实比例回放 注册/登录/主页/种植/浇水/下一天/收获/商店/订单
+# 等请求，统计每个路由的 p50/p95/p99 延迟、吞吐量和 SQLite 写锁等待次数，结果写成 JSON 方便不同提交之间对比。
+#
+# 用法：
+#   python benchmark.py --users 2000 --plots 6 --duration 30 --concurrency 8            # Flask test client（进程内）
+#   python benchmark.py --users 2000 --gunicorn --workers 4 --duration 30               # 启动 gunicorn 走真实 HTTP
+#   python benchmark.py --url http://127.0.0.1:8000 --db farm_game.db --skip-populate   # 压已经在跑的服务
+#   python benchmark.py ... --output after.json --compare before.json                   # 与上一次结果对比
+#   python benchmark.py --users 2000 --inventory 20 --render 300                         # 模板编译 / 片段缓存前后的渲染耗时
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from werkzeug.security import generate_password_hash
+
+import economy
+import init_db
+import migrations
+import passwords
+
+BENCH_PASSWORD = 'bench'
+
+# (动作名, 权重)
+TRAFFIC_MIX = [
+    ('dashboard', 30),
+    ('water', 12),
+    ('shop', 8),
+    ('next_day', 8),
+    ('orders', 6),
+    ('shop_buy', 6),
+    ('plant', 5),
+    ('harvest', 5),
+    ('plant_all', 4),
+    ('water_all', 4),
+    ('login', 3),
+    ('complete_order', 2),
+    ('register', 1),
+]
+
+# 超过这个耗时的写语句记为一次写锁等待（进程内模式）
+LOCK_WAIT_MS = 5.0
+
+
+# ===== 生成合成数据 =====
+
+def populate(path, users, plots_per_player, inventory_rows, orders, seed=0):
+    """用 init_db 的表结构建库，再批量插入合成玩家、地块、库存和订单。"""
+    rng = random.Random(seed)
+    init_db.DB_NAME = path
+    init_db.initialize_database()
+
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    migrations.migrate(conn)
+
+    items = {row['ItemName']: row['ItemID'] for row in conn.execute("SELECT ItemID, ItemName FROM Item")}
+    item_ids = list(items.values())
+    plants = conn.execute("SELECT PlantID, BaseGrowthTime FROM Plant WHERE SeedItemID IS NOT NULL").fetchall()
+    villager_ids = [row[0] for row in conn.execute("SELECT VillagerID FROM Villager")]
+
+    # 所有合成账号共用一个密码哈希，避免建库时反复计算；参数与当前配置一致，登录时不会触发重新哈希
+    pw_hash = generate_password_hash(BENCH_PASSWORD, passwords.HASH_METHOD, passwords.SALT_LENGTH)
+    first_user = conn.execute("SELECT COALESCE(MAX(UserID), 0) + 1 FROM User").fetchone()[0]
+    first_player = conn.execute("SELECT COALESCE(MAX(PlayerID), 0) + 1 FROM Player").fetchone()[0]
+
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO User (UserID, Username, Password, Role) VALUES (?, ?, ?, 'player')",
+                     ((first_user + i, 'bench_{}'.format(i), pw_hash) for i in range(users)))
+    gold = [rng.randint(100, 5000) for _ in range(users)]
+    conn.executemany("INSERT INTO Player (PlayerID, CurrentGold, UserID) VALUES (?, ?, ?)",
+                     ((first_player + i, gold[i], first_user + i) for i in range(users)))
+    economy.record(conn, [(first_player + i, gold[i], economy.reference('register')) for i in range(users)])
+
+    def plot_rows():
+        for i in range(users):
+            for _ in range(plots_per_player):
+                if rng.random() < 0.6:
+                    plant = rng.choice(plants)
+                    yield (first_player + i, 'Growing', plant['PlantID'],
+                           -rng.randint(0, plant['BaseGrowthTime']), rng.randint(0, 20))
+                else:
+                    yield (first_player + i, 'Empty', None, None, 0)
+    conn.executemany("""
+        INSERT INTO Plot (PlayerID, Status, PlantedPlantID, PlantedAt, WaterBonus)
+        VALUES (?, ?, ?, ?, ?)
+    """, plot_rows())
+
+    def inventory_rows_for_all():
+        for i in range(users):
+            chosen = rng.sample(item_ids, min(inventory_rows, len(item_ids)))
+            for item_id in chosen:
+                yield (first_player + i, item_id, rng.randint(0, 50))
+    conn.executemany("INSERT INTO Inventory (PlayerID, ItemID, Quantity) VALUES (?, ?, ?)",
+                     inventory_rows_for_all())
+
+    conn.executemany("""
+        INSERT INTO VillagerOrder (VillagerID, RequiredItemID, RequiredQuantity, RewardGold, RewardAffection)
+        VALUES (?, ?, ?, ?, ?)
+    """, ((rng.choice(villager_ids), rng.choice(item_ids), rng.randint(1, 5),
+           rng.randint(10, 100), rng.randint(1, 10)) for _ in range(orders)))
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def load_layout(path):
+    """读取压测需要的 ID：合成账号、每个玩家的地块、可完成的订单。"""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    accounts = [row['Username'] for row in conn.execute(
+        "SELECT Username FROM User WHERE Username LIKE 'bench\\_%' ESCAPE '\\'")]
+    plots = {}
+    for row in conn.execute("""
+        SELECT u.Username, p.PlotID FROM Plot p
+        JOIN Player pl ON pl.PlayerID = p.PlayerID
+        JOIN User u ON u.UserID = pl.UserID
+        WHERE u.Username LIKE 'bench\\_%' ESCAPE '\\'
+    """):
+        plots.setdefault(row['Username'], []).append(row['PlotID'])
+    orders = [row[0] for row in conn.execute("SELECT OrderID FROM VillagerOrder WHERE Status = 'Available'")]
+    water = conn.execute("SELECT ItemID FROM Item WHERE ItemName = '水滴'").fetchone()
+    plant = conn.execute("SELECT PlantID FROM Plant WHERE SeedItemID IS NOT NULL ORDER BY PlantID").fetchone()
+    conn.close()
+    return {
+        'accounts': accounts,
+        'plots': plots,
+        'orders': orders,
+        'water_item_id': water[0] if water else 1,
+        'plant_id': plant[0] if plant else 1,
+    }
+
+
+# ===== 请求客户端 =====
+
+class TestClientTransport:
+    """进程内：Flask test client，不跟随重定向。"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpTransport:
+    """HTTP：每个虚拟用户一个 cookie jar，不跟随重定向。"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+# ===== 统计 =====
+
+# 写锁等待按线程累计，每个请求结束后归到对应的路由上
+_lock_waits = threading.local()
+
+
+def add_lock_wait():
+    _lock_waits.count = getattr(_lock_waits, 'count', 0) + 1
+
+
+def take_lock_waits():
+    count = getattr(_lock_waits, 'count', 0)
+    _lock_waits.count = 0
+    return count
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.lock_waits = {}
+
+    def record(self, route, elapsed_ms, ok, lock_waits):
+        with self.lock:
+            self.latencies.setdefault(route, []).append(elapsed_ms)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+            if lock_waits:
+                self.lock_waits[route] = self.lock_waits.get(route, 0) + lock_waits
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(stats, elapsed_s):
+    routes = {}
+    total = 0
+    for route, values in sorted(stats.latencies.items()):
+        values = sorted(values)
+        total += len(values)
+        routes[route] = {
+            'count': len(values),
+            'errors': stats.errors.get(route, 0),
+            'lock_waits': stats.lock_waits.get(route, 0),
+            'rps': round(len(values) / elapsed_s, 2),
+            'mean_ms': round(sum(values) / len(values), 3),
+            'p50_ms': round(percentile(values, 50), 3),
+            'p95_ms': round(percentile(values, 95), 3),
+            'p99_ms': round(percentile(values, 99), 3),
+            'max_ms': round(values[-1], 3),
+        }
+    return {
+        'elapsed_s': round(elapsed_s, 3),
+        'requests': total,
+        'rps': round(total / elapsed_s, 2) if elapsed_s else 0,
+        'errors': sum(stats.errors.values()),
+        'lock_waits': sum(stats.lock_waits.values()),
+        'routes': routes,
+    }
+
+
+# ===== 虚拟用户 =====
+
+class VirtualUser:
+    def __init__(self, transport, layout, username, rng):
+        self.transport = transport
+        self.layout = layout
+        self.username = username
+        self.rng = rng
+
+    def action(self, name):
+        """返回 (method, path, form) 。"""
+        rng = self.rng
+        plots = self.layout['plots'].get(self.username) or [0]
+        if name == 'dashboard':
+            return 'GET', '/player/dashboard', None
+        if name == 'shop':
+            return 'GET', '/shop', None
+        if name == 'shop_buy':
+            return 'POST', '/shop/buy/{}'.format(self.layout['water_item_id']), {'quantity': rng.randint(1, 5)}
+        if name == 'plant':
+            return 'GET', '/plant', None
+        if name == 'plant_all':
+            return 'POST', '/plant_all', {'plant_id': self.layout['plant_id']}
+        if name == 'water':
+            return 'POST', '/water/{}'.format(rng.choice(plots)), None
+        if name == 'water_all':
+            return 'POST', '/water_all', None
+        if name == 'next_day':
+            return 'POST', '/next_day', None
+        if name == 'harvest':
+            return 'POST', '/harvest_all', None
+        if name == 'orders':
+            return 'GET', '/orders', None
+        if name == 'complete_order':
+            order_id = rng.choice(self.layout['orders']) if self.layout['orders'] else 0
+            return 'POST', '/orders/complete/{}'.format(order_id), None
+        if name == 'login':
+            return 'POST', '/login', {'username': self.username, 'password': BENCH_PASSWORD}
+        if name == 'register':
+            return 'POST', '/register', {'username': 'bench_new_{}_{}'.format(os.getpid(), rng.getrandbits(48)),
+                                         'password': BENCH_PASSWORD}
+        raise ValueError(name)
+
+
+def run_user(make_transport, layout, stats, deadline, max_requests, seed, counter):
+    rng = random.Random(seed)
+    names = [name for name, _ in TRAFFIC_MIX]
+    weights = [weight for _, weight in TRAFFIC_MIX]
+    transport = make_transport()
+    user = VirtualUser(transport, layout, rng.choice(layout['accounts']), rng)
+
+    transport.request('POST', '/login', {'username': user.username, 'password': BENCH_PASSWORD})
+    while time.monotonic() < deadline:
+        with counter['lock']:
+            if max_requests and counter['sent'] >= max_requests:
+                return
+            counter['sent'] += 1
+        name = rng.choices(names, weights)[0]
+        method, path, form = user.action(name)
+        take_lock_waits()
+        started = time.perf_counter()
+        try:
+            status = transport.request(method, path, form)
+            ok = status < 500
+        except sqlite3.OperationalError:
+            ok = False
+            add_lock_wait()
+        except Exception:
+            ok = False
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        stats.record(name, elapsed_ms, ok, take_lock_waits())
+
+
+def run_load(make_transport, layout, concurrency, duration, max_requests, seed):
+    stats = Stats()
+    counter = {'lock': threading.Lock(), 'sent': 0}
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=run_user,
+                                args=(make_transport, layout, stats, deadline, max_requests, seed + i, counter))
+               for i in range(concurrency)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return stats, time.monotonic() - started
+
+
+def make_timed_connection():
+    """记录写语句耗时的连接类：超过 LOCK_WAIT_MS 的写语句计为一次锁等待。"""
+    import metrics
+    write_prefixes = ('BEGIN IMMEDIATE', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+    # 继承 metrics 的连接类，压测时 /admin/metrics 的 SQL 统计照常工作
+    class TimedConnection(metrics.InstrumentedConnection):
+        def execute(self, sql, *args):
+            if not sql.lstrip().upper().startswith(write_prefixes):
+                return super().execute(sql, *args)
+            started = time.perf_counter()
+            try:
+                return super().execute(sql, *args)
+            finally:
+                if (time.perf_counter() - started) * 1000 > LOCK_WAIT_MS:
+                    add_lock_wait()
+
+    return TimedConnection
+
+
+def wait_for_server(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url + '/login', timeout=2).read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn 未能在 {} 秒内启动'.format(timeout))
+
+
+# ===== 渲染 =====
+
+def _timings(fn, rounds):
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {'mean_ms': round(sum(samples) / len(samples), 3), 'p50_ms': round(percentile(samples, 50), 3),
+            'p95_ms': round(percentile(samples, 95), 3)}
+
+
+def run_render(app, layout, rounds):
+    """模板编译（有无字节码缓存）和页面渲染（片段缓存关 / 开）的耗时对比。"""
+    from jinja2 import FileSystemBytecodeCache
+
+    import fragments
+
+    names = app.jinja_env.list_templates()
+
+    def compile_all(bytecode_cache):
+        env = app.create_jinja_environment()
+        env.add_extension(fragments.FragmentCacheExtension)
+        env.bytecode_cache = bytecode_cache
+        for name in names:
+            env.get_template(name)
+
+    bytecode_cache = FileSystemBytecodeCache(tempfile.mkdtemp(prefix='farm-bench-jinja-'))
+    compile_all(bytecode_cache)   # 写入字节码
+    results = {
+        'compile': {
+            'templates': len(names),
+            'no_bytecode_cache': _timings(lambda: compile_all(None), max(1, rounds // 10)),
+            'bytecode_cache': _timings(lambda: compile_all(bytecode_cache), max(1, rounds // 10)),
+        },
+        'pages': {},
+    }
+
+    player = app.test_client()
+    player.post('/login', data={'username': layout['accounts'][0], 'password': BENCH_PASSWORD})
+    admin = app.test_client()
+    admin.post('/login', data={'username': 'admin', 'password': '123'})
+    for route, client, path in (('dashboard', player, '/player/dashboard'), ('admin', admin, '/admin/dashboard')):
+        page = {}
+        for label, enabled in (('fragment_cache_off', False), ('fragment_cache_on', True)):
+            fragments.ENABLED = enabled
+            fragments.cache.clear()
+            client.get(path)
+            page[label] = _timings(lambda: client.get(path), rounds)
+        results['pages'][route] = page
+    fragments.ENABLED = True
+    return results
+
+
+def print_render_report(results):
+    compile_ = results['compile']
+    print('\n编译 {} 个模板：无字节码缓存 {:.2f} ms，有字节码缓存 {:.2f} ms'.format(
+        compile_['templates'], compile_['no_bytecode_cache']['mean_ms'], compile_['bytecode_cache']['mean_ms']))
+    print('{:<12} {:>14} {:>14} {:>14} {:>14}'.format('page', 'off p50 ms', 'on p50 ms', 'off p95 ms', 'on p95 ms'))
+    for route, page in results['pages'].items():
+        off, on = page['fragment_cache_off'], page['fragment_cache_on']
+        print('{:<12} {:>14} {:>14} {:>14} {:>14}'.format(route, off['p50_ms'], on['p50_ms'], off['p95_ms'], on['p95_ms']))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print('\n与 {} 对比（p95，负数为变快）：'.format(baseline_path))
+    for route, now in current['results']['routes'].items():
+        before = baseline.get('results', {}).get('routes', {}).get(route)
+        if not before or not before['p95_ms']:
+            continue
+        change = (now['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+        print('  {:<16} {:>9.2f} ms -> {:>9.2f} ms  {:+.1f}%'.format(route, before['p95_ms'], now['p95_ms'], change))
+
+
+def print_report(results):
+    print('\n{:<16} {:>7} {:>6} {:>6} {:>9} {:>9} {:>9} {:>9}'.format(
+        'route', 'count', 'err', 'lockw', 'rps', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for route, r in results['routes'].items():
+        print('{:<16} {:>7} {:>6} {:>6} {:>9} {:>9} {:>9} {:>9}'.format(
+            route, r['count'], r['errors'], r['lock_waits'], r['rps'], r['p50_ms'], r['p95_ms'], r['p99_ms']))
+    print('total: {} requests in {}s, {} req/s, {} errors, {} lock waits'.format(
+        results['requests'], results['elapsed_s'], results['rps'], results['errors'], results['lock_waits']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='种田游戏压测')
+    parser.add_argument('--db', help='数据库路径（默认在临时目录生成）')
+    parser.add_argument('--skip-populate', action='store_true', help='直接使用 --db 指定的已有数据库')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--plots', type=int, default=4, help='每个玩家的地块数')
+    parser.add_argument('--inventory', type=int, default=3, help='每个玩家的库存行数')
+    parser.add_argument('--orders', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=20, help='压测秒数')
+    parser.add_argument('--requests', type=int, default=0, help='最多发送的请求数（0 表示只按时长）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help='压测已经运行的服务，例如 http://127.0.0.1:8000')
+    parser.add_argument('--gunicorn', action='store_true', help='启动 gunicorn 并通过 HTTP 压测')
+    parser.add_argument('--workers', type=int, default=2, help='--gunicorn 时的 worker 数')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='与之前的结果文件对比')
+    parser.add_argument('--render', type=int, default=0, metavar='N',
+                        help='不压测，改为测量模板编译和玩家主页 / 管理后台各渲染 N 次的耗时')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='farm-bench-')
+    db_path = os.path.abspath(args.db or os.path.join(workdir, 'farm_game.db'))
+    if not args.skip_populate:
+        started = time.monotonic()
+        populate(db_path, args.users, args.plots, args.inventory, args.orders, args.seed)
+        print('生成合成数据：{} 个玩家，用时 {:.1f}s -> {}'.format(args.users, time.monotonic() - started, db_path))
+    layout = load_layout(db_path)
+    if not layout['accounts']:
+        sys.exit('数据库里没有 bench_* 账号，请先生成合成数据')
+
+    if args.render:
+        os.environ.setdefault('WORLD_SCHEDULER', 'off')
+        import db
+        db.DB_PATH = db_path
+        from app import app
+        results = run_render(app, layout, args.render)
+        print_render_report(results)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'mode': 'render',
+                       'config': {'users': args.users, 'plots': args.plots, 'inventory': args.inventory,
+                                  'rounds': args.render},
+                       'render': results}, f, ensure_ascii=False, indent=2)
+        print('结果已写入 {}'.format(args.output))
+        return
+
+    server = None
+    if args.gunicorn:
+        args.url = 'http://127.0.0.1:{}'.format(args.port)
+        env = dict(os.environ, FARM_DB_PATH=db_path, WORLD_SCHEDULER='off')
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '-b', '127.0.0.1:{}'.format(args.port),
+             '--chdir', os.path.dirname(os.path.abspath(__file__)), 'app:app'], env=env)
+        wait_for_server(args.url)
+
+    try:
+        if args.url:
+            mode = 'http'
+            make_transport = lambda: HttpTransport(args.url)
+            stats, elapsed = run_load(make_transport, layout, args.concurrency, args.duration, args.requests, args.seed)
+        else:
+            mode = 'test_client'
+            os.environ.setdefault('WORLD_SCHEDULER', 'off')
+            import db
+            db.DB_PATH = db_path
+            db.connection_factory = make_timed_connection()
+            from app import app
+            app.config['TESTING'] = True
+            make_transport = lambda: TestClientTransport(app)
+            stats, elapsed = run_load(make_transport, layout, args.concurrency, args.duration, args.requests, args.seed)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    results = summarize(stats, elapsed)
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'mode': mode,
+        'config': {
+            'users': args.users, 'plots': args.plots, 'inventory': args.inventory, 'orders': args.orders,
+            'concurrency': args.concurrency, 'duration': args.duration, 'requests': args.requests,
+            'workers': args.workers if args.gunicorn else None, 'seed': args.seed,
+        },
+        'results': results,
+    }
+    print_report(results)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print('结果已写入 {}'.format(args.output))
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# catalog.py
+# 静态配置表（Plant / Item / ShopItem / Villager / StarterKit）的进程内只读缓存。
+# 这些表只会被 /admin 下的管理路由修改，修改后调用 bump_version() 把 CacheVersion 表
+# 中的版本号 +1；每个 worker 在每个请求里读一次版本号，发现变化就整体重新加载。
+import threading
+
+from flask import g
+
+from db import get_db
+
+CATALOG_KEY = 'catalog'
+# 可接订单列表的版本号：订单完成 / 过期时 +1，/orders 页面的 ETag 用它判断是否变化
+ORDERS_KEY = 'orders'
+# 用户表的版本号：增删用户、改用户名 / 角色时由触发器 +1，管理后台用户列表的片段缓存用它
+USERS_KEY = 'users'
+
+SEED_SUFFIX = '种子'
+WATER_ITEM_NAME = '水滴'
+
+
+class Catalog:
+    def __init__(self, version, plants, items, shop_items, villagers, starter_kit=()):
+        self.version = version
+
+        self.plants = {p['PlantID']: p for p in plants}
+        self.plants_by_name = {p['PlantName']: p for p in plants}
+
+        self.items = {i['ItemID']: i for i in items}
+        self.items_by_name = {i['ItemName']: i for i in items}
+
+        # 商店列表保持 ItemID 顺序，附带物品名方便模板直接使用
+        self.shop_items = [
+            {'ItemID': s['ItemID'], 'ItemName': self.items[s['ItemID']]['ItemName'], 'SellPrice': s['SellPrice']}
+            for s in shop_items if s['ItemID'] in self.items
+        ]
+        self.shop_prices = {s['ItemID']: s['SellPrice'] for s in self.shop_items}
+
+        self.villagers = {v['VillagerID']: v for v in villagers}
+
+        # 新玩家初始物品 [(ItemID, Quantity), ...]
+        self.starter_kit = [(k['ItemID'], k['Quantity']) for k in starter_kit if k['ItemID'] in self.items]
+
+        # 种子物品 -> 植物，来自 Plant.SeedItemID
+        self.plants_by_seed_item = {p['SeedItemID']: p for p in plants if p['SeedItemID'] is not None}
+        self.plants_by_seed_name = {
+            self.items[item_id]['ItemName']: p
+            for item_id, p in self.plants_by_seed_item.items() if item_id in self.items
+        }
+
+    def plant(self, plant_id):
+        try:
+            return self.plants.get(int(plant_id))
+        except (TypeError, ValueError):
+            return None
+
+    def item_by_name(self, name):
+        return self.items_by_name.get(name)
+
+    def plant_for_seed(self, item_id):
+        return self.plants_by_seed_item.get(item_id)
+
+    def seed_for_plant(self, plant_id):
+        plant = self.plant(plant_id)
+        if not plant or plant['SeedItemID'] is None:
+            return None
+        return self.items.get(plant['SeedItemID'])
+
+    def produce_for_plant(self, plant_id):
+        plant = self.plant(plant_id)
+        if not plant or plant['ProduceItemID'] is None:
+            return None
+        return self.items.get(plant['ProduceItemID'])
+
+    @property
+    def water_item_id(self):
+        item = self.items_by_name.get(WATER_ITEM_NAME)
+        return item['ItemID'] if item else None
+
+
+_catalog = None
+_lock = threading.Lock()
+
+
+def read_version(conn, name=CATALOG_KEY):
+    row = conn.execute("SELECT Version FROM CacheVersion WHERE Name = ?", (name,)).fetchone()
+    return row['Version'] if row else 0
+
+
+def bump_version(conn, name=CATALOG_KEY):
+    """在调用方的事务里把版本号 +1，随调用方一起提交。"""
+    conn.execute("""
+        INSERT INTO CacheVersion (Name, Version) VALUES (?, 1)
+        ON CONFLICT(Name) DO UPDATE SET Version = CacheVersion.Version + 1
+    """, (name,))
+
+
+def load(conn, version):
+    return Catalog(
+        version,
+        conn.execute("SELECT * FROM Plant ORDER BY PlantID").fetchall(),
+        conn.execute("SELECT * FROM Item ORDER BY ItemID").fetchall(),
+        conn.execute("SELECT * FROM ShopItem ORDER BY ItemID").fetchall(),
+        conn.execute("SELECT * FROM Villager ORDER BY VillagerID").fetchall(),
+        conn.execute("SELECT * FROM StarterKit ORDER BY ItemID").fetchall(),
+    )
+
+
+def get_catalog():
+    """返回当前版本的目录缓存；同一请求内只检查一次版本号。
+
+    只读页面可能从落后的快照读到旧版本号：这时按快照加载一份只给本次请求用，不替换缓存，
+    否则快照请求和主库请求交替到达时缓存会在新旧版本之间来回重新加载。
+    """
+    global _catalog
+    if 'catalog' in g:
+        return g.catalog
+
+    conn = get_db()
+    version = read_version(conn)
+    catalog = _catalog
+    if catalog is None or catalog.version < version:
+        with _lock:
+            catalog = _catalog
+            if catalog is None or catalog.version < version:
+                catalog = load(conn, version)
+                _catalog = catalog
+    if catalog.version > version:
+        catalog = load(conn, version)
+    g.catalog = catalog
+    return catalog
+
+
+def link_plant_items(conn):
+    """按 “<植物名>种子” / “<植物名>” 的命名约定补齐 Plant 上缺失的种子、产物关联。"""
+    conn.execute("""
+        UPDATE Plant SET
+            SeedItemID = COALESCE(SeedItemID, (SELECT ItemID FROM Item WHERE ItemName = Plant.PlantName || ?)),
+            ProduceItemID = COALESCE(ProduceItemID, (SELECT ItemID FROM Item WHERE ItemName = Plant.PlantName))
+        WHERE SeedItemID IS NULL OR ProduceItemID IS NULL
+    """, (SEED_SUFFIX,))
+
+
+def unlink_item(conn, item_id):
+    """删除物品前解除植物和初始物品表对它的引用。"""
+    conn.execute("UPDATE Plant SET SeedItemID = NULL WHERE SeedItemID = ?", (item_id,))
+    conn.execute("UPDATE Plant SET ProduceItemID = NULL WHERE ProduceItemID = ?", (item_id,))
+    conn.execute("DELETE FROM StarterKit WHERE ItemID = ?", (item_id,))
+
+
+def invalidate(conn):
+    """管理路由写完目录表后调用：更新共享版本号并让本请求后续读取到新数据。"""
+    bump_version(conn)
+    g.pop('catalog', None)
@@ -0,0 +1,102 @@
+# concurrency.py
+# 乐观并发控制：Plot / Inventory / Player 各有一个 Version 列，所有写入这三张表的 UPDATE
+# 都要同时 Version = Version + 1。先读后写的操作（单块地浇水、种植、收获）读行时带上 Version，
+# 写回时用 WHERE ... AND Version = ? 做比较并交换（CAS）：中间被别的请求改过就影响 0 行，
+# 抛出 Conflict，run() 回滚后重新读、重新判断，最多重试 OCC_MAX_RETRIES 次。
+# 同一个玩家连点两下、多开标签页时，第二次操作会看到第一次的结果，库存不会扣成负数，地块也不会收获两次。
+#
+# 读阶段用普通的 BEGIN（不抢写锁），只有真正写的时候才需要写锁。SQLite WAL 模式下，
+# 读过快照的事务在别人提交之后再写会直接得到 SQLITE_BUSY（busy_timeout 等不来），
+# 这种情况同样回滚整个操作，按指数退避 + 随机抖动等一会再重试。
+#
+# 冲突次数、重试用尽次数、BUSY 退避次数按操作名统计，由 metrics 汇总到 /admin/metrics 和 /metrics。
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import db
+
+MAX_RETRIES = int(os.environ.get('OCC_MAX_RETRIES', 3))
+BUSY_RETRIES = int(os.environ.get('DB_BUSY_RETRIES', 5))
+BUSY_BACKOFF_MS = float(os.environ.get('DB_BUSY_BACKOFF_MS', 5))
+BUSY_BACKOFF_MAX_MS = float(os.environ.get('DB_BUSY_BACKOFF_MAX_MS', 200))
+
+# serialization_failure / deadlock_detected / lock_not_available
+_PG_BUSY_CODES = ('40001', '40P01', '55P03')
+
+_lock = threading.Lock()
+_counters = {}
+
+
+class Conflict(Exception):
+    """CAS 更新影响 0 行：读到的版本已经被别的事务改掉了。"""
+
+
+class RetriesExhausted(Exception):
+    pass
+
+
+def expect(cur, table):
+    """CAS 语句之后调用：没有恰好更新一行就抛出 Conflict。"""
+    if cur.rowcount != 1:
+        raise Conflict(table)
+    return cur
+
+
+def is_busy(exc):
+    """数据库被别的写事务锁住：SQLite 的 database is locked / busy，PostgreSQL 的锁超时、序列化失败。"""
+    if isinstance(exc, sqlite3.OperationalError):
+        message = str(exc)
+        return 'locked' in message or 'busy' in message
+    return isinstance(exc, db.OperationalError) and getattr(exc, 'pgcode', None) in _PG_BUSY_CODES
+
+
+def backoff(attempt):
+    """第 attempt 次重试前等待的秒数：指数增长，带 50%～100% 的随机抖动，避免多个请求同时重试。"""
+    delay = min(BUSY_BACKOFF_MAX_MS, BUSY_BACKOFF_MS * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0) / 1000
+
+
+def _count(name, key):
+    with _lock:
+        entry = _counters.get(name)
+        if entry is None:
+            entry = _counters[name] = {'attempts': 0, 'conflicts': 0, 'exhausted': 0, 'busy': 0}
+        entry[key] += 1
+
+
+def run(conn, name, action, max_retries=MAX_RETRIES, busy_retries=BUSY_RETRIES):
+    """在事务里执行 action()，遇到版本冲突或数据库忙时回滚重试，成功时提交并返回 action() 的结果。
+
+    action 必须在每次调用时重新读取数据；它抛出的其它异常（如 GameError）直接回滚并向上抛。
+    冲突重试用尽时抛出 RetriesExhausted。
+    """
+    conflicts = busy = 0
+    while True:
+        _count(name, 'attempts')
+        conn.execute("BEGIN")
+        try:
+            result = action()
+            conn.commit()
+            return result
+        except Conflict:
+            conn.rollback()
+            _count(name, 'conflicts')
+            conflicts += 1
+            if conflicts > max_retries:
+                _count(name, 'exhausted')
+                raise RetriesExhausted(name)
+        except Exception as e:
+            conn.rollback()
+            if not is_busy(e) or busy >= busy_retries:
+                raise
+            _count(name, 'busy')
+            time.sleep(backoff(busy))
+            busy += 1
+
+
+def stats():
+    with _lock:
+        return {name: dict(entry) for name, entry in _counters.items()}
@@ -0,0 +1,211 @@
+# db.py
+# 数据库连接层：每个 worker 进程维护一个连接池，连接绑定到 Flask 的 g 上，
+# 请求结束（teardown）时归还连接池，而不是每次 get_db() 都重新 connect。
+# 后端由 DATABASE_URL 决定：sqlite:///farm_game.db（默认）或 postgresql://...（见 postgres.py）。
+import os
+import sqlite3
+import threading
+import urllib.parse
+
+from flask import g
+
+import postgres
+
+DATABASE_URL = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.environ.get('FARM_DB_PATH', 'farm_game.db')
+
+
+def parse_url(url):
+    """返回 (后端名, SQLite 文件路径或原 URL)。sqlite:///相对路径，sqlite:////绝对路径。"""
+    if url.startswith('sqlite:///'):
+        return 'sqlite', url[len('sqlite:///'):]
+    if url.startswith(('postgres://', 'postgresql://')):
+        return 'postgresql', url
+    raise ValueError('不支持的 DATABASE_URL：{}'.format(url))
+
+
+BACKEND, _target = parse_url(DATABASE_URL)
+DB_PATH = _target if BACKEND == 'sqlite' else os.environ.get('FARM_DB_PATH', 'farm_game.db')
+
+# 两种后端的异常，业务代码统一 except db.Error / db.IntegrityError
+_pg_errors = postgres.error_classes()
+Error = (sqlite3.Error,) + _pg_errors[0]
+IntegrityError = (sqlite3.IntegrityError,) + _pg_errors[1]
+OperationalError = (sqlite3.OperationalError,) + _pg_errors[2]
+
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+# NORMAL：WAL 模式下进程崩溃不丢已提交事务，断电可能丢最后几次提交；FULL：每次提交都 fsync。
+# FULL 时建议配合 WRITE_BEHIND=on（writebehind.py），一批操作只 fsync 一次
+SYNCHRONOUS = os.environ.get('DB_SYNCHRONOUS', 'NORMAL').upper()
+BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+
+# 每个新连接都会执行的 PRAGMA（journal_mode=WAL 是持久化到数据库文件的，设置一次即可，
+# 重复执行代价很小）
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = {}".format(SYNCHRONOUS),
+    "PRAGMA cache_size = -16000",      # 约 16MB 页缓存（负数单位为 KB）
+    "PRAGMA mmap_size = 134217728",    # 128MB 内存映射读
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = {}".format(BUSY_TIMEOUT_MS),
+)
+
+
+# 连接类，压测 / 监控可以换成 sqlite3.Connection 的子类来统计语句耗时
+connection_factory = sqlite3.Connection
+
+
+def connect(path=None):
+    """新建一个连接：指定 path 时总是打开该 SQLite 文件，否则按 DATABASE_URL。"""
+    if path is None and BACKEND == 'postgresql':
+        return postgres.connect(DATABASE_URL, BUSY_TIMEOUT_MS)
+    conn = sqlite3.connect(path or DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000,
+                           check_same_thread=False, factory=connection_factory)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def connect_readonly(path=None):
+    """只读连接（SQLite 文件以 mode=ro 打开，并设置 query_only），给只读路由和快照用（见 replica.py）。"""
+    conn = sqlite3.connect('file:{}?mode=ro'.format(urllib.parse.quote(os.path.abspath(path or DB_PATH))),
+                           uri=True, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                           factory=connection_factory)
+    conn.row_factory = sqlite3.Row
+    # 只读连接不能改 journal_mode / synchronous，其余 PRAGMA 照常
+    for pragma in PRAGMAS[2:] + ("PRAGMA query_only = 1",):
+        conn.execute(pragma)
+    return conn
+
+
+def reserve_ids(conn, table, column, count):
+    """在调用方的写事务里为 table 预留 count 个自增 ID（已删除的 ID 不会被复用）。"""
+    if not isinstance(conn, sqlite3.Connection):
+        return postgres.reserve_ids(conn, table, column, count)
+    # SQLite AUTOINCREMENT：取现有最大值和 sqlite_sequence 中较大者
+    row = conn.execute("""
+        SELECT MAX(x) FROM (
+            SELECT MAX({column}) AS x FROM {table}
+            UNION ALL
+            SELECT seq FROM sqlite_sequence WHERE name = ?
+        )
+    """.format(table=table, column=column), (table,)).fetchone()
+    first = (row[0] or 0) + 1
+    return list(range(first, first + count))
+
+
+class ConnectionPool:
+    """简单的 LIFO 连接池，线程安全，统计命中/未命中次数。"""
+
+    def __init__(self, path, size, opener=None):
+        self.path = path
+        self.size = size
+        self.opener = opener or connect
+        self.pid = os.getpid()
+        self._idle = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+            self.misses += 1
+        return self.opener(self.path)
+
+    def release(self, conn):
+        # 路由提前 return 时可能留下未提交的事务，归还前统一回滚
+        try:
+            if getattr(conn, 'closed', False):
+                raise sqlite3.OperationalError('connection closed')
+            if conn.in_transaction:
+                conn.rollback()
+        except Error:
+            conn.close()
+            with self._lock:
+                self.discarded += 1
+            return
+
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self.discarded += 1
+        conn.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def retire(self):
+        """不再使用这个池：关闭空闲连接，之后归还的连接也直接关闭。"""
+        self.size = 0
+        self.close_all()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'pid': self.pid,
+                'size': self.size,
+                'idle': len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'discarded': self.discarded,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # gunicorn fork 出的 worker 不能复用父进程的连接，按 pid 重新建池
+    global _pool
+    pid = os.getpid()
+    if _pool is None or _pool.pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool.pid != pid:
+                _pool = ConnectionPool(DB_PATH if BACKEND == 'sqlite' else None, POOL_SIZE)
+    return _pool
+
+
+# replica.init_app 设置：返回当前请求应使用的只读连接池，None 表示用主库连接池
+read_pool_for_request = None
+
+
+def get_db(primary=False):
+    """返回当前请求/应用上下文绑定的连接，同一请求内多次调用复用同一个连接。
+
+    primary=True 总是从主库连接池取（启动时的迁移、预热等要写库或不在请求里的调用）。
+    """
+    if 'db' not in g:
+        pool = None
+        if not primary and read_pool_for_request is not None:
+            pool = read_pool_for_request()
+        pool = pool or get_pool()
+        g.db = pool.acquire()
+        g.db_pool = pool
+    elif primary and g.db_pool is not get_pool():
+        raise RuntimeError('当前上下文已经绑定了只读连接')
+    return g.db
+
+
+def close_db(exc=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        g.pop('db_pool', get_pool()).release(conn)
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
@@ -0,0 +1,168 @@
+# economy.py
+# 金币账本：所有金币变动都经过这里，在调用方的事务里同时
+#   - 追加 GoldTransaction 流水（executemany，一次操作多条也只发一条语句）；
+#   - 更新 Player.CurrentGold（余额快照，页面读它，不用每次汇总流水）。
+# 流水的 Amount 为正数，方向看 Type：Income 加、Expense 减；Adjustment（开户余额、对账修正）带符号。
+# SourceReference 用 reference() 生成 "类型:编号" 形式，如 order:12、harvest:plot:7。
+#
+# 对账：python economy.py reconcile
+# 每个玩家在 LedgerCheckpoint 里记着"已核对到哪条流水、当时的流水余额"，
+# 每次只汇总检查点之后新增的流水，再和 CurrentGold 比较，不做全表 SUM。
+import argparse
+import sys
+import time
+
+import db
+
+INCOME = 'Income'
+EXPENSE = 'Expense'
+ADJUSTMENT = 'Adjustment'
+
+RECONCILE_BATCH = 500
+
+
+class InsufficientGold(Exception):
+    pass
+
+
+def reference(kind, *parts):
+    return ':'.join([kind] + [str(part) for part in parts])
+
+
+def _rows(entries):
+    """(PlayerID, 带符号金额, SourceReference) -> GoldTransaction 行。"""
+    for player_id, amount, source in entries:
+        if amount >= 0:
+            yield player_id, INCOME, amount, source
+        else:
+            yield player_id, EXPENSE, -amount, source
+
+
+def record(conn, entries):
+    """只写流水、不动余额：用于余额已经直接写好的场景（开户时 INSERT Player 带初始金币）。"""
+    conn.executemany("""
+        INSERT INTO GoldTransaction (PlayerID, Type, Amount, SourceReference)
+        VALUES (?, ?, ?, ?)
+    """, list(_rows(entries)))
+
+
+def apply(conn, entries):
+    """在调用方的事务里记账并更新余额。entries 为 [(PlayerID, 带符号金额, SourceReference), ...]。
+
+    扣款不会让余额变成负数：任一玩家余额不足时抛出 InsufficientGold，调用方回滚整个事务。
+    """
+    entries = [entry for entry in entries if entry[1]]
+    if not entries:
+        return
+    deltas = {}
+    for player_id, amount, _ in entries:
+        deltas[player_id] = deltas.get(player_id, 0) + amount
+
+    cur = conn.executemany("""
+        UPDATE Player SET CurrentGold = CurrentGold + ?, Version = Version + 1
+        WHERE PlayerID = ? AND CurrentGold + ? >= 0
+    """, [(delta, player_id, delta) for player_id, delta in deltas.items()])
+    if cur.rowcount != len(deltas):
+        raise InsufficientGold('金币不足')
+    record(conn, entries)
+
+
+# ===== 对账 =====
+
+def reconcile(conn, batch_size=RECONCILE_BATCH, fix=False):
+    """按 PlayerID 分批核对余额快照和流水，返回 {'players', 'new_entries', 'mismatches': [...]}。
+
+    每批一个短的 BEGIN IMMEDIATE 事务：读到的余额和流水是同一时刻的，检查点也在同一事务里前移。
+    fix=True 时按流水余额修正 CurrentGold。
+    """
+    result = {'players': 0, 'new_entries': 0, 'mismatches': []}
+    after = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            last = _batch_end(conn, after, batch_size)
+            if last is None:
+                conn.rollback()
+                break
+            # 新流水按 (PlayerID, TransactionID) 索引只读检查点之后的部分
+            rows = conn.execute("""
+                SELECT p.PlayerID, p.CurrentGold, COALESCE(c.Balance, 0) AS FromBalance,
+                       t.Delta, t.LastID, t.Entries
+                FROM Player p
+                LEFT JOIN LedgerCheckpoint c ON c.PlayerID = p.PlayerID
+                LEFT JOIN (
+                    SELECT g.PlayerID, SUM(CASE WHEN g.Type = 'Expense' THEN -g.Amount ELSE g.Amount END) AS Delta, MAX(g.TransactionID) AS LastID, COUNT(*) AS Entries
+                    FROM GoldTransaction g
+                    LEFT JOIN LedgerCheckpoint gc ON gc.PlayerID = g.PlayerID
+                    WHERE g.PlayerID > ? AND g.PlayerID <= ?
+                      AND g.TransactionID > COALESCE(gc.TransactionID, 0)
+                    GROUP BY g.PlayerID
+                ) t ON t.PlayerID = p.PlayerID
+                WHERE p.PlayerID > ? AND p.PlayerID <= ?
+                ORDER BY p.PlayerID
+            """, (after, last, after, last)).fetchall()
+
+            checkpoints = []
+            for row in rows:
+                balance = row['FromBalance'] + (row['Delta'] or 0)
+                if row['LastID'] is not None:
+                    checkpoints.append((row['PlayerID'], row['LastID'], balance))
+                    result['new_entries'] += row['Entries']
+                if balance != row['CurrentGold']:
+                    result['mismatches'].append({'PlayerID': row['PlayerID'], 'CurrentGold': row['CurrentGold'],
+                                                 'Ledger': balance})
+                    if fix:
+                        conn.execute("UPDATE Player SET CurrentGold = ?, Version = Version + 1 WHERE PlayerID = ?",
+                                     (balance, row['PlayerID']))
+            conn.executemany("""
+                INSERT INTO LedgerCheckpoint (PlayerID, TransactionID, Balance) VALUES (?, ?, ?)
+                ON CONFLICT(PlayerID) DO UPDATE SET
+                    TransactionID = excluded.TransactionID, Balance = excluded.Balance
+            """, checkpoints)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        result['players'] += len(rows)
+        after = rows[-1]['PlayerID']
+    return result
+
+
+def _batch_end(conn, after, batch_size):
+    """下一批 (after, 返回值] 的上界，没有更多玩家时返回 None；两边的查询都按这个主键范围走索引。"""
+    row = conn.execute("""
+        SELECT MAX(PlayerID) FROM (
+            SELECT PlayerID FROM Player WHERE PlayerID > ? ORDER BY PlayerID LIMIT ?
+        ) batch
+    """, (after, batch_size)).fetchone()
+    return row[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='金币账本对账')
+    parser.add_argument('command', choices=['reconcile'])
+    parser.add_argument('--db', help='数据库路径（默认按 DATABASE_URL）')
+    parser.add_argument('--batch', type=int, default=RECONCILE_BATCH, help='每个事务核对的玩家数')
+    parser.add_argument('--fix', action='store_true', help='按流水余额修正不一致的 CurrentGold')
+    args = parser.parse_args(argv)
+
+    import migrations
+    conn = db.connect(args.db)
+    migrations.migrate(conn)
+    started = time.monotonic()
+    try:
+        result = reconcile(conn, args.batch, args.fix)
+    finally:
+        conn.close()
+
+    for mismatch in result['mismatches'][:50]:
+        print('  玩家 {PlayerID}: 余额 {CurrentGold}，流水 {Ledger}'.format(**mismatch))
+    print('核对 {} 个玩家、{} 条新流水，用时 {:.2f}s，不一致 {} 个{}'.format(
+        result['players'], result['new_entries'], time.monotonic() - started, len(result['mismatches']),
+        '（已修正）' if args.fix and result['mismatches'] else ''))
+    if result['mismatches'] and not args.fix:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
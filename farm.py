@@ -0,0 +1,125 @@
+# farm.py
+# 批量农场操作：一键浇水 / 一键种植 / 一键收获。
+# 每个操作都在一个 BEGIN IMMEDIATE 事务里用固定条数的集合式 SQL 完成，
+# 语句数量与地块数量无关；成熟判断与 growth.py 的推算规则一致。
+# 写锁下的集合式 UPDATE 本身不会丢更新，但要照常把 Version +1，让单块地操作的 CAS 看到变化。
+
+# 地块已成熟（p 为 Plot，pl 为 Plant，:now 为玩家时钟）
+READY_SQL = "(:now - p.PlantedAt) * p.GrowthRate + p.WaterBonus >= pl.BaseGrowthTime"
+
+
+def _inventory_quantity(conn, player_id, item_id):
+    row = conn.execute("SELECT Quantity FROM Inventory WHERE PlayerID = ? AND ItemID = ?",
+                       (player_id, item_id)).fetchone()
+    return row['Quantity'] if row else 0
+
+
+def _run(conn, action):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = action()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return result
+
+
+def water_all(conn, player_id, now, water_item_id):
+    """给所有未成熟、未达到浇水上限的地块各浇一次水，受水滴库存限制。"""
+    def action():
+        drops = _inventory_quantity(conn, player_id, water_item_id)
+        if drops <= 0:
+            return {'watered': 0, 'drops_left': 0}
+
+        watered = conn.execute("""
+            UPDATE Plot SET
+                WaterBonus = WaterBonus + (SELECT WaterEffectPerTime FROM Plant WHERE PlantID = Plot.PlantedPlantID),
+                TimesWatered = TimesWatered + 1,
+                Version = Version + 1
+            WHERE PlotID IN (
+                SELECT p.PlotID FROM Plot p
+                JOIN Plant pl ON pl.PlantID = p.PlantedPlantID
+                WHERE p.PlayerID = :player_id AND p.Status = 'Growing'
+                  AND p.TimesWatered < pl.MaxWaterTimes
+                  AND NOT ({ready})
+                ORDER BY p.PlotID
+                LIMIT :limit
+            )
+        """.format(ready=READY_SQL), {'player_id': player_id, 'now': now, 'limit': drops}).rowcount
+
+        if watered:
+            conn.execute("UPDATE Inventory SET Quantity = Quantity - ?, Version = Version + 1 WHERE PlayerID = ? AND ItemID = ?",
+                         (watered, player_id, water_item_id))
+        return {'watered': watered, 'drops_left': drops - watered}
+
+    return _run(conn, action)
+
+
+def plant_all(conn, player_id, plant_id, seed_item_id, now, rate=1.0):
+    """在所有空地上种下同一种作物，受种子库存限制。"""
+    def action():
+        seeds = _inventory_quantity(conn, player_id, seed_item_id)
+        if seeds <= 0:
+            return {'planted': 0, 'seeds_left': 0}
+
+        planted = conn.execute("""
+            UPDATE Plot SET PlantedPlantID = :plant_id, Status = 'Growing', PlantedAt = :now,
+                            GrowthRate = :rate, WaterBonus = 0, TimesWatered = 0,
+                            CurrentGrowthTimeLeft = NULL, Version = Version + 1
+            WHERE PlotID IN (
+                SELECT PlotID FROM Plot
+                WHERE PlayerID = :player_id AND Status = 'Empty'
+                ORDER BY PlotID
+                LIMIT :limit
+            )
+        """, {'plant_id': plant_id, 'now': now, 'rate': rate, 'player_id': player_id, 'limit': seeds}).rowcount
+
+        if planted:
+            conn.execute("UPDATE Inventory SET Quantity = Quantity - ?, Version = Version + 1 WHERE PlayerID = ? AND ItemID = ?",
+                         (planted, player_id, seed_item_id))
+        return {'planted': planted, 'seeds_left': seeds - planted}
+
+    return _run(conn, action)
+
+
+def harvest_all(conn, player_id, now):
+    """收获所有已成熟地块，产物按物品汇总写入库存；没有对应产物物品的作物跳过。"""
+    params = {'player_id': player_id, 'now': now}
+    ready_from = """
+        FROM Plot p
+        JOIN Plant pl ON pl.PlantID = p.PlantedPlantID
+        WHERE p.PlayerID = :player_id AND p.Status = 'Growing' AND {ready}
+    """.format(ready=READY_SQL)
+
+    def action():
+        summary = conn.execute("""
+            SELECT pl.ProduceItemID AS ItemID, COUNT(*) AS Plots, SUM(pl.HarvestYield) AS Quantity
+        """ + ready_from + " GROUP BY pl.ProduceItemID", params).fetchall()
+        harvested = {row['ItemID']: row['Quantity'] for row in summary if row['ItemID'] is not None}
+        skipped = sum(row['Plots'] for row in summary if row['ItemID'] is None)
+        plots = sum(row['Plots'] for row in summary) - skipped
+        if not harvested:
+            return {'plots': 0, 'items': {}, 'skipped': skipped}
+
+        conn.execute("""
+            INSERT INTO Inventory (PlayerID, ItemID, Quantity)
+            SELECT :player_id, pl.ProduceItemID, SUM(pl.HarvestYield)
+        """ + ready_from + """
+              AND pl.ProduceItemID IS NOT NULL
+            GROUP BY pl.ProduceItemID
+            ON CONFLICT(PlayerID, ItemID) DO UPDATE SET Quantity = Inventory.Quantity + excluded.Quantity,
+                                                        Version = Inventory.Version + 1
+        """, params)
+
+        conn.execute("""
+            UPDATE Plot SET Status = 'Empty', PlantedPlantID = NULL, PlantedAt = NULL,
+                            CurrentGrowthTimeLeft = NULL, WaterBonus = 0, TimesWatered = 0,
+                            Version = Version + 1
+            WHERE PlotID IN (SELECT p.PlotID
+        """ + ready_from + """
+              AND pl.ProduceItemID IS NOT NULL)
+        """, params)
+        return {'plots': plots, 'items': harvested, 'skipped': skipped}
+
+    return _run(conn, action)
@@ -0,0 +1,107 @@
+# fragments.py
+# 模板片段缓存和 Jinja 字节码缓存。
+#
+# 片段缓存：模板里用 {% cache 'inventory', player.PlayerID, player.Revision %}...{% endcache %}
+# 包住渲染开销大的块，渲染结果按 (模板名, 参数...) 放在进程内的 LRU 里。参数里带上版本号，
+# 数据一改版本号就变，旧条目不会再被命中，自然被挤出 LRU，不需要主动删除：
+#   - Player.Revision：玩家的库存 / 地块每改一行就 +1（数据库触发器维护，见迁移 8）；
+#   - CacheVersion 表里的 catalog / users 等：按表的版本号。
+# 视图把只在缓存块里用到的数据包成 Deferred，命中时连查询也省掉。
+#
+# 字节码缓存：模板编译结果写到 JINJA_CACHE_DIR，worker 重启后直接加载，不用重新解析模板；
+# 模板源码变了（校验和不同）会自动重新编译。
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+ENABLED = os.environ.get('FRAGMENT_CACHE', 'on') != 'off'
+MAX_ENTRIES = int(os.environ.get('FRAGMENT_CACHE_SIZE', 10000))
+BYTECODE_DIR = os.environ.get('JINJA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'farm-jinja-cache'))
+
+
+class FragmentCache:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get_or_render(self, key, render):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        # 渲染不持锁；两个请求同时未命中时各渲染一次，结果相同
+        value = render()
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'max_entries': self.max_entries,
+                    'hits': self.hits, 'misses': self.misses, 'enabled': ENABLED}
+
+
+cache = FragmentCache()
+
+
+class Deferred:
+    """只在缓存块里用到的查询结果：第一次遍历时才执行 load()。"""
+
+    def __init__(self, load):
+        self._load = load
+        self._rows = None
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = self._load()
+        return self._rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getattr__(self, name):
+        return getattr(self.rows, name)
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        call = self.call_method('_render', [nodes.Const(parser.name), nodes.List(key)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, template_name, key, caller):
+        if not ENABLED:
+            return caller()
+        return cache.get_or_render((template_name,) + tuple(key), caller)
+
+
+def init_app(app):
+    os.makedirs(BYTECODE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(BYTECODE_DIR)
+    app.jinja_env.add_extension(FragmentCacheExtension)
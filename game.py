@@ -0,0 +1,168 @@
+# game.py
+# 玩家操作的业务逻辑，HTML 路由（app.py）和 JSON API（api.py）共用。
+# 每个操作成功时返回 dict：message 为提示文字，plot_ids / item_ids 为受影响的地块和物品，
+# 调用方据此决定重新渲染页面还是只返回增量；失败时抛出 GameError。
+import concurrency
+import economy
+import farm
+import growth
+import orders
+
+
+class GameError(Exception):
+    pass
+
+
+def _result(message, plot_ids=(), item_ids=(), **extra):
+    result = {'message': message, 'plot_ids': list(plot_ids), 'item_ids': list(item_ids)}
+    result.update(extra)
+    return result
+
+
+def _optimistic(conn, name, action):
+    try:
+        return concurrency.run(conn, name, action)
+    except concurrency.RetriesExhausted:
+        raise GameError('操作太频繁，请稍后再试')
+
+
+def _inventory_row(conn, player_id, item_id):
+    return conn.execute("SELECT Quantity, Version FROM Inventory WHERE PlayerID = ? AND ItemID = ?",
+                        (player_id, item_id)).fetchone()
+
+
+def _take_item(conn, player_id, item_id, row, qty=1):
+    """按读到的 Inventory.Version 扣物品。"""
+    concurrency.expect(conn.execute("""
+        UPDATE Inventory SET Quantity = Quantity - ?, Version = Version + 1
+        WHERE PlayerID = ? AND ItemID = ? AND Version = ?
+    """, (qty, player_id, item_id, row['Version'])), 'Inventory')
+
+
+def water(conn, catalog, player, plot_id):
+    water_item_id = catalog.water_item_id
+
+    def action():
+        plot = conn.execute("SELECT * FROM Plot WHERE PlotID = ? AND PlayerID = ? AND Status = 'Growing'",
+                            (plot_id, player['PlayerID'])).fetchone()
+        plant_info = catalog.plant(plot['PlantedPlantID']) if plot else None
+        # 已成熟的地块不能再浇水
+        if not plant_info or growth.is_ready(plot, plant_info, growth.player_clock(conn, player)):
+            raise GameError('无法浇水：该土地不可操作')
+
+        if plot['TimesWatered'] >= plant_info['MaxWaterTimes']:
+            raise GameError('已达最大浇水次数')
+
+        drops = _inventory_row(conn, player['PlayerID'], water_item_id)
+        if not drops or drops['Quantity'] < 1:
+            raise GameError('没有足够的水滴')
+
+        concurrency.expect(growth.water_plot(conn, plot_id, plot['Version'], plant_info['WaterEffectPerTime']), 'Plot')
+        _take_item(conn, player['PlayerID'], water_item_id, drops)
+
+    _optimistic(conn, 'water', action)
+    return _result('浇水成功', [plot_id], [water_item_id])
+
+
+def plant(conn, catalog, player, plot_id, plant_id):
+    """在一块空地上种下作物，扣一颗对应的种子。"""
+    plant_info = catalog.plant(plant_id)
+    # 表单提交的是 PlantID，库存里扣的是对应的种子物品
+    seed_item = catalog.seed_for_plant(plant_id)
+    if not plant_info or not seed_item:
+        raise GameError('你没有这个种子的库存')
+
+    def action():
+        plot = conn.execute("SELECT PlotID, Version FROM Plot WHERE PlotID = ? AND PlayerID = ? AND Status = 'Empty'",
+                            (plot_id, player['PlayerID'])).fetchone()
+        if not plot:
+            raise GameError('这块地不能种植')
+        seed = _inventory_row(conn, player['PlayerID'], seed_item['ItemID'])
+        if not seed or seed['Quantity'] < 1:
+            raise GameError('你没有这个种子的库存')
+
+        concurrency.expect(growth.plant_plot(conn, plot['PlotID'], plot['Version'], plant_info['PlantID'],
+                                             growth.player_clock(conn, player)), 'Plot')
+        _take_item(conn, player['PlayerID'], seed_item['ItemID'], seed)
+
+    _optimistic(conn, 'plant', action)
+    return _result('种植成功', [plot_id], [seed_item['ItemID']])
+
+
+def water_all(conn, catalog, player):
+    water_item_id = catalog.water_item_id
+    result = farm.water_all(conn, player['PlayerID'], growth.player_clock(conn, player), water_item_id)
+    if result['watered']:
+        message = f"浇水成功：共 {result['watered']} 块地，剩余水滴 {result['drops_left']}"
+    elif result['drops_left'] <= 0:
+        raise GameError('没有足够的水滴')
+    else:
+        raise GameError('没有需要浇水的土地')
+    return _result(message, item_ids=[water_item_id], all_plots=True)
+
+
+def plant_all(conn, catalog, player, plant_id):
+    plant_info = catalog.plant(plant_id)
+    seed_item = catalog.seed_for_plant(plant_id)
+    if not plant_info or not seed_item:
+        raise GameError('你没有这个种子的库存')
+
+    result = farm.plant_all(conn, player['PlayerID'], plant_info['PlantID'], seed_item['ItemID'],
+                            growth.player_clock(conn, player))
+    if not result['planted']:
+        raise GameError('没有空地或种子不足')
+    return _result(f"种植成功：{plant_info['PlantName']} 共 {result['planted']} 块地",
+                   item_ids=[seed_item['ItemID']], all_plots=True)
+
+
+def harvest_plot(conn, catalog, player, plot_id):
+    """单块地收获：直接按售价换成金币。"""
+    def action():
+        plot = conn.execute("""
+            SELECT * FROM Plot
+            WHERE PlotID = ? AND PlayerID = ? AND Status = 'Growing'
+        """, (plot_id, player['PlayerID'])).fetchone()
+        plant_info = catalog.plant(plot['PlantedPlantID']) if plot else None
+
+        if not plant_info or not growth.is_ready(plot, plant_info, growth.player_clock(conn, player)):
+            raise GameError("❌ 无法收获：该地块未成熟或不存在。")
+
+        # 收获逻辑：先按版本清除地块（同一块地只能收获一次），再加金币
+        concurrency.expect(growth.clear_plot(conn, plot_id, plot['Version']), 'Plot')
+        total_gold = plant_info['SellPrice'] * plant_info['HarvestYield']
+        economy.apply(conn, [(player['PlayerID'], total_gold, economy.reference('harvest', 'plot', plot_id))])
+        return total_gold
+
+    total_gold = _optimistic(conn, 'harvest', action)
+    return _result(f"✅ 收获成功，获得金币 {total_gold}！", [plot_id], gold=total_gold)
+
+
+def harvest_all(conn, catalog, player):
+    """收获所有已成熟地块，产物进仓库；warning 里是被跳过的地块提示。"""
+    result = farm.harvest_all(conn, player['PlayerID'], growth.player_clock(conn, player))
+    warning = f"{result['skipped']} 块地的作物无对应物品，跳过。" if result['skipped'] else None
+
+    if not result['plots']:
+        if warning:
+            raise GameError(warning)
+        raise GameError("当前没有可收获的作物！")
+
+    detail = '、'.join(f"{catalog.items[item_id]['ItemName']}×{qty}" for item_id, qty in result['items'].items())
+    return _result(f"作物已成功收获 ✅ 共 {result['plots']} 块地：{detail}",
+                   item_ids=result['items'].keys(), all_plots=True, warning=warning)
+
+
+def next_day(conn, player):
+    # 只推进玩家时钟，地块的成熟状态在读取时推算
+    growth.advance_clock(conn, player['PlayerID'])
+    conn.commit()
+    return _result('新的一天开始了', all_plots=True)
+
+
+def complete_order(conn, player_id, order_id):
+    """用仓库里的物品完成村民订单（见 orders.claim）。"""
+    try:
+        order = orders.claim(conn, player_id, order_id)
+    except orders.OrderError as e:
+        raise GameError(str(e))
+    return _result("订单完成，奖励已发放！", item_ids=[order['RequiredItemID']], gold=order['RewardGold'])
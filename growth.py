@@ -0,0 +1,72 @@
+# growth.py
+# 作物生长模型：地块只记录种下时的时钟 PlantedAt、累计浇水加速 WaterBonus 和生长速率 GrowthRate，
+# 成熟状态和剩余时间在读取 / 收获时按当前时钟推算。
+# 玩家时钟 = 世界时钟 WorldClock.Tick（由 scheduler.py 定时推进）+ 玩家自己的 ClockOffset；
+# “下一天” 只需要把玩家的 ClockOffset +1，写入量与地块数量无关。
+import math
+
+# 数据库里只存 Empty / Growing 两种状态，Ready 是读取时推算出来的
+EMPTY = 'Empty'
+GROWING = 'Growing'
+READY = 'Ready'
+
+
+def world_tick(conn):
+    row = conn.execute("SELECT Tick FROM WorldClock WHERE ID = 1").fetchone()
+    return row[0] if row else 0
+
+
+def player_clock(conn, player):
+    """玩家当前的游戏时钟（单位与 BaseGrowthTime 相同）。"""
+    return world_tick(conn) + player['ClockOffset']
+
+
+def time_left(plot, plant, now):
+    elapsed = max(0, now - plot['PlantedAt']) * plot['GrowthRate']
+    return max(0, math.ceil(plant['BaseGrowthTime'] - plot['WaterBonus'] - elapsed))
+
+
+def derive(plot, plant, now):
+    """返回带推算后 Status / CurrentGrowthTimeLeft 的地块 dict。"""
+    row = dict(plot)
+    if plot['Status'] != GROWING or plant is None:
+        return row
+    left = time_left(plot, plant, now)
+    row['CurrentGrowthTimeLeft'] = left
+    row['Status'] = READY if left == 0 else GROWING
+    return row
+
+
+def is_ready(plot, plant, now):
+    return plot['Status'] == GROWING and plant is not None and time_left(plot, plant, now) == 0
+
+
+def advance_clock(conn, player_id, ticks=1):
+    conn.execute("UPDATE Player SET ClockOffset = ClockOffset + ?, Version = Version + 1 WHERE PlayerID = ?",
+                 (ticks, player_id))
+
+
+# 下面三个按读到的 Plot.Version 做 CAS（见 concurrency.py），版本不符时影响 0 行
+def plant_plot(conn, plot_id, version, plant_id, now, rate=1.0):
+    return conn.execute("""
+        UPDATE Plot SET PlantedPlantID = ?, Status = 'Growing', PlantedAt = ?, GrowthRate = ?,
+                        WaterBonus = 0, TimesWatered = 0, CurrentGrowthTimeLeft = NULL,
+                        Version = Version + 1
+        WHERE PlotID = ? AND Version = ?
+    """, (plant_id, now, rate, plot_id, version))
+
+
+def water_plot(conn, plot_id, version, effect):
+    return conn.execute("""
+        UPDATE Plot SET WaterBonus = WaterBonus + ?, TimesWatered = TimesWatered + 1, Version = Version + 1
+        WHERE PlotID = ? AND Version = ?
+    """, (effect, plot_id, version))
+
+
+def clear_plot(conn, plot_id, version):
+    return conn.execute("""
+        UPDATE Plot SET Status = 'Empty', PlantedPlantID = NULL, PlantedAt = NULL,
+                        CurrentGrowthTimeLeft = NULL, WaterBonus = 0, TimesWatered = 0,
+                        Version = Version + 1
+        WHERE PlotID = ? AND Version = ?
+    """, (plot_id, version))
@@ -0,0 +1,74 @@
+# gunicorn.conf.py
+# gunicorn 配置：gunicorn -c gunicorn.conf.py
+# 所有参数都可以用环境变量覆盖，默认值按 CPU 数计算。
+#
+#   GUNICORN_WORKER_CLASS  gthread（默认）/ sync / uvicorn（走 asgi.py）
+#                          不支持 gevent / eventlet：应用在每个 worker 里起了真正的 OS 线程（写线程、
+#                          密码哈希线程池、快照、定时任务），SQLite 调用也会阻塞整个协程循环，
+#                          猴子补丁下这些都不安全。需要大量并发连接时用 uvicorn。
+#   WEB_CONCURRENCY        worker 进程数，默认 min(CPU * 2 + 1, GUNICORN_MAX_WORKERS)
+#   GUNICORN_THREADS       gthread 下每个 worker 的线程数
+#   GUNICORN_PRELOAD       1（默认）在 master 里先加载应用，fork 后 worker 共享模板、目录缓存等内存页
+#   GUNICORN_MAX_REQUESTS  worker 处理这么多请求后重启，避免内存慢慢涨
+import multiprocessing
+import os
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:{}'.format(os.environ.get('PORT', '8000')))
+
+_worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if _worker_class not in ('gthread', 'sync', 'uvicorn'):
+    raise ValueError('不支持的 GUNICORN_WORKER_CLASS：{}（可选 gthread / sync / uvicorn）'.format(_worker_class))
+if _worker_class == 'uvicorn':
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'asgi:app'
+else:
+    worker_class = _worker_class
+    wsgi_app = 'app:app'
+
+# SQLite 只有一个写者，worker 太多只会增加写锁竞争，默认封顶
+workers = int(os.environ.get('WEB_CONCURRENCY', min(cpu_count * 2 + 1, int(os.environ.get('GUNICORN_MAX_WORKERS', 8)))))
+threads = int(os.environ.get('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    # 清掉上一次部署留下的 worker 统计快照，/admin/metrics 只汇总这次启动的 worker
+    import metrics
+    metrics.clear()
+
+
+def when_ready(server):
+    # master 已加载应用、还没 fork worker：预热模板和目录缓存，
+    # 再关掉 master 在迁移时打开的连接（SQLite 连接不能跨 fork 使用）
+    if not preload_app or wsgi_app != 'app:app':
+        return
+    import db
+    from app import app
+    from catalog import get_catalog
+
+    with app.app_context():
+        db.get_db(primary=True)
+        get_catalog()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    db.get_pool().close_all()
+    server.log.info('preloaded app: %d workers x %d threads (%s)', workers, threads, worker_class)
+
+
+def worker_exit(server, worker):
+    # WRITE_BEHIND=on 时先提交完写线程队列里的操作，再让 worker 退出
+    import writebehind
+    writebehind.drain()
@@ -2,18 +2,35 @@ import sqlite3
 import os
 from werkzeug.security import generate_password_hash
 
-DB_NAME = 'farm_game.db'
+import db
+import migrations
 
-def initialize_database():
-    if os.path.exists(DB_NAME):
-        os.remove(DB_NAME)
-        print("🗑 旧数据库已删除")
+DB_NAME = 'farm_game.db'
 
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
+# PostgreSQL 下重建时删除的表（含迁移创建的表）
+TABLES = ['LedgerCheckpoint', 'ShopItem', 'GoldTransaction', 'VillagerOrder', 'Affection', 'Villager', 'Inventory', 'Plot',
+          'Plant', 'Item', 'Player', 'User', 'StarterKit', 'CacheVersion', 'WorldClock', 'SchedulerLease',
+          'SchemaVersion']
 
-    # 启用外键支持
-    cur.execute("PRAGMA foreign_keys = ON")
+def initialize_database():
+    if db.BACKEND == 'postgresql' and DB_NAME == 'farm_game.db':
+        # DATABASE_URL 指向 PostgreSQL：同样的建表 / 初始数据语句经 postgres.py 转换后执行
+        # （压测等调用方改了 DB_NAME 时仍然生成 SQLite 文件）
+        import postgres
+        conn = db.connect()
+        postgres.drop_tables(conn, TABLES)
+        print("🗑 旧数据表已删除")
+        cur = conn
+    else:
+        if os.path.exists(DB_NAME):
+            os.remove(DB_NAME)
+            print("🗑 旧数据库已删除")
+
+        conn = sqlite3.connect(DB_NAME)
+        cur = conn.cursor()
+
+        # 启用外键支持
+        cur.execute("PRAGMA foreign_keys = ON")
 
     # ===== 创建表结构 =====
     cur.executescript("""
@@ -153,6 +170,9 @@ def initialize_database():
 
 
     conn.commit()
+
+    # 补齐索引等后续迁移
+    migrations.migrate(conn)
     conn.close()
     print("✅ 数据库初始化完成！已插入默认用户与物品。")
 
@@ -0,0 +1,394 @@
+# metrics.py
+# 请求与 SQL 统计：每个请求记录耗时、SQL 条数、SQL 耗时、返回行数（按 endpoint 汇总），
+# 慢查询按归一化后的语句汇总，可按比例对请求做 cProfile 采样；乐观并发的冲突 / 重试次数来自 concurrency.py。
+# 统计只在内存里累加，每个 worker 每隔几秒把快照写到 METRICS_DIR/<pid>.json，
+# /admin/metrics 和 /metrics 读取所有 worker 的快照合并展示。
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+
+from flask import request
+
+import concurrency
+import db
+
+ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'farm_game_metrics'))
+FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+# 超过这么久没更新的 worker 快照视为已失效（空闲 worker 不会刷新，默认给足余量）
+STALE_SECONDS = float(os.environ.get('METRICS_STALE_SECONDS', 600))
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+PROFILE_RATE = float(os.environ.get('METRICS_PROFILE_RATE', 0))   # 0~1，被 cProfile 采样的请求比例
+MAX_SLOW_QUERIES = 200
+MAX_PROFILES = 10
+
+# 请求耗时直方图的桶（毫秒）
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_lock = threading.Lock()
+_endpoints = {}
+_slow = {}
+_profiles = deque(maxlen=MAX_PROFILES)
+_last_flush = 0.0
+
+# 当前线程正在处理的请求：[SQL 条数, SQL 耗时 ms, 返回行数]
+_current = threading.local()
+
+
+# ===== SQL 统计 =====
+
+_WS = re.compile(r'\s+')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+def normalize_sql(sql):
+    """去掉字面量和多余空白，IN (?, ?, ...) 合并成 IN (...)，用作慢查询的汇总键。"""
+    sql = _WS.sub(' ', sql).strip()
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    return _IN_LIST.sub('(...)', sql)
+
+
+def _record_sql(sql, elapsed_ms, rows):
+    req = getattr(_current, 'req', None)
+    if req is not None:
+        req[0] += 1 if sql is not None else 0
+        req[1] += elapsed_ms
+        req[2] += rows
+    if sql is not None and elapsed_ms >= SLOW_QUERY_MS:
+        _record_slow(sql, elapsed_ms)
+
+
+def _record_slow(sql, elapsed_ms):
+    key = normalize_sql(sql)
+    endpoint = getattr(_current, 'endpoint', None) or '-'
+    with _lock:
+        entry = _slow.get(key)
+        if entry is None:
+            if len(_slow) >= MAX_SLOW_QUERIES:
+                # 满了就丢掉累计耗时最少的那条
+                del _slow[min(_slow, key=lambda k: _slow[k]['total_ms'])]
+            entry = _slow[key] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'endpoint': endpoint}
+        entry['count'] += 1
+        entry['total_ms'] += elapsed_ms
+        if elapsed_ms > entry['max_ms']:
+            entry['max_ms'] = elapsed_ms
+            entry['endpoint'] = endpoint
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """统计 execute 耗时和 fetch 出来的行数。"""
+
+    def execute(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            _record_sql(sql, (time.perf_counter() - started) * 1000, 0)
+
+    def executemany(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            _record_sql(sql, (time.perf_counter() - started) * 1000, 0)
+
+    # fetch 阶段的耗时和行数记到当前请求上，不算作新语句
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        _record_sql(None, (time.perf_counter() - started) * 1000, 1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, *args):
+        started = time.perf_counter()
+        rows = super().fetchmany(*args)
+        _record_sql(None, (time.perf_counter() - started) * 1000, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        _record_sql(None, (time.perf_counter() - started) * 1000, len(rows))
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        row = super().__next__()
+        _record_sql(None, (time.perf_counter() - started) * 1000, 1)
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """connection.execute / cursor() 都走 InstrumentedCursor。"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+
+# ===== 请求统计 =====
+
+def _new_endpoint():
+    return {'count': 0, 'errors': 0, 'wall_ms': 0.0, 'max_ms': 0.0,
+            'sql_count': 0, 'sql_ms': 0.0, 'rows': 0, 'buckets': [0] * (len(BUCKETS_MS) + 1)}
+
+
+def _bucket_index(ms):
+    for i, bound in enumerate(BUCKETS_MS):
+        if ms <= bound:
+            return i
+    return len(BUCKETS_MS)
+
+
+def _start_request():
+    _current.req = [0, 0.0, 0]
+    _current.endpoint = request.endpoint or '<unmatched>'
+    _current.status = 500
+    _current.started = time.perf_counter()
+    _current.profiler = None
+    if PROFILE_RATE and random.random() < PROFILE_RATE:
+        _current.profiler = cProfile.Profile()
+        _current.profiler.enable()
+
+
+def _set_status(response):
+    _current.status = response.status_code
+    return response
+
+
+def _finish_request(exc=None):
+    req = getattr(_current, 'req', None)
+    if req is None:
+        return
+    elapsed_ms = (time.perf_counter() - _current.started) * 1000
+    endpoint = _current.endpoint
+    status = 500 if exc is not None else _current.status
+    _current.req = None
+
+    profiler = _current.profiler
+    if profiler is not None:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+        _current.profiler = None
+        with _lock:
+            _profiles.append({'endpoint': endpoint, 'path': request.path, 'ms': round(elapsed_ms, 3),
+                              'at': time.time(), 'stats': out.getvalue()})
+
+    with _lock:
+        stats = _endpoints.get(endpoint)
+        if stats is None:
+            stats = _endpoints[endpoint] = _new_endpoint()
+        stats['count'] += 1
+        if status >= 500:
+            stats['errors'] += 1
+        stats['wall_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        stats['sql_count'] += req[0]
+        stats['sql_ms'] += req[1]
+        stats['rows'] += req[2]
+        stats['buckets'][_bucket_index(elapsed_ms)] += 1
+    _maybe_flush()
+
+
+# ===== 跨 worker 汇总 =====
+
+def snapshot():
+    """当前进程的统计快照。"""
+    with _lock:
+        return {
+            'pid': os.getpid(),
+            'endpoints': {name: dict(stats, buckets=list(stats['buckets'])) for name, stats in _endpoints.items()},
+            'slow_queries': {sql: dict(entry) for sql, entry in _slow.items()},
+            'profiles': list(_profiles),
+            'concurrency': concurrency.stats(),
+        }
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, '{}.json'.format(pid))
+
+
+def flush():
+    """把当前进程的快照写到 METRICS_DIR（先写临时文件再替换，读取方不会读到半个文件）。"""
+    global _last_flush
+    _last_flush = time.monotonic()
+    data = snapshot()
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = _snapshot_path(data['pid'])
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        pass
+
+
+def clear():
+    """删除 METRICS_DIR 里所有 worker 快照（gunicorn 启动时调用，不带上一次部署的旧数据）。"""
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        return
+    for name in names:
+        if name.endswith(('.json', '.tmp')):
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except OSError:
+                pass
+
+
+def _maybe_flush():
+    if time.monotonic() - _last_flush >= FLUSH_SECONDS:
+        flush()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def collect():
+    """合并所有 worker 的快照（本进程用内存里的最新数据）。
+
+    进程已经不在（max_requests 回收、上一次部署留下的）或超过 STALE_SECONDS 没更新的快照不参与汇总，并顺手删掉。
+    """
+    snapshots = [snapshot()]
+    own = os.getpid()
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        names = []
+    now = time.time()
+    for name in names:
+        if not name.endswith('.json') or name == '{}.json'.format(own):
+            continue
+        path = os.path.join(METRICS_DIR, name)
+        try:
+            pid = int(name[:-len('.json')])
+            if not _alive(pid) or now - os.path.getmtime(path) > STALE_SECONDS:
+                os.remove(path)
+                continue
+            with open(path, encoding='utf-8') as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+
+    endpoints, slow, profiles, occ = {}, {}, [], {}
+    for snap in snapshots:
+        for name, stats in snap['endpoints'].items():
+            total = endpoints.setdefault(name, _new_endpoint())
+            for key in ('count', 'errors', 'wall_ms', 'sql_count', 'sql_ms', 'rows'):
+                total[key] += stats[key]
+            total['max_ms'] = max(total['max_ms'], stats['max_ms'])
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], stats['buckets'])]
+        for sql, entry in snap['slow_queries'].items():
+            total = slow.setdefault(sql, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'endpoint': entry['endpoint']})
+            total['count'] += entry['count']
+            total['total_ms'] += entry['total_ms']
+            if entry['max_ms'] > total['max_ms']:
+                total['max_ms'] = entry['max_ms']
+                total['endpoint'] = entry['endpoint']
+        profiles.extend(dict(p, pid=snap['pid']) for p in snap['profiles'])
+        for name, counters in snap.get('concurrency', {}).items():
+            total = occ.setdefault(name, dict.fromkeys(counters, 0))
+            for key, value in counters.items():
+                total[key] = total.get(key, 0) + value
+
+    profiles.sort(key=lambda p: p['at'], reverse=True)
+    return {'workers': len(snapshots), 'endpoints': endpoints, 'slow_queries': slow,
+            'profiles': profiles[:MAX_PROFILES], 'concurrency': occ}
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus(data=None):
+    """Prometheus 文本格式。"""
+    data = data or collect()
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for labels, value in samples:
+            label_text = ','.join('{}="{}"'.format(k, _label(v)) for k, v in labels)
+            lines.append('{}{{{}}} {}'.format(name, label_text, value) if label_text else '{} {}'.format(name, value))
+
+    endpoints = sorted(data['endpoints'].items())
+    metric('farm_http_requests_total', 'counter', '请求数',
+           [((('endpoint', name),), s['count']) for name, s in endpoints])
+    metric('farm_http_request_errors_total', 'counter', '5xx 请求数',
+           [((('endpoint', name),), s['errors']) for name, s in endpoints])
+
+    lines.append('# HELP farm_http_request_duration_seconds 请求耗时')
+    lines.append('# TYPE farm_http_request_duration_seconds histogram')
+    for name, s in endpoints:
+        cumulative = 0
+        for bound, n in zip(BUCKETS_MS + ('+Inf',), s['buckets']):
+            cumulative += n
+            le = bound if bound == '+Inf' else bound / 1000
+            lines.append('farm_http_request_duration_seconds_bucket{{endpoint="{}",le="{}"}} {}'
+                         .format(_label(name), le, cumulative))
+        lines.append('farm_http_request_duration_seconds_sum{{endpoint="{}"}} {}'
+                     .format(_label(name), round(s['wall_ms'] / 1000, 6)))
+        lines.append('farm_http_request_duration_seconds_count{{endpoint="{}"}} {}'.format(_label(name), s['count']))
+
+    metric('farm_sql_statements_total', 'counter', 'SQL 语句数',
+           [((('endpoint', name),), s['sql_count']) for name, s in endpoints])
+    metric('farm_sql_duration_seconds_total', 'counter', 'SQL 耗时',
+           [((('endpoint', name),), round(s['sql_ms'] / 1000, 6)) for name, s in endpoints])
+    metric('farm_sql_rows_total', 'counter', 'SQL 返回行数',
+           [((('endpoint', name),), s['rows']) for name, s in endpoints])
+    metric('farm_slow_queries_total', 'counter', '超过 SLOW_QUERY_MS 的语句数（按归一化语句）',
+           [((('query', sql),), e['count']) for sql, e in sorted(data['slow_queries'].items())])
+    occ = sorted(data.get('concurrency', {}).items())
+    metric('farm_occ_attempts_total', 'counter', '乐观并发操作的事务次数（含重试）',
+           [((('action', name),), c['attempts']) for name, c in occ])
+    metric('farm_occ_conflicts_total', 'counter', 'CAS 版本冲突次数',
+           [((('action', name),), c['conflicts']) for name, c in occ])
+    metric('farm_occ_retries_exhausted_total', 'counter', '冲突重试用尽、返回失败的次数',
+           [((('action', name),), c['exhausted']) for name, c in occ])
+    metric('farm_db_busy_retries_total', 'counter', '数据库忙（SQLITE_BUSY 等）退避重试次数',
+           [((('action', name),), c['busy']) for name, c in occ])
+    metric('farm_metrics_workers', 'gauge', '参与汇总的 worker 数', [((), data['workers'])])
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    if not ENABLED:
+        return
+    if db.BACKEND == 'postgresql':
+        import postgres
+        postgres.statement_observer = _record_sql
+    # 压测等场景可能已经换成了 InstrumentedConnection 的子类，不覆盖
+    elif db.connection_factory is sqlite3.Connection:
+        db.connection_factory = InstrumentedConnection
+    app.before_request(_start_request)
+    app.after_request(_set_status)
+    app.teardown_request(_finish_request)
@@ -0,0 +1,231 @@
+# migrations.py
+# 版本化的数据库迁移：应用启动时执行，已执行过的版本记录在 SchemaVersion 表中。
+# 每个迁移在一个 BEGIN IMMEDIATE 事务里执行，多个 gunicorn worker 同时启动时
+# 只有一个会真正执行，其余的拿到写锁后发现版本已更新便直接跳过。
+import sqlite3
+
+import db
+
+
+# 迁移 8 的触发器。SQLite 直接写触发器体；PostgreSQL 的触发器要先建 plpgsql 函数。
+_SQLITE_REVISION_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_{name}_revision AFTER {event} ON {table}
+    BEGIN
+        UPDATE Player SET Revision = Revision + 1 WHERE PlayerID IN ({rows});
+    END
+    """.format(name='{}_{}'.format(table, event).lower(), table=table, event=event, rows=rows)
+    for table in ('Inventory', 'Plot')
+    for event, rows in (('INSERT', 'NEW.PlayerID'), ('UPDATE', 'OLD.PlayerID, NEW.PlayerID'),
+                        ('DELETE', 'OLD.PlayerID'))
+] + [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_user_{name}_version AFTER {event} ON User
+    BEGIN
+        UPDATE CacheVersion SET Version = Version + 1 WHERE Name = 'users';
+    END
+    """.format(name=name, event=event)
+    for name, event in (('insert', 'INSERT'), ('delete', 'DELETE'), ('update', 'UPDATE OF Username, Role'))
+]
+
+_POSTGRES_REVISION_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION bump_player_revision() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            UPDATE Player SET Revision = Revision + 1 WHERE PlayerID = OLD.PlayerID;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            UPDATE Player SET Revision = Revision + 1 WHERE PlayerID = NEW.PlayerID;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION bump_users_version() RETURNS trigger AS $$
+    BEGIN
+        UPDATE CacheVersion SET Version = Version + 1 WHERE Name = 'users';
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+    """,
+    "CREATE TRIGGER trg_inventory_revision AFTER INSERT OR UPDATE OR DELETE ON Inventory "
+    "FOR EACH ROW EXECUTE FUNCTION bump_player_revision()",
+    "CREATE TRIGGER trg_plot_revision AFTER INSERT OR UPDATE OR DELETE ON Plot "
+    "FOR EACH ROW EXECUTE FUNCTION bump_player_revision()",
+    "CREATE TRIGGER trg_user_version AFTER INSERT OR DELETE OR UPDATE OF Username, Role ON User "
+    "FOR EACH STATEMENT EXECUTE FUNCTION bump_users_version()",
+]
+
+
+def create_revision_triggers(conn):
+    for statement in _SQLITE_REVISION_TRIGGERS if isinstance(conn, sqlite3.Connection) else _POSTGRES_REVISION_TRIGGERS:
+        conn.execute(statement)
+
+# (版本号, 说明, [SQL 语句或接收 conn 的函数, ...])
+MIGRATIONS = [
+    (1, '热点查询的二级索引', [
+        # plant / next_day / harvest 按 (PlayerID, Status) 过滤地块
+        "CREATE INDEX IF NOT EXISTS idx_plot_player_status ON Plot(PlayerID, Status)",
+        # view_orders 按 Status 列出订单
+        "CREATE INDEX IF NOT EXISTS idx_villagerorder_status ON VillagerOrder(Status)",
+        # 按玩家查询金币流水
+        "CREATE INDEX IF NOT EXISTS idx_goldtransaction_player_time ON GoldTransaction(PlayerID, Timestamp)",
+    ]),
+    (2, '缓存版本号表（目录缓存失效用）', [
+        """
+        CREATE TABLE IF NOT EXISTS CacheVersion (
+            Name TEXT PRIMARY KEY,
+            Version INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "INSERT INTO CacheVersion (Name, Version) VALUES ('catalog', 0) ON CONFLICT DO NOTHING",
+    ]),
+    (3, '植物与种子/产物物品的显式关联', [
+        "ALTER TABLE Plant ADD COLUMN SeedItemID INTEGER REFERENCES Item(ItemID)",
+        "ALTER TABLE Plant ADD COLUMN ProduceItemID INTEGER REFERENCES Item(ItemID)",
+        # 按原有命名约定回填：“萝卜种子” 种出 “萝卜”
+        """
+        UPDATE Plant SET
+            SeedItemID = (SELECT ItemID FROM Item WHERE ItemName = Plant.PlantName || '种子'),
+            ProduceItemID = (SELECT ItemID FROM Item WHERE ItemName = Plant.PlantName)
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_plant_seed_item ON Plant(SeedItemID)",
+        "CREATE INDEX IF NOT EXISTS idx_plant_produce_item ON Plant(ProduceItemID)",
+        "UPDATE CacheVersion SET Version = Version + 1 WHERE Name = 'catalog'",
+    ]),
+    (4, '按时间戳推算作物生长', [
+        "ALTER TABLE Plot ADD COLUMN PlantedAt INTEGER",
+        "ALTER TABLE Plot ADD COLUMN WaterBonus INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE Plot ADD COLUMN GrowthRate REAL NOT NULL DEFAULT 1.0",
+        "ALTER TABLE Player ADD COLUMN ClockOffset INTEGER NOT NULL DEFAULT 0",
+        # 已种植的地块换算成 “在过去某个时刻种下”，保持剩余时间不变；Ready 改为推算
+        """
+        UPDATE Plot SET
+            PlantedAt = -((SELECT BaseGrowthTime FROM Plant WHERE PlantID = Plot.PlantedPlantID)
+                          - COALESCE(CurrentGrowthTimeLeft, 0)),
+            Status = 'Growing',
+            CurrentGrowthTimeLeft = NULL
+        WHERE Status IN ('Growing', 'Ready')
+        """,
+    ]),
+    (5, '世界时钟与定时任务租约', [
+        """
+        CREATE TABLE IF NOT EXISTS WorldClock (
+            ID INTEGER PRIMARY KEY CHECK (ID = 1),
+            Tick INTEGER NOT NULL DEFAULT 0,
+            LastTickAt REAL,
+            LastDurationMs REAL,
+            LastRows INTEGER,
+            LastLagMs REAL
+        )
+        """,
+        "INSERT INTO WorldClock (ID, Tick) VALUES (1, 0) ON CONFLICT DO NOTHING",
+        """
+        CREATE TABLE IF NOT EXISTS SchedulerLease (
+            Name TEXT PRIMARY KEY,
+            Owner TEXT NOT NULL,
+            ExpiresAt REAL NOT NULL
+        )
+        """,
+        # 过期订单扫描按 (Status, ExpiryTime) 走索引，原来的 Status 单列索引是它的前缀
+        "CREATE INDEX IF NOT EXISTS idx_villagerorder_status_expiry ON VillagerOrder(Status, ExpiryTime)",
+        "DROP INDEX IF EXISTS idx_villagerorder_status",
+    ]),
+    (6, '记录完成订单的玩家', [
+        # 完成订单时会写 VillagerOrder.PlayerID，但原表结构里没有这一列
+        "ALTER TABLE VillagerOrder ADD COLUMN PlayerID INTEGER REFERENCES Player(PlayerID)",
+    ]),
+    (7, '新玩家初始物品表', [
+        """
+        CREATE TABLE IF NOT EXISTS StarterKit (
+            ItemID INTEGER PRIMARY KEY REFERENCES Item(ItemID),
+            Quantity INTEGER NOT NULL CHECK(Quantity > 0)
+        )
+        """,
+        # 原来 register() 里写死的 [(1, 3), (3, 2)]
+        "INSERT INTO StarterKit (ItemID, Quantity) SELECT ItemID, 3 FROM Item WHERE ItemID = 1 ON CONFLICT DO NOTHING",
+        "INSERT INTO StarterKit (ItemID, Quantity) SELECT ItemID, 2 FROM Item WHERE ItemID = 3 ON CONFLICT DO NOTHING",
+        "UPDATE CacheVersion SET Version = Version + 1 WHERE Name = 'catalog'",
+    ]),
+    (8, '片段缓存用的版本号', [
+        # 玩家库存 / 地块的修改计数，玩家主页的片段缓存按它判断是否过期
+        "ALTER TABLE Player ADD COLUMN Revision INTEGER NOT NULL DEFAULT 0",
+        "INSERT INTO CacheVersion (Name, Version) VALUES ('users', 0) ON CONFLICT DO NOTHING",
+        # 用触发器维护，HTML 路由、API、管理后台、批量开通等所有写入口都不会漏掉
+        create_revision_triggers,
+    ]),
+    (9, '金币账本对账', [
+        # 对账只汇总检查点之后的流水：按 (PlayerID, TransactionID) 范围扫描，索引覆盖 Type / Amount
+        "CREATE INDEX IF NOT EXISTS idx_goldtransaction_player_id ON GoldTransaction(PlayerID, TransactionID, Type, Amount)",
+        """
+        CREATE TABLE IF NOT EXISTS LedgerCheckpoint (
+            PlayerID INTEGER PRIMARY KEY REFERENCES Player(PlayerID),
+            TransactionID INTEGER NOT NULL,
+            Balance INTEGER NOT NULL
+        )
+        """,
+        # 以前收获、注册送的金币没有流水：差额记一条开户调整，之后余额和流水一致
+        """
+        INSERT INTO GoldTransaction (PlayerID, Type, Amount, SourceReference)
+        SELECT p.PlayerID, 'Adjustment', p.CurrentGold - COALESCE(t.Total, 0), 'opening'
+        FROM Player p
+        LEFT JOIN (
+            SELECT PlayerID, SUM(CASE WHEN Type = 'Expense' THEN -Amount ELSE Amount END) AS Total
+            FROM GoldTransaction GROUP BY PlayerID
+        ) t ON t.PlayerID = p.PlayerID
+        WHERE p.CurrentGold <> COALESCE(t.Total, 0)
+        """,
+    ]),
+    (10, '订单板按库存匹配订单', [
+        # orders.board 从玩家的库存行出发，按物品找可接订单，RequiredQuantity 上的范围条件也走索引
+        "CREATE INDEX IF NOT EXISTS idx_villagerorder_board ON VillagerOrder(Status, RequiredItemID, RequiredQuantity)",
+    ]),
+    (11, '乐观并发控制的版本号', [
+        # 见 concurrency.py：写这三张表的 UPDATE 都要 Version = Version + 1，先读后写的操作按它做 CAS
+        "ALTER TABLE Plot ADD COLUMN Version INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE Inventory ADD COLUMN Version INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE Player ADD COLUMN Version INTEGER NOT NULL DEFAULT 0",
+    ]),
+]
+
+
+def ensure_version_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS SchemaVersion (
+            Version INTEGER PRIMARY KEY,
+            Description TEXT NOT NULL,
+            AppliedAt TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def current_version(conn):
+    row = conn.execute("SELECT MAX(Version) FROM SchemaVersion").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn):
+    """执行所有未应用的迁移，返回本次应用的版本号列表。"""
+    ensure_version_table(conn)
+    conn.commit()
+
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= current_version(conn):
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute("INSERT INTO SchemaVersion (Version, Description) VALUES (?, ?)",
+                         (version, description))
+            conn.commit()
+        except db.Error:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
@@ -0,0 +1,199 @@
+# orders.py
+# 村民订单：订单板查询、接单、批量生成 / 过期。HTML 路由、JSON API 和调度器共用。
+#
+# 订单板：每个玩家只看到自己仓库里的物品能完成、或差得不多（持有量 >= 需求 × NEAR_RATIO）的订单。
+# 一条查询从玩家的 Inventory 行出发，按 (Status, RequiredItemID, RequiredQuantity) 索引
+# 找匹配的订单，不扫描整个订单表，订单再多也只读和玩家持有物品相关的那部分。
+# （CROSS JOIN 让 SQLite 固定以 Inventory 为外层，不会在统计信息不足时改成先扫订单。）
+#
+# 接单：一个 BEGIN IMMEDIATE 事务里先用 WHERE Status = 'Available' 的条件 UPDATE 占下订单，
+# 再用 WHERE Quantity >= ? 的条件 UPDATE 扣物品，任一步影响 0 行就整体回滚，
+# 两个玩家同时提交同一订单时只有一个能成功，物品也不会被扣成负数。
+#
+# 命令行：
+#   python orders.py generate --count 200 --ttl-hours 24   # 批量发布随机订单
+#   python orders.py expire                                # 把已过期的订单标记为 Expired
+import argparse
+import os
+import random
+import time
+
+import db
+import economy
+from catalog import ORDERS_KEY, bump_version
+
+NEAR_RATIO = float(os.environ.get('ORDER_NEAR_RATIO', 0.5))
+# 订单板查询用 RequiredQuantity <= Quantity / NEAR_RATIO 走索引范围扫描，比例必须大于 0
+if not 0 < NEAR_RATIO <= 1:
+    raise ValueError('ORDER_NEAR_RATIO 必须在 (0, 1] 之间：{}'.format(NEAR_RATIO))
+BOARD_LIMIT = int(os.environ.get('ORDER_BOARD_LIMIT', 50))
+# 调度器每次 tick 把可接订单补到这个数量，0 表示不自动发布
+BOARD_TARGET = int(os.environ.get('ORDER_BOARD_TARGET', 0))
+TTL_HOURS = float(os.environ.get('ORDER_TTL_HOURS', 24))
+MAX_QUANTITY = 5
+
+
+class OrderError(Exception):
+    pass
+
+
+def utc_text(ts=None):
+    # 与 SQLite datetime('now') 相同的格式（UTC），两种数据库都能直接比较 ExpiryTime
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))
+
+
+def board(conn, catalog, player_id, near_ratio=NEAR_RATIO, limit=BOARD_LIMIT):
+    """玩家能完成或接近完成的订单，能完成的排在前面，同类按金币奖励从高到低。"""
+    rows = conn.execute("""
+        SELECT vo.OrderID, vo.VillagerID, vo.RequiredItemID, vo.RequiredQuantity,
+               vo.RewardGold, vo.RewardAffection, vo.ExpiryTime, i.Quantity AS Have
+        FROM Inventory i
+        CROSS JOIN VillagerOrder vo
+        WHERE i.PlayerID = ? AND i.Quantity > 0
+          AND vo.Status = 'Available' AND vo.RequiredItemID = i.ItemID
+          AND vo.RequiredQuantity <= i.Quantity * ?
+          AND (vo.ExpiryTime IS NULL OR vo.ExpiryTime > ?)
+        ORDER BY CASE WHEN vo.RequiredQuantity <= i.Quantity THEN 0 ELSE 1 END,
+                 vo.RewardGold DESC, vo.OrderID
+        LIMIT ?
+    """, (player_id, 1 / near_ratio, utc_text(), limit)).fetchall()
+
+    orders = []
+    for row in rows:
+        order = dict(row)
+        villager = catalog.villagers.get(row['VillagerID'])
+        item = catalog.items.get(row['RequiredItemID'])
+        order['VillagerName'] = villager['VillagerName'] if villager else '?'
+        order['ItemName'] = item['ItemName'] if item else '?'
+        order['Missing'] = max(0, row['RequiredQuantity'] - row['Have'])
+        orders.append(order)
+    return orders
+
+
+def next_expiry(conn):
+    """还在订单板上的订单里最早的过期时间（没有则为 None）；走 (Status, ExpiryTime) 索引。
+
+    订单到期只靠时间流逝、不写数据库（调度器关闭时也不会被标记为 Expired），
+    页面 ETag 带上它，过了这个时间 ETag 就会变。
+    """
+    return conn.execute("""
+        SELECT MIN(ExpiryTime) FROM VillagerOrder
+        WHERE Status = 'Available' AND ExpiryTime > ?
+    """, (utc_text(),)).fetchone()[0]
+
+
+def claim(conn, player_id, order_id):
+    """用仓库里的物品完成订单：占订单、扣物品、加金币和好感在一个事务里，返回订单行。"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cur = conn.execute("""
+            UPDATE VillagerOrder SET Status = 'Completed', PlayerID = ?
+            WHERE OrderID = ? AND Status = 'Available'
+              AND (ExpiryTime IS NULL OR ExpiryTime > ?)
+        """, (player_id, order_id, utc_text()))
+        if cur.rowcount != 1:
+            raise OrderError("订单无效或已完成。")
+
+        order = conn.execute("""
+            SELECT OrderID, VillagerID, RequiredItemID, RequiredQuantity, RewardGold, RewardAffection
+            FROM VillagerOrder WHERE OrderID = ?
+        """, (order_id,)).fetchone()
+
+        cur = conn.execute("""
+            UPDATE Inventory SET Quantity = Quantity - ?, Version = Version + 1
+            WHERE PlayerID = ? AND ItemID = ? AND Quantity >= ?
+        """, (order['RequiredQuantity'], player_id, order['RequiredItemID'], order['RequiredQuantity']))
+        if cur.rowcount != 1:
+            raise OrderError("仓库物品不足，无法完成订单。")
+
+        economy.apply(conn, [(player_id, order['RewardGold'], economy.reference('order', order_id))])
+        conn.execute("""
+            INSERT INTO Affection (PlayerID, VillagerID, AffectionLevel)
+            VALUES (?, ?, ?)
+            ON CONFLICT(PlayerID, VillagerID) DO UPDATE SET AffectionLevel = Affection.AffectionLevel + excluded.AffectionLevel
+        """, (player_id, order['VillagerID'], order['RewardAffection']))
+        bump_version(conn, ORDERS_KEY)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return order
+
+
+# ===== 批量发布 / 过期 =====
+
+def _random_orders(catalog, count, expiry, rng):
+    """村民随机要作物：奖励按作物售价 × 数量再加 20%～100%。"""
+    villagers = list(catalog.villagers)
+    crops = [(plant['ProduceItemID'], plant['SellPrice']) for plant in catalog.plants.values()
+             if plant['ProduceItemID'] in catalog.items]
+    if not villagers or not crops:
+        return []
+    orders = []
+    for _ in range(count):
+        item_id, price = rng.choice(crops)
+        qty = rng.randint(1, MAX_QUANTITY)
+        orders.append((rng.choice(villagers), item_id, qty, int(price * qty * rng.uniform(1.2, 2.0)), qty, expiry))
+    return orders
+
+
+def generate(conn, catalog, count, ttl_hours=TTL_HOURS, rng=None):
+    """一个事务里发布 count 个随机订单（一条 executemany），返回实际发布的数量。"""
+    expiry = utc_text(time.time() + ttl_hours * 3600) if ttl_hours else None
+    orders = _random_orders(catalog, count, expiry, rng or random.Random())
+    if not orders:
+        return 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany("""
+            INSERT INTO VillagerOrder (VillagerID, RequiredItemID, RequiredQuantity, RewardGold,
+                                       RewardAffection, ExpiryTime)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, orders)
+        bump_version(conn, ORDERS_KEY)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(orders)
+
+
+def replenish(conn, catalog, target=BOARD_TARGET, ttl_hours=TTL_HOURS):
+    """可接订单不足 target 个时补齐，返回发布的数量。"""
+    if target <= 0:
+        return 0
+    open_count = conn.execute("SELECT COUNT(*) FROM VillagerOrder WHERE Status = 'Available'").fetchone()[0]
+    if open_count >= target:
+        return 0
+    return generate(conn, catalog, target - open_count, ttl_hours)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='村民订单批量维护')
+    parser.add_argument('command', choices=['generate', 'expire'])
+    parser.add_argument('--db', help='数据库路径（默认按 DATABASE_URL）')
+    parser.add_argument('--count', type=int, default=100, help='generate 发布的订单数')
+    parser.add_argument('--ttl-hours', type=float, default=TTL_HOURS, help='订单有效期，0 表示不过期')
+    parser.add_argument('--seed', type=int, help='随机种子')
+    args = parser.parse_args(argv)
+
+    import catalog as catalog_module
+    import migrations
+    import scheduler
+    conn = db.connect(args.db)
+    migrations.migrate(conn)
+    started = time.monotonic()
+    try:
+        if args.command == 'generate':
+            catalog = catalog_module.load(conn, catalog_module.read_version(conn))
+            count = generate(conn, catalog, args.count, args.ttl_hours, random.Random(args.seed))
+            print('✅ 已发布 {} 个订单，用时 {:.2f}s'.format(count, time.monotonic() - started))
+        else:
+            rows, chunks = scheduler.expire_orders(conn)
+            print('✅ 已过期 {} 个订单（{} 批），用时 {:.2f}s'.format(rows, chunks, time.monotonic() - started))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# paging.py
+# 管理后台的键集分页（keyset pagination）：用上一页最后一行的排序列值作为游标，
+# WHERE 列 > 游标 ORDER BY 列 LIMIT n，每页都走索引、只读 n + 1 行，
+# 翻到第几页都不会变慢，也不需要 OFFSET 或 COUNT(*) 全表扫描。
+# 排序列必须唯一且有索引（主键或 UNIQUE 列），否则游标会跳过 / 重复同值的行。
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class Page:
+    def __init__(self, rows, next_after=None, prev_before=None):
+        self.rows = rows
+        self.next_after = next_after       # 下一页的 after 游标，None 表示已是最后一页
+        self.prev_before = prev_before     # 上一页的 before 游标，None 表示已是第一页
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def prefix_range(prefix):
+    """前缀搜索转成范围条件 [prefix, upper)，可以用普通索引，不依赖 LIKE 的大小写规则。"""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def keyset(conn, select, column, key, filters=(), after=None, before=None, desc=False, limit=PAGE_SIZE):
+    """执行一页查询。
+
+    select 是不带 WHERE / ORDER BY / LIMIT 的 SELECT，column 是排序列（SQL 表达式），
+    key 是该列在结果行里的名字；filters 为 [(条件, 参数元组), ...]。
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    backward = before is not None
+    conditions = [condition for condition, _ in filters]
+    params = [value for _, values in filters for value in values]
+    # 往后翻：asc 取大于游标的行；往前翻反过来，取完再倒序
+    if backward or after is not None:
+        conditions.append('{} {} ?'.format(column, '<' if desc != backward else '>'))
+        params.append(before if backward else after)
+
+    sql = select
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY {} {} LIMIT ?'.format(column, 'DESC' if desc != backward else 'ASC')
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+        return Page(rows, rows[-1][key] if rows else None, rows[0][key] if more and rows else None)
+    return Page(rows, rows[-1][key] if more else None, rows[0][key] if after is not None and rows else None)
@@ -0,0 +1,118 @@
+# passwords.py
+# 密码哈希：参数由环境变量配置，计算放到每个进程一个有上限的线程池里
+# （hashlib 的 pbkdf2 / scrypt 计算时会释放 GIL）。请求线程仍会阻塞等待结果，线程池限制的是
+# 同时做哈希的 CPU 占用：登录高峰时最多 WORKERS 个哈希并行，其余请求排队；
+# 排队已满或等待超过 PASSWORD_HASH_TIMEOUT 秒时抛出 PasswordBusy，路由返回 503 和 Retry-After，
+# 而不是让请求一直挂着或报 500。登录成功时如果发现旧哈希的参数和当前配置不同，
+# 在后台用当前参数重新哈希并写回 User.Password，旧账号不受影响。
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+import db
+
+# werkzeug 的写法：pbkdf2:sha256:600000 或 scrypt:32768:8:1
+HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:{}'.format(DEFAULT_PBKDF2_ITERATIONS))
+SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 16))   # 执行中 + 排队中的任务上限
+TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+RETRY_AFTER = int(os.environ.get('PASSWORD_HASH_RETRY_AFTER', 2))   # 繁忙时 503 响应的 Retry-After（秒）
+
+# 省略参数时 werkzeug 使用的默认值
+_METHOD_DEFAULTS = {
+    'pbkdf2': ['pbkdf2', 'sha256', str(DEFAULT_PBKDF2_ITERATIONS)],
+    'scrypt': ['scrypt', str(2 ** 15), '8', '1'],
+}
+
+
+class PasswordBusy(Exception):
+    pass
+
+
+def normalize_method(method):
+    """把 'pbkdf2' / 'scrypt:16384' 之类的写法补全成完整参数，便于比较。"""
+    parts = method.split(':')
+    defaults = _METHOD_DEFAULTS.get(parts[0])
+    if not defaults:
+        return method
+    return ':'.join(parts + defaults[len(parts):])
+
+
+def needs_rehash(pw_hash):
+    return normalize_method(pw_hash.split('$', 1)[0]) != normalize_method(HASH_METHOD)
+
+
+class _HashPool:
+    def __init__(self):
+        self.pid = os.getpid()
+        self.executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(MAX_PENDING)
+
+    def submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise PasswordBusy('服务器繁忙，请稍后再试')
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    # 和连接池一样，fork 出的 worker 按 pid 各建一个
+    global _pool
+    pid = os.getpid()
+    if _pool is None or _pool.pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool.pid != pid:
+                _pool = _HashPool()
+    return _pool
+
+
+def _wait(future):
+    try:
+        return future.result(timeout=TIMEOUT)
+    except FutureTimeout:
+        # 还在排队的任务直接取消，不再占用线程池
+        future.cancel()
+        raise PasswordBusy('服务器繁忙，请稍后再试')
+
+
+def hash_password(password):
+    return _wait(_get_pool().submit(generate_password_hash, password, HASH_METHOD, SALT_LENGTH))
+
+
+def verify_password(pw_hash, password):
+    return _wait(_get_pool().submit(check_password_hash, pw_hash, password))
+
+
+def _rehash(user_id, old_hash, password):
+    new_hash = generate_password_hash(password, HASH_METHOD, SALT_LENGTH)
+    conn = db.connect()
+    try:
+        # 只在密码没被其它请求改过时写回
+        conn.execute("UPDATE User SET Password = ? WHERE UserID = ? AND Password = ?",
+                     (new_hash, user_id, old_hash))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def rehash_if_needed(user_id, pw_hash, password):
+    """登录成功后调用：参数过期时在后台重新哈希；线程池忙就等下次登录。"""
+    if not needs_rehash(pw_hash):
+        return False
+    try:
+        _get_pool().submit(_rehash, user_id, pw_hash, password)
+    except PasswordBusy:
+        return False
+    return True
@@ -0,0 +1,216 @@
+# postgres.py
+# PostgreSQL 后端（DATABASE_URL=postgresql://...，需要 pip install psycopg2-binary）。
+# 把 psycopg2 连接包装成和 sqlite3 连接一样的用法，业务代码里的 SQL 不用分两套写：
+#   - ? / :name 参数转成 %s / %(name)s；
+#   - 表名、列名（PlayerID、User 这种大小写混合的标识符，以及 ID）加双引号，保留大小写，
+#     同时避开 User 这类保留字；结果行可以用 row['PlayerID'] / row[0] 访问；
+#   - BEGIN IMMEDIATE 转成 BEGIN + 事务级 advisory 锁，和 SQLite 一样同一时间只有一个写事务，
+#     原来依赖"先读后写"不被打断的逻辑不需要改；
+#   - 和 sqlite3 默认行为一致：INSERT / UPDATE / DELETE 前自动开启事务，其它语句自动提交；
+#   - 建表语句里的 AUTOINCREMENT / REAL / 外键映射成 SERIAL / DOUBLE PRECISION / 不建外键
+#     （SQLite 连接没有开启 foreign_keys，两边行为保持一致）。
+import re
+import time
+from functools import lru_cache
+
+try:
+    import psycopg2
+except ImportError:  # 只在使用 PostgreSQL 时才需要
+    psycopg2 = None
+
+# metrics.init_app 会把它设为记录 SQL 耗时的函数 (sql, elapsed_ms, rows)
+statement_observer = None
+
+WRITE_LOCK_KEY = 0x6661726d   # 'farm'
+
+_TOKEN = re.compile(r"'(?:[^']|'')*'|\"[^\"]*\"|\?|%|:[A-Za-z_]\w*|[A-Za-z_]\w*")
+_AUTOINCREMENT = re.compile(r'INTEGER\s+PRIMARY\s+KEY\s+AUTOINCREMENT', re.I)
+_FOREIGN_KEY = re.compile(r',\s*FOREIGN\s+KEY\s*\([^)]*\)\s*REFERENCES\s+\w+\s*\([^)]*\)', re.I)
+_REFERENCES = re.compile(r'\s+REFERENCES\s+\w+\s*\(\w+\)', re.I)
+_DML = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+@lru_cache(maxsize=1024)
+def translate(sql):
+    """把本项目的 SQLite 写法转成 PostgreSQL。"""
+    head = sql.lstrip()[:12].upper()
+    if head.startswith('CREATE TABLE') or head.startswith('ALTER TABLE'):
+        sql = _FOREIGN_KEY.sub('', sql)
+        sql = _REFERENCES.sub('', sql)
+        sql = _AUTOINCREMENT.sub('SERIAL PRIMARY KEY', sql)
+
+    def replace(match):
+        token = match.group(0)
+        if token[0] in '\'"':
+            return token.replace('%', '%%')
+        if token == '?':
+            return '%s'
+        if token == '%':
+            return '%%'
+        if token[0] == ':':
+            return '%({})s'.format(token[1:])
+        if token == 'REAL':
+            return 'DOUBLE PRECISION'
+        # 关键字全大写、别名 / 函数全小写，大小写混合的是表名和列名
+        if token == 'ID' or not (token.isupper() or token.islower()):
+            return '"{}"'.format(token)
+        return token
+
+    return _TOKEN.sub(replace, sql)
+
+
+class Row:
+    """兼容 sqlite3.Row：按下标或列名取值，支持 keys() / dict(row)。"""
+    __slots__ = ('_values', '_index')
+
+    def __init__(self, values, index):
+        self._values = values
+        self._index = index
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def keys(self):
+        return list(self._index)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return 'Row({!r})'.format(dict(zip(self._index, self._values)))
+
+
+class Cursor:
+    def __init__(self, conn):
+        self.connection = conn
+        self._raw = conn.raw.cursor()
+        self._index = None
+
+    @property
+    def rowcount(self):
+        return self._raw.rowcount
+
+    @property
+    def description(self):
+        return self._raw.description
+
+    def _run(self, sql, run):
+        self.connection._before(sql)
+        started = time.perf_counter()
+        run()
+        self._index = ({col.name: i for i, col in enumerate(self._raw.description)}
+                       if self._raw.description else None)
+        if statement_observer is not None:
+            rows = self._raw.rowcount if self._raw.description else 0
+            statement_observer(sql, (time.perf_counter() - started) * 1000, max(rows, 0))
+        return self
+
+    def execute(self, sql, params=()):
+        upper = sql.strip().upper()
+        if upper.startswith('BEGIN'):
+            return self._run(sql, lambda: self.connection._begin(upper == 'BEGIN IMMEDIATE'))
+        return self._run(sql, lambda: self._raw.execute(translate(sql), params if params is not None else ()))
+
+    def executemany(self, sql, seq_of_params):
+        return self._run(sql, lambda: self._raw.executemany(translate(sql), list(seq_of_params)))
+
+    def _row(self, values):
+        return Row(values, self._index) if values is not None else None
+
+    def fetchone(self):
+        return self._row(self._raw.fetchone())
+
+    def fetchmany(self, size=None):
+        rows = self._raw.fetchmany(size) if size else self._raw.fetchmany()
+        return [Row(values, self._index) for values in rows]
+
+    def fetchall(self):
+        return [Row(values, self._index) for values in self._raw.fetchall()]
+
+    def __iter__(self):
+        for values in self._raw:
+            yield Row(values, self._index)
+
+
+class Connection:
+    def __init__(self, raw):
+        self.raw = raw
+        self.in_transaction = False
+
+    @property
+    def closed(self):
+        return bool(self.raw.closed)
+
+    def _begin(self, write_lock=False):
+        if not self.in_transaction:
+            self.raw.cursor().execute('BEGIN')
+            self.in_transaction = True
+        if write_lock:
+            self.raw.cursor().execute('SELECT pg_advisory_xact_lock(%s)', (WRITE_LOCK_KEY,))
+
+    def _before(self, sql):
+        if not self.in_transaction and sql.lstrip()[:7].upper().startswith(_DML):
+            self._begin()
+
+    def cursor(self):
+        return Cursor(self)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, script):
+        for statement in script.split(';'):
+            if statement.strip():
+                self.execute(statement)
+        self.commit()
+
+    def commit(self):
+        if self.in_transaction:
+            self.in_transaction = False
+            self.raw.cursor().execute('COMMIT')
+
+    def rollback(self):
+        if self.in_transaction:
+            self.in_transaction = False
+            self.raw.cursor().execute('ROLLBACK')
+
+    def close(self):
+        self.raw.close()
+
+
+def connect(url, timeout_ms=5000):
+    if psycopg2 is None:
+        raise RuntimeError('DATABASE_URL 指向 PostgreSQL，但没有安装 psycopg2（pip install psycopg2-binary）')
+    raw = psycopg2.connect(url, connect_timeout=max(1, int(timeout_ms / 1000)),
+                           options='-c lock_timeout={}'.format(int(timeout_ms)))
+    # 事务由 Connection 按 sqlite3 的规则显式开启
+    raw.autocommit = True
+    return Connection(raw)
+
+
+def reserve_ids(conn, table, column, count):
+    """从 SERIAL 列的序列里预先取 count 个 ID。"""
+    rows = conn.raw.cursor()
+    rows.execute("SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+                 ('"{}"'.format(table), column, count))
+    return [row[0] for row in rows.fetchall()]
+
+
+def drop_tables(conn, tables):
+    for table in tables:
+        conn.raw.cursor().execute('DROP TABLE IF EXISTS "{}" CASCADE'.format(table))
+
+
+def error_classes():
+    """(Error, IntegrityError, OperationalError)，未安装 psycopg2 时为空。"""
+    if psycopg2 is None:
+        return (), (), ()
+    return (psycopg2.Error,), (psycopg2.IntegrityError,), (psycopg2.OperationalError,)
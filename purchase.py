@@ -0,0 +1,56 @@
+# purchase.py
+# 商店购买：一次购买（可以是多种物品、任意数量）在一个 BEGIN IMMEDIATE 事务里完成，
+# 经 economy 扣金币并记一条流水（余额不足时整单回滚），用 ON CONFLICT 一次写入库存。
+import economy
+
+MAX_QUANTITY = 999
+
+
+class PurchaseError(Exception):
+    pass
+
+
+def normalize_cart(cart, prices):
+    """校验 [(item_id, qty), ...]，合并重复物品，返回 ({item_id: qty}, 总价)。"""
+    lines = {}
+    for item_id, qty in cart:
+        try:
+            item_id, qty = int(item_id), int(qty)
+        except (TypeError, ValueError):
+            raise PurchaseError('购买数量无效')
+        if qty <= 0:
+            continue
+        if item_id not in prices:
+            raise PurchaseError('商品不存在')
+        lines[item_id] = lines.get(item_id, 0) + qty
+        if lines[item_id] > MAX_QUANTITY:
+            raise PurchaseError('单次最多购买 {} 个'.format(MAX_QUANTITY))
+    if not lines:
+        raise PurchaseError('请选择要购买的商品')
+    total = sum(prices[item_id] * qty for item_id, qty in lines.items())
+    return lines, total
+
+
+def buy(conn, player_id, cart, prices):
+    """购买购物车中的物品，返回 (明细 {item_id: qty}, 总价)；失败时抛出 PurchaseError。"""
+    lines, total = normalize_cart(cart, prices)
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        try:
+            economy.apply(conn, [(player_id, -total, economy.reference(
+                'shop', ','.join('{}x{}'.format(item_id, qty) for item_id, qty in lines.items())))])
+        except economy.InsufficientGold as e:
+            raise PurchaseError(str(e))
+
+        conn.executemany("""
+            INSERT INTO Inventory (PlayerID, ItemID, Quantity)
+            VALUES (?, ?, ?)
+            ON CONFLICT(PlayerID, ItemID) DO UPDATE SET Quantity = Inventory.Quantity + excluded.Quantity,
+                                                        Version = Inventory.Version + 1
+        """, [(player_id, item_id, qty) for item_id, qty in lines.items()])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return lines, total
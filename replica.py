@@ -0,0 +1,187 @@
+# replica.py
+# 只读路由：商店、订单、玩家主页、管理后台这几个只读页面的整个请求（包括登录检查、目录版本、
+# ETag / 片段缓存的版本号）都从只读连接池读，不占主库连接池，也不会和写事务抢连接。
+# DB_READ_MODE 选择读哪里：
+#   off（默认）  ：不区分，和以前一样用主库连接池；
+#   readonly     ：单独的只读连接池，同一个数据库文件以 mode=ro 打开并设置 query_only；
+#   snapshot     ：每个 worker 的后台线程每 DB_SNAPSHOT_SECONDS 秒用 SQLite 在线备份 API
+#                  把数据库复制成一个快照文件，只读页面读快照，和写者完全不共享锁和 WAL。
+# 快照的过期上限：快照比 DB_SNAPSHOT_MAX_STALENESS 秒旧（刷新失败或太慢）时退回 readonly 方式。
+# 读到自己的写入：会话在快照生成之后提交过 POST，本次请求也退回 readonly 方式读最新数据，
+# 所以刚买完东西、刚收获完跳回的页面不会显示旧的金币和库存。
+# 页面内容和它的版本号（ETag、片段缓存键）来自同一个连接，快照旧一点也不会把旧内容缓存到新版本号下。
+# 只适用于 SQLite；PostgreSQL 后端忽略此设置。快照每个 worker 一份，占用磁盘 = 数据库大小 × worker 数。
+import atexit
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from flask import has_request_context, request, session
+
+import db
+
+log = logging.getLogger(__name__)
+
+MODE = os.environ.get('DB_READ_MODE', 'off')
+POOL_SIZE = int(os.environ.get('DB_READ_POOL_SIZE', db.POOL_SIZE))
+SNAPSHOT_SECONDS = float(os.environ.get('DB_SNAPSHOT_SECONDS', 5))
+MAX_STALENESS = float(os.environ.get('DB_SNAPSHOT_MAX_STALENESS', 15))
+SNAPSHOT_DIR = os.environ.get('DB_SNAPSHOT_DIR', tempfile.gettempdir())
+
+# 只读的页面（endpoint 名）；这些路由里不能有写操作，query_only 会让写入直接报错
+READ_ENDPOINTS = {'shop', 'view_orders', 'player_dashboard', 'admin_dashboard'}
+
+# 会话里记录最近一次 POST 的时间，用于读到自己的写入
+WROTE_AT_KEY = 'wrote_at'
+
+_readonly_pool = None
+_pool_lock = threading.Lock()
+
+
+def readonly_pool():
+    global _readonly_pool
+    pid = os.getpid()
+    if _readonly_pool is None or _readonly_pool.pid != pid:
+        with _pool_lock:
+            if _readonly_pool is None or _readonly_pool.pid != pid:
+                _readonly_pool = db.ConnectionPool(db.DB_PATH, POOL_SIZE, opener=db.connect_readonly)
+    return _readonly_pool
+
+
+class Snapshot(threading.Thread):
+    """本 worker 的快照文件和它的连接池，后台定期刷新。"""
+
+    def __init__(self):
+        super().__init__(name='db-snapshot', daemon=True)
+        self.pid = os.getpid()
+        self.path = os.path.join(SNAPSHOT_DIR, 'farm-snapshot-{}.db'.format(self.pid))
+        self.pool = None
+        self.taken_at = None
+        self.refreshes = self.errors = 0
+        self.last_ms = None
+        self.stop_event = threading.Event()
+
+    def refresh(self):
+        started = time.monotonic()
+        taken_at = time.time()
+        tmp = self.path + '.tmp'
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        source = db.connect_readonly()
+        target = sqlite3.connect(tmp)
+        try:
+            # 一步复制全部页面：整个备份在源库的一个读事务里完成，得到一致的快照；WAL 模式下不挡写者
+            source.backup(target)
+            # 快照只读，不需要 WAL，读者也就不需要 -wal / -shm 文件
+            target.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            target.close()
+            source.close()
+        os.replace(tmp, self.path)
+
+        # 已经打开的连接还指向旧文件，换一个新池；旧池的连接归还时直接关闭
+        old, self.pool = self.pool, db.ConnectionPool(self.path, POOL_SIZE, opener=db.connect_readonly)
+        self.taken_at = taken_at
+        self.refreshes += 1
+        self.last_ms = round((time.monotonic() - started) * 1000, 3)
+        if old is not None:
+            old.retire()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                self.errors += 1
+                log.exception('snapshot refresh failed')
+            self.stop_event.wait(SNAPSHOT_SECONDS)
+
+    def age(self):
+        return time.time() - self.taken_at if self.taken_at is not None else None
+
+    def stop(self):
+        self.stop_event.set()
+        for path in (self.path, self.path + '.tmp'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+_snapshot = None
+_start_lock = threading.Lock()
+
+
+def ensure_snapshot():
+    """在 worker 内按需启动快照线程（fork 后按 pid 重新启动）。"""
+    global _snapshot
+    pid = os.getpid()
+    if _snapshot is not None and _snapshot.pid == pid:
+        return _snapshot
+    with _start_lock:
+        if _snapshot is None or _snapshot.pid != pid:
+            snapshot = Snapshot()
+            snapshot.start()
+            _snapshot = snapshot
+    return _snapshot
+
+
+def pool_for_request():
+    """db.get_db() 的路由钩子：只读页面返回只读连接池，其余请求返回 None（用主库连接池）。
+
+    不在请求里（启动时迁移、gunicorn 预热、命令行）一律用主库连接池。
+    """
+    if not has_request_context() or request.method != 'GET' or request.endpoint not in READ_ENDPOINTS:
+        return None
+    if MODE == 'snapshot':
+        snapshot = ensure_snapshot()
+        pool, age = snapshot.pool, snapshot.age()
+        if pool is not None and age is not None and age <= MAX_STALENESS \
+                and session.get(WROTE_AT_KEY, 0) < snapshot.taken_at:
+            return pool
+    return readonly_pool()
+
+
+def _mark_write(response):
+    if request.method == 'POST' and response.status_code < 400:
+        session[WROTE_AT_KEY] = time.time()
+    return response
+
+
+def stats():
+    result = {'mode': MODE, 'endpoints': sorted(READ_ENDPOINTS)}
+    if _readonly_pool is not None:
+        result['readonly'] = _readonly_pool.stats()
+    snapshot = _snapshot
+    if snapshot is not None:
+        result['snapshot'] = {
+            'path': snapshot.path,
+            'age_s': round(snapshot.age(), 3) if snapshot.taken_at is not None else None,
+            'max_staleness_s': MAX_STALENESS,
+            'refresh_s': SNAPSHOT_SECONDS,
+            'refreshes': snapshot.refreshes,
+            'errors': snapshot.errors,
+            'last_refresh_ms': snapshot.last_ms,
+            'pool': snapshot.pool.stats() if snapshot.pool is not None else None,
+        }
+    return result
+
+
+@atexit.register
+def _remove_snapshot():
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.pid == os.getpid():
+        snapshot.stop()
+
+
+def init_app(app):
+    if MODE == 'off' or db.BACKEND != 'sqlite':
+        return
+    if MODE not in ('readonly', 'snapshot'):
+        raise ValueError('不支持的 DB_READ_MODE：{}'.format(MODE))
+    db.read_pool_for_request = pool_for_request
+    if MODE == 'snapshot':
+        app.after_request(_mark_write)
@@ -0,0 +1,230 @@
+# scheduler.py
+# 世界时钟调度器：按实时时间推进 WorldClock.Tick，并分批把超过 ExpiryTime 的村民订单标记为过期；
+# 设置了 ORDER_BOARD_TARGET 时顺便把可接订单补到这个数量（见 orders.replenish）。
+#
+# 作物生长是按时钟推算的（见 growth.py），推进所有玩家的作物只需要更新 WorldClock 一行；
+# 真正需要扫表的只有过期订单，每批一个短事务，批大小根据实际持锁时间自动调整，
+# 保证单个写事务不超过 WORLD_TICK_SLICE_MS，不会长时间占着 SQLite 写锁挡住请求。
+#
+# 运行方式：
+#   1. 默认（WORLD_SCHEDULER=thread）：每个 worker 在第一个请求时启动一个后台线程，
+#      通过 SchedulerLease 表选主，只有持有租约的那个线程会执行 tick；
+#   2. WORLD_SCHEDULER=process：web worker 不启动线程，由单独的进程 `python scheduler.py` 执行；
+#   3. WORLD_SCHEDULER=off：关闭。
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+import catalog
+import db
+import orders
+from catalog import ORDERS_KEY, bump_version
+
+log = logging.getLogger(__name__)
+
+MODE = os.environ.get('WORLD_SCHEDULER', 'thread')
+TICK_SECONDS = float(os.environ.get('WORLD_TICK_SECONDS', 60))
+SLICE_MS = float(os.environ.get('WORLD_TICK_SLICE_MS', 50))
+CHUNK_SIZE = int(os.environ.get('WORLD_TICK_CHUNK', 500))
+MAX_CHUNK_SIZE = 10000
+LEASE_NAME = 'world'
+LEASE_SECONDS = TICK_SECONDS * 3
+
+# 本进程最近的 tick 指标
+_history = deque(maxlen=100)
+_totals = {'ticks': 0, 'rows': 0, 'errors': 0}
+_metrics_lock = threading.Lock()
+
+
+def utc_now_text():
+    return orders.utc_text()
+
+
+def try_acquire_lease(conn, owner, now=None):
+    """抢占或续约调度租约；租约未过期且属于别人时返回 False。"""
+    now = now or time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cur = conn.execute("""
+            INSERT INTO SchedulerLease (Name, Owner, ExpiresAt) VALUES (?, ?, ?)
+            ON CONFLICT(Name) DO UPDATE SET Owner = excluded.Owner, ExpiresAt = excluded.ExpiresAt
+            WHERE SchedulerLease.Owner = excluded.Owner OR SchedulerLease.ExpiresAt < ?
+        """, (LEASE_NAME, owner, now + LEASE_SECONDS, now))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return cur.rowcount == 1
+
+
+def advance_world(conn, now):
+    """按距上次 tick 的实际时间推进世界时钟，返回 (推进的 tick 数, 延迟毫秒)。"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT Tick, LastTickAt FROM WorldClock WHERE ID = 1").fetchone()
+        last = row['LastTickAt']
+        if last is None:
+            conn.execute("UPDATE WorldClock SET LastTickAt = ? WHERE ID = 1", (now,))
+            conn.commit()
+            return 0, 0.0
+
+        due = int((now - last) // TICK_SECONDS)
+        if due <= 0:
+            conn.rollback()
+            return 0, 0.0
+
+        conn.execute("UPDATE WorldClock SET Tick = Tick + ?, LastTickAt = ? WHERE ID = 1",
+                     (due, last + due * TICK_SECONDS))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    # 延迟 = 实际执行时间 - 第一个应执行 tick 的时间
+    return due, (now - (last + TICK_SECONDS)) * 1000
+
+
+def expire_orders(conn, chunk_size=CHUNK_SIZE, budget_ms=None):
+    """分批把过期订单标记为 Expired，返回 (处理行数, 批次数)。"""
+    deadline = time.monotonic() + budget_ms / 1000 if budget_ms else None
+    total = chunks = 0
+    while True:
+        started = time.monotonic()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute("""
+                UPDATE VillagerOrder SET Status = 'Expired'
+                WHERE OrderID IN (
+                    SELECT OrderID FROM VillagerOrder
+                    WHERE Status = 'Available' AND ExpiryTime IS NOT NULL AND ExpiryTime <= ?
+                    LIMIT ?
+                )
+            """, (utc_now_text(), chunk_size))
+            if cur.rowcount:
+                bump_version(conn, ORDERS_KEY)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        held_ms = (time.monotonic() - started) * 1000
+        total += cur.rowcount
+        chunks += 1
+
+        if cur.rowcount < chunk_size:
+            break
+        if deadline and time.monotonic() >= deadline:
+            break
+        # 持锁超过时间片就减半批大小，明显低于时间片则逐步放大
+        if held_ms > SLICE_MS:
+            chunk_size = max(1, chunk_size // 2)
+        elif held_ms < SLICE_MS / 4:
+            chunk_size = min(MAX_CHUNK_SIZE, chunk_size * 2)
+        # 批次之间让出写锁
+        time.sleep(0.001)
+    return total, chunks
+
+
+def run_tick(conn, now=None):
+    now = now or time.time()
+    started = time.monotonic()
+    ticks, lag_ms = advance_world(conn, now)
+    rows, chunks = expire_orders(conn, budget_ms=TICK_SECONDS * 1000 / 2)
+    posted = 0
+    if orders.BOARD_TARGET:
+        posted = orders.replenish(conn, catalog.load(conn, catalog.read_version(conn)))
+    duration_ms = (time.monotonic() - started) * 1000
+
+    conn.execute("""
+        UPDATE WorldClock SET LastDurationMs = ?, LastRows = ?, LastLagMs = ?
+        WHERE ID = 1
+    """, (duration_ms, rows, lag_ms))
+    conn.commit()
+
+    result = {
+        'at': now,
+        'ticks': ticks,
+        'rows': rows,
+        'chunks': chunks,
+        'posted': posted,
+        'duration_ms': round(duration_ms, 3),
+        'lag_ms': round(lag_ms, 3),
+    }
+    with _metrics_lock:
+        _history.append(result)
+        _totals['ticks'] += ticks
+        _totals['rows'] += rows
+    return result
+
+
+class WorldScheduler(threading.Thread):
+    def __init__(self, poll_seconds=None):
+        super().__init__(name='world-scheduler', daemon=True)
+        self.owner = '{}:{}:{}'.format(os.uname().nodename, os.getpid(), uuid.uuid4().hex[:8])
+        self.poll_seconds = poll_seconds or max(1.0, TICK_SECONDS / 4)
+        self.stop_event = threading.Event()
+
+    def run(self):
+        conn = db.connect()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    if try_acquire_lease(conn, self.owner):
+                        run_tick(conn)
+                except Exception:
+                    with _metrics_lock:
+                        _totals['errors'] += 1
+                    log.exception('world tick failed')
+                self.stop_event.wait(self.poll_seconds)
+        finally:
+            conn.close()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+_scheduler = None
+_start_lock = threading.Lock()
+
+
+def ensure_started():
+    """在 worker 内按需启动调度线程（fork 后按 pid 重新启动）。"""
+    global _scheduler
+    if MODE != 'thread':
+        return None
+    pid = os.getpid()
+    if _scheduler is not None and _scheduler.pid == pid:
+        return _scheduler
+    with _start_lock:
+        if _scheduler is None or _scheduler.pid != pid:
+            scheduler = WorldScheduler()
+            scheduler.pid = pid
+            scheduler.start()
+            _scheduler = scheduler
+    return _scheduler
+
+
+def metrics(conn):
+    world = conn.execute("SELECT * FROM WorldClock WHERE ID = 1").fetchone()
+    lease = conn.execute("SELECT Owner, ExpiresAt FROM SchedulerLease WHERE Name = ?", (LEASE_NAME,)).fetchone()
+    with _metrics_lock:
+        local = {'totals': dict(_totals), 'recent': list(_history)[-10:]}
+    return {
+        'mode': MODE,
+        'tick_seconds': TICK_SECONDS,
+        'slice_ms': SLICE_MS,
+        'world': dict(world) if world else None,
+        'lease': dict(lease) if lease else None,
+        'local': local,
+    }
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    scheduler = WorldScheduler()
+    log.info('world scheduler %s started, tick every %ss', scheduler.owner, TICK_SECONDS)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
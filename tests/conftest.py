@@ -0,0 +1,119 @@
+# tests/conftest.py
+# 测试默认用 SQLite：每个测试在自己的临时目录里用 init_db 建一个新库。
+# 用到 pg_conn / backend_conn 的测试还会在 PostgreSQL 上跑一遍，服务器按顺序找：
+#   1. DATABASE_URL 指向 PostgreSQL：直接用它（会清空并重建库里的表，只能指向测试用的库）；
+#   2. 装了 pgserver（pip install pgserver psycopg2-binary，自带 PostgreSQL 二进制）：
+#      在临时目录里起一个临时实例，测试结束后删除；
+#   3. 都没有：跳过这些测试。
+# 其余测试（应用、并发、批量写入）只用 SQLite 文件。
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 模块在 import 时读取这些环境变量，必须在导入项目模块之前设置
+os.environ.setdefault('WORLD_SCHEDULER', 'off')
+os.environ.setdefault('METRICS_DIR', tempfile.mkdtemp(prefix='farm-test-metrics-'))
+# 测试里注册的账号用低迭代次数的哈希，省时间
+os.environ.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+
+import pytest  # noqa: E402
+
+import db  # noqa: E402
+import init_db  # noqa: E402
+import postgres  # noqa: E402
+
+
+def create_database(path):
+    """在 path 建一个带初始数据、已执行全部迁移的 SQLite 库。"""
+    init_db.DB_NAME = str(path)
+    try:
+        init_db.initialize_database()
+    finally:
+        init_db.DB_NAME = 'farm_game.db'
+    return str(path)
+
+
+@pytest.fixture
+def database(tmp_path):
+    return create_database(tmp_path / 'farm_game.db')
+
+
+@pytest.fixture
+def conn(database):
+    connection = db.connect(database)
+    yield connection
+    connection.close()
+
+
+@pytest.fixture
+def app(database, monkeypatch):
+    """指向本测试数据库的 Flask 应用；连接池、目录缓存、片段缓存、密码哈希线程池都从空开始。"""
+    import catalog
+    import fragments
+    import passwords
+
+    monkeypatch.setattr(db, 'BACKEND', 'sqlite')
+    monkeypatch.setattr(db, 'DB_PATH', database)
+    monkeypatch.setattr(db, '_pool', None)
+    monkeypatch.setattr(catalog, '_catalog', None)
+    monkeypatch.setattr(passwords, '_pool', None)
+    fragments.cache.clear()
+    import app as app_module
+    app_module.app.testing = True
+    yield app_module.app
+    # 登录时的后台重新哈希会在线程池里连库，等它写完，免得 DB_PATH 复原后写到项目目录的库里
+    if passwords._pool is not None:
+        passwords._pool.executor.shutdown(wait=True)
+    db.get_pool().close_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login_player(client, username='tester', password='pw'):
+    """注册并登录一个玩家，返回其 PlayerID。"""
+    client.post('/register', data={'username': username, 'password': password})
+    client.post('/login', data={'username': username, 'password': password})
+    with client.session_transaction() as session:
+        return session['player_id']
+
+
+@pytest.fixture(scope='session')
+def postgres_url(tmp_path_factory):
+    """测试用 PostgreSQL 的连接 URL，找不到服务器时跳过。"""
+    if db.BACKEND == 'postgresql':
+        yield db.DATABASE_URL
+        return
+    if postgres.psycopg2 is None:
+        pytest.skip('没有安装 psycopg2')
+    try:
+        import pgserver
+    except ImportError:
+        pytest.skip('DATABASE_URL 未指向 PostgreSQL，也没有安装 pgserver')
+    server = pgserver.get_server(tmp_path_factory.mktemp('pgdata'), cleanup_mode='delete')
+    try:
+        yield server.get_uri()
+    finally:
+        server.cleanup()
+
+
+@pytest.fixture
+def pg_conn(postgres_url, monkeypatch):
+    """在 PostgreSQL 上用 init_db 重建表（含全部迁移）并返回连接。"""
+    monkeypatch.setattr(db, 'BACKEND', 'postgresql')
+    monkeypatch.setattr(db, 'DATABASE_URL', postgres_url)
+    init_db.initialize_database()
+    connection = db.connect()
+    yield connection
+    connection.close()
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def backend_conn(request):
+    """两种后端各跑一遍的测试用这个连接。"""
+    return request.getfixturevalue('conn' if request.param == 'sqlite' else 'pg_conn')
@@ -0,0 +1,68 @@
+# /api/v1：写操作要带 X-Requested-With 且同源；浇水、下一天、全部种植的响应带着页面重画所需的库存行和地块。
+import pytest
+
+import catalog as catalog_module
+from conftest import login_player
+
+AJAX = {'X-Requested-With': 'XMLHttpRequest'}
+
+
+@pytest.fixture
+def player(client):
+    return login_player(client)
+
+
+def _inventory(data):
+    return {item['ItemID']: item for item in data['inventory']}
+
+
+@pytest.mark.parametrize('headers', [
+    {},
+    {'X-Requested-With': 'fetch'},
+    dict(AJAX, Origin='http://evil.example'),
+], ids=['no-header', 'wrong-header', 'cross-origin'])
+def test_post_without_csrf_header_rejected(client, player, headers):
+    before = client.get('/api/v1/state').get_json()['clock']
+    response = client.post('/api/v1/next_day', headers=headers)
+    assert response.status_code == 403
+    assert response.get_json()['ok'] is False
+    assert client.get('/api/v1/state').get_json()['clock'] == before
+
+
+def test_same_origin_post_allowed(client, player):
+    response = client.post('/api/v1/next_day', headers=dict(AJAX, Origin='https://localhost'))
+    assert response.status_code == 200
+
+
+def test_get_needs_no_header(client, player):
+    data = client.get('/api/v1/state').get_json()
+    assert data['ok'] and data['full']
+
+
+def test_responses_carry_rows_to_rerender(app, client, player, conn):
+    state = client.get('/api/v1/state').get_json()
+    with app.app_context():
+        catalog = catalog_module.load(conn, catalog_module.read_version(conn))
+    plant_id = next(plant['PlantID'] for plant in catalog.plants.values()
+                    if catalog.seed_for_plant(plant['PlantID'])['ItemID'] in _inventory(state))
+    seed_id = catalog.seed_for_plant(plant_id)['ItemID']
+    seeds = _inventory(state)[seed_id]['Quantity']
+
+    planted = client.post('/api/v1/plots/plant_all', json={'plant_id': plant_id}, headers=AJAX).get_json()
+    assert planted['ok'], planted
+    assert _inventory(planted)[seed_id]['Quantity'] < seeds
+    assert {plot['PlotID'] for plot in planted['plots']} == {plot['PlotID'] for plot in state['plots']}
+
+    plot = next(plot for plot in planted['plots'] if plot['Status'] == 'Growing')
+    # 初始物品里没有水滴，先放 3 个
+    conn.execute("INSERT INTO Inventory (PlayerID, ItemID, Quantity) VALUES (?, ?, 3)", (player, catalog.water_item_id))
+    conn.commit()
+    drops = 3
+    watered = client.post('/api/v1/plots/{}/water'.format(plot['PlotID']), headers=AJAX).get_json()
+    assert watered['ok'], watered
+    assert _inventory(watered)[catalog.water_item_id]['Quantity'] == drops - 1
+    assert [row['PlotID'] for row in watered['plots']] == [plot['PlotID']]
+
+    next_day = client.post('/api/v1/next_day', headers=AJAX).get_json()
+    assert next_day['ok'] and next_day['clock'] > planted['clock']
+    assert len(next_day['plots']) == len(state['plots'])
@@ -0,0 +1,88 @@
+# ASGI 适配层：分块上传的表单（没有 Content-Length）能被 Flask 读到；CSV 导出按块流式发送。
+import asyncio
+import csv
+import io
+from urllib.parse import urlencode
+
+import pytest
+
+import accounts
+
+
+def _request(app, method, path, chunks=(), headers=()):
+    """按 ASGI 协议发一个请求：请求体按 chunks 分成多条 http.request 消息，返回发出的所有消息。"""
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'root_path': '',
+             'headers': [(k.encode('latin1'), v.encode('latin1')) for k, v in headers],
+             'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)}
+    incoming = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)] or [{'type': 'http.request', 'body': b''}]
+    sent = []
+
+    async def receive():
+        return incoming.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return sent
+
+
+def _headers(start):
+    return {k.decode('latin1'): v.decode('latin1') for k, v in start['headers']}
+
+
+@pytest.fixture
+def asgi_app(app):
+    # asgi 会 import app，必须在 app fixture 把数据库指向临时库之后再导入
+    import asgi
+    wrapper = asgi.FarmASGI(app)
+    yield wrapper
+    wrapper.shutdown()
+
+
+def _login_messages(asgi_app, username, password):
+    body = urlencode({'username': username, 'password': password}).encode()
+    # 分两块上传、不带 Content-Length，和客户端 / 代理用 Transfer-Encoding: chunked 时一样
+    return _request(asgi_app, 'POST', '/login', [body[:5], body[5:]], [
+        ('host', 'testserver'), ('content-type', 'application/x-www-form-urlencoded'),
+        ('transfer-encoding', 'chunked')])
+
+
+def _login(asgi_app, username, password):
+    return _login_messages(asgi_app, username, password)[0]
+
+
+def test_chunked_form_post(asgi_app):
+    start = _login(asgi_app, 'admin', '123')
+    assert start['status'] == 302
+    headers = _headers(start)
+    assert headers['location'].endswith('/admin/dashboard')
+    assert 'session=' in headers['set-cookie']
+
+
+def test_wrong_password_form_post(asgi_app):
+    sent = _login_messages(asgi_app, 'admin', 'wrong')
+    assert sent[0]['status'] == 200
+    assert '用户名或密码错误' in b''.join(message.get('body', b'') for message in sent[1:]).decode()
+
+
+def test_csv_export_streams_chunks(asgi_app, conn, monkeypatch):
+    import app as app_module
+    monkeypatch.setattr(app_module, 'EXPORT_CHUNK_SIZE', 2)
+    accounts.create_players(conn, [('csv_{}'.format(i), 'x') for i in range(5)], [])
+    conn.commit()
+    users = conn.execute("SELECT COUNT(*) FROM User").fetchone()[0]
+
+    cookie = _headers(_login(asgi_app, 'admin', '123'))['set-cookie'].split(';', 1)[0]
+    sent = _request(asgi_app, 'GET', '/admin/users/export.csv', headers=[('host', 'testserver'), ('cookie', cookie)])
+
+    start, bodies = sent[0], sent[1:]
+    assert start['status'] == 200
+    assert _headers(start)['content-type'].startswith('text/csv')
+    # 每页一块，最后一条是空的结束消息
+    assert len(bodies) > 2
+    assert all(message['more_body'] for message in bodies[:-1]) and not bodies[-1].get('more_body')
+    rows = list(csv.reader(io.StringIO(b''.join(message['body'] for message in bodies).decode())))
+    assert rows[0] == ['UserID', 'Username', 'Role', 'PlayerID', 'CurrentGold']
+    assert len(rows) - 1 == users
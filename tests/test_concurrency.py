@@ -0,0 +1,212 @@
+# 乐观并发：concurrency.run 的重试 / 退避规则，以及多个线程（各自一个连接，相当于并发的请求）
+# 同时提交同一个操作时，只有该成功的那几次成功，库存不会扣成负数，同一块地不会收获两次。
+import sqlite3
+import threading
+
+import pytest
+
+import accounts
+import catalog as catalog_module
+import concurrency
+import db
+import game
+
+THREADS = 8
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(concurrency, 'BUSY_BACKOFF_MS', 1)
+
+
+# ===== concurrency.run =====
+
+def _gold(conn, player_id):
+    return conn.execute("SELECT CurrentGold FROM Player WHERE PlayerID = ?", (player_id,)).fetchone()[0]
+
+
+def _player(conn, name='occ_player'):
+    (_, player_id), = accounts.create_players(conn, [(name, 'x')], [])
+    return player_id
+
+
+def test_run_retries_conflicts_and_rolls_back(conn):
+    player_id = _player(conn)
+    attempts = []
+
+    def action():
+        attempts.append(1)
+        conn.execute("UPDATE Player SET CurrentGold = CurrentGold + 1 WHERE PlayerID = ?", (player_id,))
+        if len(attempts) < 3:
+            raise concurrency.Conflict('Player')
+        return 'done'
+
+    assert concurrency.run(conn, 'test_conflict', action) == 'done'
+    # 前两次的写入都回滚了，只有最后一次生效
+    assert _gold(conn, player_id) == accounts.STARTER_GOLD + 1
+    assert concurrency.stats()['test_conflict']['conflicts'] >= 2
+
+
+def test_run_gives_up_after_max_retries(conn):
+    player_id = _player(conn)
+
+    def action():
+        conn.execute("UPDATE Player SET CurrentGold = 0 WHERE PlayerID = ?", (player_id,))
+        raise concurrency.Conflict('Player')
+
+    with pytest.raises(concurrency.RetriesExhausted):
+        concurrency.run(conn, 'test_exhausted', action, max_retries=2)
+    assert _gold(conn, player_id) == accounts.STARTER_GOLD
+    assert concurrency.stats()['test_exhausted']['attempts'] >= 3
+    assert not conn.in_transaction
+
+
+def test_run_backs_off_on_busy_and_propagates_other_errors(conn):
+    calls = []
+
+    def busy_then_ok():
+        calls.append(1)
+        if len(calls) < 3:
+            raise sqlite3.OperationalError('database is locked')
+        return len(calls)
+
+    assert concurrency.run(conn, 'test_busy', busy_then_ok) == 3
+    assert concurrency.stats()['test_busy']['busy'] >= 2
+
+    def always_busy():
+        raise sqlite3.OperationalError('database is locked')
+
+    with pytest.raises(sqlite3.OperationalError):
+        concurrency.run(conn, 'test_busy_forever', always_busy, busy_retries=1)
+
+    def game_error():
+        raise game.GameError('no')
+
+    with pytest.raises(game.GameError):
+        concurrency.run(conn, 'test_error', game_error)
+    assert concurrency.stats()['test_error']['attempts'] >= 1
+
+
+def test_expect():
+    class Cursor:
+        rowcount = 0
+    with pytest.raises(concurrency.Conflict):
+        concurrency.expect(Cursor(), 'Plot')
+    Cursor.rowcount = 1
+    concurrency.expect(Cursor(), 'Plot')
+
+
+# ===== 并发双击 =====
+
+def _setup_plot(conn, planted_at, drops, max_water=None):
+    """一个有一块萝卜地的玩家；planted_at 为 -1000 时已成熟，为 0 时刚种下。"""
+    player_id = _player(conn)
+    catalog = catalog_module.load(conn, catalog_module.read_version(conn))
+    plant_id = conn.execute("SELECT PlantID FROM Plant WHERE PlantName = '萝卜'").fetchone()[0]
+    if max_water is not None:
+        conn.execute("UPDATE Plant SET MaxWaterTimes = ? WHERE PlantID = ?", (max_water, plant_id))
+    conn.execute("""
+        UPDATE Plot SET Status = 'Growing', PlantedPlantID = ?, PlantedAt = ?, GrowthRate = 1,
+                        WaterBonus = 0, TimesWatered = 0
+        WHERE PlayerID = ?
+    """, (plant_id, planted_at, player_id))
+    conn.execute("INSERT INTO Inventory (PlayerID, ItemID, Quantity) VALUES (?, ?, ?)",
+                 (player_id, catalog.water_item_id, drops))
+    conn.commit()
+    plot_id = conn.execute("SELECT PlotID FROM Plot WHERE PlayerID = ?", (player_id,)).fetchone()[0]
+    return player_id, plot_id, catalog_module.load(conn, catalog_module.read_version(conn))
+
+
+def _race(database, operation, threads=THREADS):
+    """threads 个线程各开一个连接，同时执行 operation(conn, player, 线程序号)，返回 (成功结果, GameError 列表)。"""
+    barrier = threading.Barrier(threads)
+    results, errors, unexpected = [], [], []
+    lock = threading.Lock()
+
+    def worker(index):
+        conn = db.connect(database)
+        try:
+            player = conn.execute("SELECT * FROM Player ORDER BY PlayerID DESC LIMIT 1").fetchone()
+            barrier.wait()
+            try:
+                outcome = operation(conn, player, index)
+            except game.GameError as e:
+                with lock:
+                    errors.append(e)
+            except Exception as e:
+                with lock:
+                    unexpected.append(e)
+            else:
+                with lock:
+                    results.append(outcome)
+        finally:
+            conn.close()
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join(30)
+    assert not unexpected, unexpected
+    assert len(results) + len(errors) == threads
+    return results, errors
+
+
+def test_double_harvest_pays_once(conn, database):
+    player_id, plot_id, catalog = _setup_plot(conn, planted_at=-1000, drops=0)
+    plant = catalog.plant(conn.execute("SELECT PlantedPlantID FROM Plot WHERE PlotID = ?", (plot_id,)).fetchone()[0])
+
+    results, _ = _race(database, lambda c, player, _: game.harvest_plot(c, catalog, player, plot_id))
+
+    assert len(results) == 1
+    assert _gold(conn, player_id) == accounts.STARTER_GOLD + plant['SellPrice'] * plant['HarvestYield']
+    assert conn.execute("SELECT Status FROM Plot WHERE PlotID = ?", (plot_id,)).fetchone()[0] == 'Empty'
+    assert conn.execute("SELECT COUNT(*) FROM GoldTransaction WHERE SourceReference = ?",
+                        ('harvest:plot:{}'.format(plot_id),)).fetchone()[0] == 1
+
+
+def test_single_and_bulk_harvest_race_harvests_once(conn, database):
+    player_id, plot_id, catalog = _setup_plot(conn, planted_at=-1000, drops=0)
+
+    def operation(c, player, index):
+        if index % 2:
+            return game.harvest_all(c, catalog, player)
+        return game.harvest_plot(c, catalog, player, plot_id)
+
+    results, _ = _race(database, operation)
+
+    assert len(results) == 1
+    paid = _gold(conn, player_id) - accounts.STARTER_GOLD
+    stored = conn.execute("SELECT COALESCE(SUM(Quantity), 0) FROM Inventory WHERE PlayerID = ? AND ItemID != ?",
+                          (player_id, catalog.water_item_id)).fetchone()[0]
+    # 要么按售价换成了金币，要么产物进了仓库，不会两样都有
+    assert (paid > 0) != (stored > 0)
+
+
+def test_double_water_with_one_drop(conn, database):
+    player_id, plot_id, catalog = _setup_plot(conn, planted_at=0, drops=1)
+
+    results, _ = _race(database, lambda c, player, _: game.water(c, catalog, player, plot_id))
+
+    assert len(results) == 1
+    row = conn.execute("SELECT TimesWatered FROM Plot WHERE PlotID = ?", (plot_id,)).fetchone()
+    assert row[0] == 1
+    assert conn.execute("SELECT Quantity FROM Inventory WHERE PlayerID = ? AND ItemID = ?",
+                        (player_id, catalog.water_item_id)).fetchone()[0] == 0
+
+
+def test_concurrent_water_respects_max_times_and_drops(conn, database):
+    player_id, plot_id, catalog = _setup_plot(conn, planted_at=0, drops=20, max_water=3)
+
+    def operation(c, player, index):
+        if index % 4 == 0:
+            return game.water_all(c, catalog, player)
+        return game.water(c, catalog, player, plot_id)
+
+    results, _ = _race(database, operation)
+
+    watered = conn.execute("SELECT TimesWatered FROM Plot WHERE PlotID = ?", (plot_id,)).fetchone()[0]
+    drops = conn.execute("SELECT Quantity FROM Inventory WHERE PlayerID = ? AND ItemID = ?",
+                         (player_id, catalog.water_item_id)).fetchone()[0]
+    assert 1 <= len(results) == watered <= 3
+    assert drops == 20 - watered
@@ -0,0 +1,106 @@
+# 金币账本：余额不足拒绝、流水和余额一致、增量对账能发现被绕过账本改掉的余额。
+# SQLite 和 PostgreSQL 各跑一遍（见 conftest.py 的 backend_conn）。
+import pytest
+
+import accounts
+import economy
+
+
+def _players(conn, count=2):
+    return [player_id for _, player_id in
+            accounts.create_players(conn, [('eco_{}'.format(i), 'x') for i in range(count)], [])]
+
+
+def _gold(conn, player_id):
+    return conn.execute("SELECT CurrentGold FROM Player WHERE PlayerID = ?", (player_id,)).fetchone()[0]
+
+
+def _ledger(conn, player_id):
+    return conn.execute("""
+        SELECT COALESCE(SUM(CASE WHEN Type = 'Expense' THEN -Amount ELSE Amount END), 0)
+        FROM GoldTransaction WHERE PlayerID = ?
+    """, (player_id,)).fetchone()[0]
+
+
+def _entries(conn):
+    return conn.execute("SELECT COUNT(*) FROM GoldTransaction").fetchone()[0]
+
+
+def test_insufficient_gold_changes_nothing(backend_conn):
+    conn = backend_conn
+    rich, poor = _players(conn)
+    entries_before = _entries(conn)
+
+    conn.execute("BEGIN IMMEDIATE")
+    with pytest.raises(economy.InsufficientGold):
+        # 同一批里有一个玩家余额不足，整批都不能生效
+        economy.apply(conn, [(rich, -10, economy.reference('test', 1)),
+                             (poor, -(accounts.STARTER_GOLD + 1), economy.reference('test', 2))])
+    conn.rollback()
+
+    assert _gold(conn, rich) == _gold(conn, poor) == accounts.STARTER_GOLD
+    assert _entries(conn) == entries_before
+
+
+def test_spending_whole_balance_is_allowed(backend_conn):
+    conn = backend_conn
+    player, = _players(conn, 1)
+    conn.execute("BEGIN IMMEDIATE")
+    economy.apply(conn, [(player, -accounts.STARTER_GOLD, economy.reference('shop', 'all'))])
+    conn.commit()
+    assert _gold(conn, player) == 0
+
+
+def test_ledger_matches_gold_delta(backend_conn):
+    conn = backend_conn
+    a, b = _players(conn)
+    gold_before = {p: _gold(conn, p) for p in (a, b)}
+    ledger_before = {p: _ledger(conn, p) for p in (a, b)}
+
+    conn.execute("BEGIN IMMEDIATE")
+    economy.apply(conn, [(a, 30, economy.reference('order', 1)),
+                         (a, -12, economy.reference('shop', 5)),
+                         (b, -40, economy.reference('shop', 1)),
+                         (b, 0, economy.reference('noop'))])
+    conn.commit()
+
+    for player in (a, b):
+        assert _gold(conn, player) - gold_before[player] == _ledger(conn, player) - ledger_before[player]
+    assert _gold(conn, a) == accounts.STARTER_GOLD + 18
+    # 金额为 0 的条目不记流水
+    assert conn.execute("SELECT COUNT(*) FROM GoldTransaction WHERE SourceReference = 'noop'").fetchone()[0] == 0
+    types = conn.execute("SELECT Type, Amount FROM GoldTransaction WHERE PlayerID = ? AND SourceReference = 'shop:1'",
+                         (b,)).fetchone()
+    assert tuple(types) == (economy.EXPENSE, 40)
+
+
+def test_reconcile_is_incremental_and_finds_injected_mismatch(backend_conn):
+    conn = backend_conn
+    players = _players(conn, 5)
+
+    first = economy.reconcile(conn, batch_size=2)
+    assert first['mismatches'] == []
+    assert first['players'] >= 5 and first['new_entries'] >= 5
+
+    # 没有新流水：只核对检查点之后的部分，一条也不读
+    assert economy.reconcile(conn, batch_size=2)['new_entries'] == 0
+
+    conn.execute("BEGIN IMMEDIATE")
+    economy.apply(conn, [(players[0], 25, economy.reference('order', 9)),
+                         (players[1], -5, economy.reference('shop', 9))])
+    conn.commit()
+    second = economy.reconcile(conn, batch_size=2)
+    assert second['new_entries'] == 2 and second['mismatches'] == []
+
+    # 绕过账本直接改余额
+    conn.execute("UPDATE Player SET CurrentGold = CurrentGold + 7 WHERE PlayerID = ?", (players[3],))
+    conn.commit()
+    found = economy.reconcile(conn, batch_size=2)
+    assert found['new_entries'] == 0
+    assert found['mismatches'] == [{'PlayerID': players[3], 'CurrentGold': accounts.STARTER_GOLD + 7,
+                                    'Ledger': accounts.STARTER_GOLD}]
+
+    fixed = economy.reconcile(conn, batch_size=2, fix=True)
+    assert [m['PlayerID'] for m in fixed['mismatches']] == [players[3]]
+    assert _gold(conn, players[3]) == accounts.STARTER_GOLD
+    assert economy.reconcile(conn)['mismatches'] == []
@@ -0,0 +1,26 @@
+# gunicorn 配置：worker 类型只接受 gthread / sync / uvicorn，gevent 这类协程 worker 在加载配置时就拒绝。
+import os
+import runpy
+
+import pytest
+
+CONF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py')
+
+
+@pytest.mark.parametrize('worker_class, expected, app_path', [
+    ('gthread', 'gthread', 'app:app'),
+    ('sync', 'sync', 'app:app'),
+    ('uvicorn', 'uvicorn.workers.UvicornWorker', 'asgi:app'),
+])
+def test_supported_worker_classes(monkeypatch, worker_class, expected, app_path):
+    monkeypatch.setenv('GUNICORN_WORKER_CLASS', worker_class)
+    conf = runpy.run_path(CONF)
+    assert (conf['worker_class'], conf['wsgi_app']) == (expected, app_path)
+    assert conf['threads'] == (4 if worker_class == 'gthread' else 1)
+
+
+@pytest.mark.parametrize('worker_class', ['gevent', 'eventlet'])
+def test_green_workers_rejected(monkeypatch, worker_class):
+    monkeypatch.setenv('GUNICORN_WORKER_CLASS', worker_class)
+    with pytest.raises(ValueError):
+        runpy.run_path(CONF)
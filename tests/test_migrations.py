@@ -0,0 +1,32 @@
+# 迁移：init_db 之后已是最新版本，再执行 migrate 不做任何事；触发器在两种后端上都生效。
+# SQLite 和 PostgreSQL 各跑一遍。
+import accounts
+import migrations
+
+LATEST = migrations.MIGRATIONS[-1][0]
+
+
+def _versions(conn):
+    return [row[0] for row in conn.execute("SELECT Version FROM SchemaVersion ORDER BY Version")]
+
+
+def _revision(conn, player_id):
+    return conn.execute("SELECT Revision FROM Player WHERE PlayerID = ?", (player_id,)).fetchone()[0]
+
+
+def test_migrate_is_idempotent(backend_conn):
+    conn = backend_conn
+    assert migrations.current_version(conn) == LATEST
+    assert migrations.migrate(conn) == []
+    assert _versions(conn) == [version for version, _, _ in migrations.MIGRATIONS]
+
+
+def test_revision_triggers(backend_conn):
+    conn = backend_conn
+    # 迁移 8 的触发器：库存变化时玩家的 Revision 加一（ETag 和片段缓存依赖它）
+    (_, player_id), = accounts.create_players(conn, [('migrated', 'x')], [])
+    conn.commit()
+    before = _revision(conn, player_id)
+    conn.execute("INSERT INTO Inventory (PlayerID, ItemID, Quantity) VALUES (?, 1, 1)", (player_id,))
+    conn.commit()
+    assert _revision(conn, player_id) == before + 1
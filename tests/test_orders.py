@@ -0,0 +1,113 @@
+# 订单板：持有量够的订单排在前面、差得多的不显示；ORDER_NEAR_RATIO 在加载时校验。
+# 接单：成功时扣物品、加金币记流水；订单已被接走或物品不足时整单回滚。
+# 订单板和接单在 SQLite 和 PostgreSQL 各跑一遍。
+import importlib
+
+import pytest
+
+import accounts
+import economy
+import catalog as catalog_module
+import orders
+
+
+def _setup(conn, quantity):
+    """一个持有 quantity 个萝卜的玩家，以及需要 2 / 4 / 10 个萝卜的三个订单。"""
+    (_, player_id), = accounts.create_players(conn, [('orders_player', 'x')], [])
+    radish = conn.execute("SELECT ItemID FROM Item WHERE ItemName = '萝卜'").fetchone()[0]
+    conn.execute("DELETE FROM VillagerOrder")
+    conn.execute("INSERT INTO Inventory (PlayerID, ItemID, Quantity) VALUES (?, ?, ?)", (player_id, radish, quantity))
+    conn.executemany("""
+        INSERT INTO VillagerOrder (VillagerID, RequiredItemID, RequiredQuantity, RewardGold, RewardAffection)
+        VALUES (1, ?, ?, ?, 1)
+    """, [(radish, 2, 10), (radish, 4, 30), (radish, 10, 90)])
+    conn.commit()
+    return player_id, catalog_module.load(conn, catalog_module.read_version(conn))
+
+
+def test_board_orders_completable_first(backend_conn):
+    conn = backend_conn
+    player_id, catalog = _setup(conn, 3)
+    board = orders.board(conn, catalog, player_id, near_ratio=0.5)
+    # 10 个的订单差太多（3 < 10 × 0.5），不显示
+    assert [(o['RequiredQuantity'], o['Missing']) for o in board] == [(2, 0), (4, 1)]
+    assert board[0]['ItemName'] == '萝卜'
+
+
+def test_board_full_ratio_only_completable(backend_conn):
+    conn = backend_conn
+    player_id, catalog = _setup(conn, 3)
+    assert [o['RequiredQuantity'] for o in orders.board(conn, catalog, player_id, near_ratio=1)] == [2]
+
+
+
+def _order_ids(conn):
+    return [row[0] for row in conn.execute("SELECT OrderID FROM VillagerOrder ORDER BY RequiredQuantity")]
+
+
+def _gold(conn, player_id):
+    return conn.execute("SELECT CurrentGold FROM Player WHERE PlayerID = ?", (player_id,)).fetchone()[0]
+
+
+def _radishes(conn, player_id):
+    return conn.execute("""
+        SELECT Quantity FROM Inventory JOIN Item USING (ItemID) WHERE PlayerID = ? AND ItemName = '萝卜'
+    """, (player_id,)).fetchone()[0]
+
+
+def test_claim_pays_reward(backend_conn):
+    conn = backend_conn
+    player_id, _ = _setup(conn, 3)
+    small = _order_ids(conn)[0]
+    gold_before = _gold(conn, player_id)
+
+    order = orders.claim(conn, player_id, small)
+
+    assert order['RewardGold'] == 10
+    assert _gold(conn, player_id) == gold_before + 10
+    assert _radishes(conn, player_id) == 1
+    status, owner = conn.execute("SELECT Status, PlayerID FROM VillagerOrder WHERE OrderID = ?", (small,)).fetchone()
+    assert (status, owner) == ('Completed', player_id)
+    ledger = conn.execute("SELECT Type, Amount FROM GoldTransaction WHERE SourceReference = ?",
+                          (economy.reference('order', small),)).fetchall()
+    assert [tuple(row) for row in ledger] == [(economy.INCOME, 10)]
+
+
+def test_claim_taken_order_rejected(backend_conn):
+    conn = backend_conn
+    player_id, _ = _setup(conn, 10)
+    small = _order_ids(conn)[0]
+    orders.claim(conn, player_id, small)
+    gold_before = _gold(conn, player_id)
+
+    with pytest.raises(orders.OrderError):
+        orders.claim(conn, player_id, small)
+    assert _gold(conn, player_id) == gold_before
+    assert _radishes(conn, player_id) == 8
+
+
+def test_claim_without_items_rolls_back(backend_conn):
+    conn = backend_conn
+    player_id, _ = _setup(conn, 3)
+    large = _order_ids(conn)[-1]
+    gold_before = _gold(conn, player_id)
+
+    with pytest.raises(orders.OrderError):
+        orders.claim(conn, player_id, large)
+    # 占订单的 UPDATE 也一起回滚，订单仍可接
+    assert conn.execute("SELECT Status FROM VillagerOrder WHERE OrderID = ?", (large,)).fetchone()[0] == 'Available'
+    assert _gold(conn, player_id) == gold_before
+    assert _radishes(conn, player_id) == 3
+    assert conn.execute("SELECT COUNT(*) FROM GoldTransaction WHERE SourceReference = ?",
+                        (economy.reference('order', large),)).fetchone()[0] == 0
+
+
+@pytest.mark.parametrize('value', ['0', '-1', '1.5'])
+def test_near_ratio_validated_on_load(monkeypatch, value):
+    monkeypatch.setenv('ORDER_NEAR_RATIO', value)
+    try:
+        with pytest.raises(ValueError):
+            importlib.reload(orders)
+    finally:
+        monkeypatch.undo()
+        importlib.reload(orders)
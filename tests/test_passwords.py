@@ -0,0 +1,55 @@
+# 密码哈希线程池：排队已满或等待超时抛出 PasswordBusy，登录、注册返回 503 和 Retry-After 而不是 500。
+import threading
+
+import pytest
+
+import passwords
+
+
+@pytest.fixture
+def fresh_pool(monkeypatch):
+    """每个测试用自己的线程池；测试里改的 WORKERS / MAX_PENDING 在建池时生效。"""
+    monkeypatch.setattr(passwords, '_pool', None)
+    yield
+    pool = passwords._pool
+    if pool is not None:
+        pool.executor.shutdown(wait=True)
+
+
+def test_hash_and_verify(fresh_pool):
+    pw_hash = passwords.hash_password('secret')
+    assert passwords.verify_password(pw_hash, 'secret')
+    assert not passwords.verify_password(pw_hash, 'wrong')
+
+
+def test_full_queue_is_busy(fresh_pool, monkeypatch):
+    monkeypatch.setattr(passwords, 'MAX_PENDING', 0)
+    with pytest.raises(passwords.PasswordBusy):
+        passwords.hash_password('secret')
+    # 后台重新哈希遇到繁忙直接放弃，等下次登录
+    assert passwords.rehash_if_needed(1, 'pbkdf2:sha256:1$salt$hash', 'secret') is False
+
+
+def test_wait_timeout_is_busy_and_frees_slot(fresh_pool, monkeypatch):
+    monkeypatch.setattr(passwords, 'WORKERS', 1)
+    monkeypatch.setattr(passwords, 'MAX_PENDING', 2)
+    monkeypatch.setattr(passwords, 'TIMEOUT', 0.05)
+    release = threading.Event()
+    pool = passwords._get_pool()
+    blocker = pool.submit(release.wait, 10)
+
+    with pytest.raises(passwords.PasswordBusy):
+        passwords.hash_password('secret')
+    # 超时的任务还在排队，已被取消，名额归还：池恢复后照常可用
+    release.set()
+    blocker.result(10)
+    assert passwords.verify_password(passwords.hash_password('secret'), 'secret')
+
+
+@pytest.mark.parametrize('path', ['/login', '/register'])
+def test_routes_return_503_with_retry_after(client, fresh_pool, monkeypatch, path):
+    monkeypatch.setattr(passwords, 'MAX_PENDING', 0)
+    response = client.post(path, data={'username': 'admin', 'password': '123'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(passwords.RETRY_AFTER)
+    assert '繁忙' in response.get_data(as_text=True)
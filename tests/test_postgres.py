@@ -0,0 +1,136 @@
+# PostgreSQL 适配层：SQL 改写是纯函数，不需要数据库；连库的部分在 DATABASE_URL 指向 PostgreSQL 时运行，
+# 同样的调用在 SQLite 上也跑一遍，保证两种后端行为一致。
+import sqlite3
+
+import pytest
+
+import db
+import postgres
+
+
+# ===== translate =====
+
+def test_translate_placeholders():
+    assert postgres.translate("SELECT * FROM Item WHERE ItemID = ? AND ItemName = ?") == \
+        'SELECT * FROM "Item" WHERE "ItemID" = %s AND "ItemName" = %s'
+    assert postgres.translate("UPDATE Player SET CurrentGold = :gold WHERE PlayerID = :pid") == \
+        'UPDATE "Player" SET "CurrentGold" = %(gold)s WHERE "PlayerID" = %(pid)s'
+
+
+def test_translate_escapes_percent_and_keeps_literals():
+    sql = postgres.translate("SELECT ItemName FROM Item WHERE ItemName LIKE '%种子' AND ItemType = 'Seed?' AND ItemID % 2 = ?")
+    assert sql == 'SELECT "ItemName" FROM "Item" WHERE "ItemName" LIKE \'%%种子\' AND "ItemType" = \'Seed?\' AND "ItemID" %% 2 = %s'
+
+
+def test_translate_quotes_mixed_case_identifiers_and_reserved_user():
+    sql = postgres.translate("SELECT u.UserID, p.ID, count(*) AS n FROM User u JOIN Player p ON p.UserID = u.UserID")
+    assert sql == 'SELECT u."UserID", p."ID", count(*) AS n FROM "User" u JOIN "Player" p ON p."UserID" = u."UserID"'
+
+
+def test_translate_upsert():
+    sql = postgres.translate("""
+        INSERT INTO Inventory (PlayerID, ItemID, Quantity) VALUES (?, ?, ?)
+        ON CONFLICT(PlayerID, ItemID) DO UPDATE SET Quantity = Inventory.Quantity + excluded.Quantity
+    """)
+    assert 'INSERT INTO "Inventory" ("PlayerID", "ItemID", "Quantity") VALUES (%s, %s, %s)' in sql
+    assert 'ON CONFLICT("PlayerID", "ItemID") DO UPDATE SET "Quantity" = "Inventory"."Quantity" + excluded."Quantity"' in sql
+
+
+def test_translate_create_table():
+    sql = postgres.translate("""CREATE TABLE IF NOT EXISTS Note (
+        NoteID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Weight REAL,
+        PlayerID INTEGER REFERENCES Player(PlayerID),
+        FOREIGN KEY (PlayerID) REFERENCES Player(PlayerID)
+    )""")
+    assert '"NoteID" SERIAL PRIMARY KEY' in sql
+    assert '"Weight" DOUBLE PRECISION' in sql
+    assert 'REFERENCES' not in sql and 'FOREIGN' not in sql
+
+
+def test_row_access():
+    row = postgres.Row((1, 'admin'), {'UserID': 0, 'Username': 1})
+    assert row['Username'] == 'admin' and row[0] == 1
+    assert dict(zip(row.keys(), row)) == {'UserID': 1, 'Username': 'admin'}
+
+
+# ===== reserve_ids / 异常映射：两种后端 =====
+
+def _reserve_and_insert(connection):
+    connection.execute("BEGIN IMMEDIATE")
+    ids = db.reserve_ids(connection, 'User', 'UserID', 3)
+    connection.executemany("INSERT INTO User (UserID, Username, Password, Role) VALUES (?, ?, ?, 'player')",
+                           [(user_id, 'reserved_{}'.format(user_id), 'x') for user_id in ids])
+    connection.commit()
+    return ids
+
+
+def _check_reserve_ids(connection):
+    before = connection.execute("SELECT MAX(UserID) FROM User").fetchone()[0]
+    first = _reserve_and_insert(connection)
+    second = _reserve_and_insert(connection)
+    assert len(set(first + second)) == 6
+    assert min(first) > before and min(second) > max(first)
+    # 预留之后普通的自增 INSERT 也不会和已用的 ID 撞上
+    connection.execute("INSERT INTO User (Username, Password) VALUES ('after_reserve', 'x')")
+    connection.commit()
+    after = connection.execute("SELECT UserID FROM User WHERE Username = 'after_reserve'").fetchone()[0]
+    assert after > max(second)
+
+
+def _check_error_mapping(connection):
+    connection.execute("INSERT INTO User (Username, Password) VALUES ('dup', 'x')")
+    connection.commit()
+    with pytest.raises(db.IntegrityError):
+        connection.execute("INSERT INTO User (Username, Password) VALUES ('dup', 'x')")
+    connection.rollback()
+    with pytest.raises(db.Error):
+        connection.execute("SELECT NoSuchColumn FROM User")
+    connection.rollback()
+    # 出错回滚之后连接还能继续用
+    assert connection.execute("SELECT COUNT(*) FROM User WHERE Username = 'dup'").fetchone()[0] == 1
+
+
+def _check_upsert(connection):
+    sql = """
+        INSERT INTO Inventory (PlayerID, ItemID, Quantity) VALUES (?, ?, ?)
+        ON CONFLICT(PlayerID, ItemID) DO UPDATE SET Quantity = Inventory.Quantity + excluded.Quantity
+    """
+    connection.execute(sql, (999, 1, 2))
+    connection.execute(sql, (999, 1, 3))
+    connection.commit()
+    row = connection.execute("SELECT Quantity FROM Inventory WHERE PlayerID = ? AND ItemID = ?", (999, 1)).fetchone()
+    assert row['Quantity'] == 5
+
+
+def test_reserve_ids_sqlite(conn):
+    _check_reserve_ids(conn)
+
+
+def test_error_mapping_sqlite(conn):
+    _check_error_mapping(conn)
+    assert issubclass(sqlite3.IntegrityError, db.IntegrityError)
+
+
+def test_upsert_sqlite(conn):
+    _check_upsert(conn)
+
+
+def test_reserve_ids_postgres(pg_conn):
+    _check_reserve_ids(pg_conn)
+
+
+def test_error_mapping_postgres(pg_conn):
+    _check_error_mapping(pg_conn)
+
+
+def test_upsert_postgres(pg_conn):
+    _check_upsert(pg_conn)
+
+
+def test_parse_url():
+    assert db.parse_url('sqlite:///farm_game.db') == ('sqlite', 'farm_game.db')
+    assert db.parse_url('sqlite:////var/data/farm.db') == ('sqlite', '/var/data/farm.db')
+    assert db.parse_url('postgresql://u:p@localhost/farm')[0] == 'postgresql'
+    with pytest.raises(ValueError):
+        db.parse_url('mysql://localhost/farm')
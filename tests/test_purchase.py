@@ -0,0 +1,96 @@
+# 商店购买：扣金币、记一条流水、写入库存在一个事务里；余额不足时整单回滚，不留流水。
+# SQLite 和 PostgreSQL 各跑一遍。
+import pytest
+
+import accounts
+import catalog as catalog_module
+import economy
+import purchase
+
+
+def _setup(conn):
+    (_, player_id), = accounts.create_players(conn, [('shopper', 'x')], [])
+    conn.commit()
+    prices = catalog_module.load(conn, catalog_module.read_version(conn)).shop_prices
+    cheap, dear = sorted(prices, key=prices.get)[:2]
+    return player_id, prices, cheap, dear
+
+
+def _gold(conn, player_id):
+    return conn.execute("SELECT CurrentGold FROM Player WHERE PlayerID = ?", (player_id,)).fetchone()[0]
+
+
+def _inventory(conn, player_id):
+    return {row[0]: row[1] for row in conn.execute(
+        "SELECT ItemID, Quantity FROM Inventory WHERE PlayerID = ?", (player_id,))}
+
+
+def _spent(conn, player_id):
+    return conn.execute("""
+        SELECT COALESCE(SUM(Amount), 0) FROM GoldTransaction WHERE PlayerID = ? AND Type = ?
+    """, (player_id, economy.EXPENSE)).fetchone()[0]
+
+
+def test_buy_merges_cart_and_records_one_entry(backend_conn):
+    conn = backend_conn
+    player_id, prices, cheap, dear = _setup(conn)
+    inventory_before = _inventory(conn, player_id)
+
+    lines, total = purchase.buy(conn, player_id, [(cheap, 2), (dear, 1), (cheap, 1)], prices)
+
+    assert lines == {cheap: 3, dear: 1}
+    assert total == prices[cheap] * 3 + prices[dear]
+    assert _gold(conn, player_id) == accounts.STARTER_GOLD - total
+    inventory = _inventory(conn, player_id)
+    assert inventory[cheap] == inventory_before.get(cheap, 0) + 3
+    assert inventory[dear] == inventory_before.get(dear, 0) + 1
+    entries = conn.execute("SELECT Amount FROM GoldTransaction WHERE PlayerID = ? AND Type = ?",
+                           (player_id, economy.EXPENSE)).fetchall()
+    assert [row[0] for row in entries] == [total]
+
+
+def test_buy_again_adds_to_inventory(backend_conn):
+    conn = backend_conn
+    player_id, prices, cheap, _ = _setup(conn)
+    purchase.buy(conn, player_id, [(cheap, 1)], prices)
+    before = _inventory(conn, player_id)[cheap]
+    purchase.buy(conn, player_id, [(cheap, 4)], prices)
+    assert _inventory(conn, player_id)[cheap] == before + 4
+    assert _spent(conn, player_id) == prices[cheap] * 5
+
+
+def test_insufficient_gold_rolls_back(backend_conn):
+    conn = backend_conn
+    player_id, prices, _, dear = _setup(conn)
+    quantity = min(accounts.STARTER_GOLD // prices[dear] + 1, purchase.MAX_QUANTITY)
+    inventory_before = _inventory(conn, player_id)
+
+    with pytest.raises(purchase.PurchaseError):
+        purchase.buy(conn, player_id, [(dear, quantity)], prices)
+
+    assert _gold(conn, player_id) == accounts.STARTER_GOLD
+    assert _inventory(conn, player_id) == inventory_before
+    assert _spent(conn, player_id) == 0
+
+
+@pytest.mark.parametrize('cart', [
+    lambda item: [],
+    lambda item: [(item, 0)],
+    lambda item: [(item, 'x')],
+    lambda item: [(-1, 1)],
+    lambda item: [(item, purchase.MAX_QUANTITY), (item, 1)],
+])
+def test_invalid_cart_rejected(backend_conn, cart):
+    conn = backend_conn
+    player_id, prices, cheap, _ = _setup(conn)
+    with pytest.raises(purchase.PurchaseError):
+        purchase.buy(conn, player_id, cart(cheap), prices)
+    assert _gold(conn, player_id) == accounts.STARTER_GOLD
+
+
+def test_purchases_reconcile(backend_conn):
+    conn = backend_conn
+    player_id, prices, cheap, dear = _setup(conn)
+    purchase.buy(conn, player_id, [(cheap, 2)], prices)
+    purchase.buy(conn, player_id, [(dear, 1)], prices)
+    assert economy.reconcile(conn)['mismatches'] == []
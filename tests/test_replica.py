@@ -0,0 +1,175 @@
+# 只读路由：DB_READ_MODE=readonly / snapshot 时应用能正常启动（import 时迁移、gunicorn 预热都走主库），
+# 只读页面从只读连接池或快照读，写过数据的会话读到自己的写入；落后的快照不会把目录缓存换回旧版本。
+import os
+import shutil
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+import catalog
+import db
+import replica
+from conftest import ROOT, login_player
+
+READ_PAGES = ('/shop', '/orders', '/player/dashboard')
+
+
+@pytest.mark.parametrize('mode', ['readonly', 'snapshot'])
+def test_app_starts_and_serves_in_read_mode(database, tmp_path, mode):
+    """新进程里按该模式 import app、跑 gunicorn 的 when_ready 预热，再请求只读页面。"""
+    script = textwrap.dedent('''
+        import runpy
+        import app
+
+        client = app.app.test_client()
+        client.post('/register', data={'username': 'reader', 'password': 'pw'})
+        client.post('/login', data={'username': 'reader', 'password': 'pw'})
+        for path in %r:
+            response = client.get(path)
+            assert response.status_code == 200, (path, response.status_code)
+
+        class Log:
+            def info(self, *args):
+                pass
+
+        class Server:
+            log = Log()
+
+        runpy.run_path('gunicorn.conf.py')['when_ready'](Server())
+        import replica
+        print('served', replica.stats()['mode'])
+    ''' % (READ_PAGES,))
+    env = dict(os.environ, DB_READ_MODE=mode, DATABASE_URL='sqlite:///' + database,
+               DB_SNAPSHOT_DIR=str(tmp_path), WORLD_SCHEDULER='off')
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert 'served ' + mode in result.stdout
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('farm-snapshot')]
+
+
+@pytest.fixture
+def read_mode(app, monkeypatch, tmp_path):
+    """在已加载的应用上切换读模式，返回切换函数；结束时停掉快照线程。"""
+    monkeypatch.setattr(replica, '_readonly_pool', None)
+    monkeypatch.setattr(replica, '_snapshot', None)
+    monkeypatch.setattr(replica, 'SNAPSHOT_DIR', str(tmp_path))
+    monkeypatch.setattr(app, 'after_request_funcs', {key: list(funcs) for key, funcs in app.after_request_funcs.items()})
+    monkeypatch.setattr(db, 'read_pool_for_request', None)
+
+    def switch(mode):
+        # 应用已经处理过请求，不能再调 init_app 注册钩子，这里直接做同样的设置
+        monkeypatch.setattr(replica, 'MODE', mode)
+        monkeypatch.setattr(db, 'read_pool_for_request', replica.pool_for_request)
+        if mode == 'snapshot':
+            app.after_request_funcs.setdefault(None, []).append(replica._mark_write)
+
+    yield switch
+    if replica._snapshot is not None:
+        replica._snapshot.stop()
+        replica._snapshot.join(5)
+        if replica._snapshot.pool is not None:
+            replica._snapshot.pool.retire()
+    if replica._readonly_pool is not None:
+        replica._readonly_pool.close_all()
+
+
+def _used(pool):
+    stats = pool.stats()
+    return stats['hits'] + stats['misses']
+
+
+def test_readonly_mode_routes_reads_only(client, read_mode):
+    login_player(client)
+    read_mode('readonly')
+    primary_before = _used(db.get_pool())
+
+    for path in READ_PAGES:
+        assert client.get(path).status_code == 200
+    assert _used(replica._readonly_pool) == len(READ_PAGES)
+    assert _used(db.get_pool()) == primary_before
+
+    # 写操作仍然走主库
+    assert client.post('/next_day').status_code == 302
+    assert _used(replica._readonly_pool) == len(READ_PAGES)
+    assert _used(db.get_pool()) > primary_before
+
+
+def test_readonly_connection_rejects_writes(database):
+    conn = db.connect_readonly(database)
+    try:
+        with pytest.raises(db.OperationalError):
+            conn.execute("UPDATE Player SET CurrentGold = 0")
+    finally:
+        conn.close()
+
+
+def _wait_for_snapshot():
+    snapshot = replica.ensure_snapshot()
+    deadline = time.monotonic() + 10
+    while snapshot.taken_at is None and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert snapshot.taken_at is not None
+    return snapshot
+
+
+def test_snapshot_mode_read_your_writes_and_staleness(client, read_mode, monkeypatch):
+    player_id = login_player(client)
+    read_mode('snapshot')
+    # 登录是在快照之前发生的，清掉写入时间，模拟一个只读的会话
+    with client.session_transaction() as session:
+        session.pop(replica.WROTE_AT_KEY, None)
+    snapshot = _wait_for_snapshot()
+
+    assert client.get('/shop').status_code == 200
+    assert _used(snapshot.pool) == 1
+
+    # 写过之后（快照还是旧的）读主库，页面上是新数据
+    assert client.post('/next_day').status_code == 302
+    with client.session_transaction() as session:
+        assert session[replica.WROTE_AT_KEY] >= snapshot.taken_at
+    offset = db.connect(db.DB_PATH).execute("SELECT ClockOffset FROM Player WHERE PlayerID = ?",
+                                            (player_id,)).fetchone()[0]
+    assert offset == 1
+    readonly_before = _used(replica.readonly_pool())
+    assert client.get('/player/dashboard').status_code == 200
+    assert _used(snapshot.pool) == 1
+    assert _used(replica.readonly_pool()) == readonly_before + 1
+
+    # 快照过期：即使会话没写过，也退回只读连接池
+    with client.session_transaction() as session:
+        session.pop(replica.WROTE_AT_KEY, None)
+    monkeypatch.setattr(replica, 'MAX_STALENESS', 0)
+    assert client.get('/orders').status_code == 200
+    assert _used(snapshot.pool) == 1
+    assert _used(replica.readonly_pool()) == readonly_before + 2
+
+
+def test_stale_snapshot_does_not_replace_catalog_cache(app, database, tmp_path, monkeypatch):
+    snapshot_path = str(tmp_path / 'snapshot.db')
+    shutil.copy(database, snapshot_path)
+    primary = db.connect(database)
+    catalog.bump_version(primary)
+    primary.commit()
+    snapshot = db.connect(snapshot_path)
+    new_version = catalog.read_version(primary)
+
+    def get_catalog_from(conn):
+        monkeypatch.setattr(catalog, 'get_db', lambda: conn)
+        with app.test_request_context('/shop'):
+            return catalog.get_catalog()
+
+    try:
+        cached = get_catalog_from(primary)
+        assert cached.version == new_version
+        # 快照落后一个版本：本次请求拿到和快照数据一致的旧目录，缓存不动
+        assert get_catalog_from(snapshot).version == new_version - 1
+        assert catalog._catalog is cached
+        # 之后主库的请求直接命中缓存，不再重新加载
+        assert get_catalog_from(primary) is cached
+    finally:
+        primary.close()
+        snapshot.close()
@@ -0,0 +1,147 @@
+# 批量写入：并发提交的操作按默认设置会合成批；同批操作各自一个保存点，一个失败不影响其它；
+# 队列满 / 等待超时时路由返回"繁忙"而不是 500。
+import threading
+
+import pytest
+
+import accounts
+import db
+import economy
+import purchase
+import writebehind
+from conftest import login_player
+
+
+@pytest.fixture
+def writer_db(database, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', database)
+    return database
+
+
+def _flush_together(ops):
+    """把 ops 先全部放进队列再启动写线程，保证它们落在同一批里；返回每个操作的 Future 和写线程。"""
+    writer = writebehind.Writer()
+    futures = [writer.submit(op) for op in ops]
+    writer.start()
+    for future in futures:
+        future.exception(10)
+    writer.stop(10)
+    return futures, writer
+
+
+def _add_user(name):
+    def op(conn):
+        conn.execute("INSERT INTO User (Username, Password) VALUES (?, 'x')", (name,))
+        return name
+    return op
+
+
+def test_failed_op_rolls_back_only_itself(writer_db, conn):
+    def fails_after_write(batch_conn):
+        batch_conn.execute("INSERT INTO User (Username, Password) VALUES ('wb_lost', 'x')")
+        raise ValueError('boom')
+
+    def duplicate(batch_conn):
+        # 违反 UNIQUE 约束，SQLite 只撤销这一条语句，保存点再撤销它之前的写入
+        batch_conn.execute("INSERT INTO User (Username, Password) VALUES ('wb_lost_too', 'x')")
+        batch_conn.execute("INSERT INTO User (Username, Password) VALUES ('wb_first', 'x')")
+
+    futures, writer = _flush_together([_add_user('wb_first'), fails_after_write, duplicate, _add_user('wb_last')])
+
+    assert futures[0].result() == 'wb_first' and futures[3].result() == 'wb_last'
+    assert isinstance(futures[1].exception(), ValueError)
+    assert isinstance(futures[2].exception(), db.IntegrityError)
+    names = {row[0] for row in conn.execute("SELECT Username FROM User WHERE Username LIKE 'wb_%'")}
+    assert names == {'wb_first', 'wb_last'}
+    stats = dict(writer.totals)
+    assert stats['batches'] == 1 and stats['ops'] == 4 and stats['failed'] == 2
+
+
+def test_business_rollback_inside_batch(writer_db, conn):
+    """purchase.buy 失败时自己调用 rollback()：在批量连接上只回滚到它的保存点。"""
+    (_, player_id), = accounts.create_players(conn, [('wb_buyer', 'x')], [])
+    prices = {row[0]: row[1] for row in conn.execute("SELECT ItemID, SellPrice FROM ShopItem")}
+    item_id, price = min(prices.items(), key=lambda item: item[1])
+
+    def reward(batch_conn):
+        batch_conn.execute("BEGIN IMMEDIATE")
+        economy.apply(batch_conn, [(player_id, 7, economy.reference('test', 'reward'))])
+        batch_conn.commit()
+
+    futures, _ = _flush_together([
+        lambda c: purchase.buy(c, player_id, [(item_id, 1)], prices),
+        lambda c: purchase.buy(c, player_id, [(item_id, 10 ** 6)], prices),
+        reward,
+    ])
+
+    assert futures[0].exception() is None and futures[2].exception() is None
+    assert isinstance(futures[1].exception(), purchase.PurchaseError)
+    gold = conn.execute("SELECT CurrentGold FROM Player WHERE PlayerID = ?", (player_id,)).fetchone()[0]
+    assert gold == accounts.STARTER_GOLD - price + 7
+    assert economy.reconcile(conn)['mismatches'] == []
+
+
+def test_concurrent_runs_are_batched(writer_db, conn, monkeypatch):
+    monkeypatch.setattr(writebehind, 'ENABLED', True)
+    monkeypatch.setattr(writebehind, '_writer', None)
+    threads_count = 16
+    barrier = threading.Barrier(threads_count)
+    errors = []
+
+    def worker(index):
+        barrier.wait()
+        try:
+            assert writebehind.run(_add_user('wb_batched_{}'.format(index))) == 'wb_batched_{}'.format(index)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    writebehind.drain()
+
+    assert errors == []
+    # run() 返回时已经提交：另一个连接立刻能读到全部写入
+    assert conn.execute("SELECT COUNT(*) FROM User WHERE Username LIKE 'wb_batched_%'").fetchone()[0] == threads_count
+    stats = writebehind.stats()
+    assert stats['ops'] == threads_count
+    assert stats['avg_batch'] > 1, stats
+
+
+def _saturate(monkeypatch, fill):
+    """让 run() 拿到一个不会消费队列的写线程：fill=True 时队列已满，否则只是一直不提交。"""
+    monkeypatch.setattr(writebehind, 'ENABLED', True)
+    monkeypatch.setattr(writebehind, 'TIMEOUT', 0.05)
+    monkeypatch.setattr(writebehind, 'MAX_PENDING', 1)
+    stuck = writebehind.Writer()
+    if fill:
+        stuck.queue.put((None, None))
+    monkeypatch.setattr(writebehind, 'get_writer', lambda: stuck)
+
+
+@pytest.mark.parametrize('fill', [True, False], ids=['queue-full', 'commit-timeout'])
+def test_run_raises_writer_busy(monkeypatch, fill):
+    _saturate(monkeypatch, fill)
+    with pytest.raises(writebehind.WriterBusy):
+        writebehind.run(lambda conn: None)
+
+
+@pytest.mark.parametrize('fill', [True, False], ids=['queue-full', 'commit-timeout'])
+def test_routes_report_busy(client, monkeypatch, fill):
+    login_player(client)
+    _saturate(monkeypatch, fill)
+
+    for path in ('/next_day', '/water/1', '/shop/buy/1'):
+        response = client.post(path)
+        assert response.status_code == 302, path
+        with client.session_transaction() as session:
+            messages = [message for _, message in session.pop('_flashes', [])]
+        assert any('繁忙' in message for message in messages), (path, messages)
+
+    for path, body in (('/api/v1/next_day', None), ('/api/v1/plots/1/water', None),
+                       ('/api/v1/shop/buy', {'item_id': 1, 'quantity': 1})):
+        response = client.post(path, json=body, headers={'X-Requested-With': 'XMLHttpRequest'})
+        assert response.status_code == 503, path
+        assert '繁忙' in response.get_json()['error']
@@ -0,0 +1,241 @@
+# writebehind.py
+# 高频玩法操作（浇水、下一天、商店购买）的批量写入模式，WRITE_BEHIND=on 时开启，默认关闭。
+#
+# 开启后这些路由不再各自提交事务，而是把写操作（接收连接的函数，里面照常做校验和写入）
+# 放进本进程的队列；一个写线程每 WRITE_BEHIND_MS 毫秒或攒够 WRITE_BEHIND_BATCH 个操作，
+# 就在一个 BEGIN IMMEDIATE 事务里依次执行、一次提交。每个操作套一个 SAVEPOINT：
+# 某个操作失败（金币不足、地块不可操作等）只回滚它自己，同批其它操作照常提交。
+# 操作里原有的 BEGIN / commit 不生效，rollback 只回滚到该操作的保存点（见 _BatchConnection），
+# 所以 game / purchase 里的业务代码不用改。写锁的获取、提交（以及 synchronous = FULL 时的 fsync）
+# 由一批操作分摊，写者之间也不再互相等待 busy_timeout。
+#
+# 持久性约定：
+#   - 请求线程拿到的是该操作的 Future，等到所在批次 COMMIT 成功后才返回；响应里看到"成功"时，
+#     数据已经和普通模式一样提交（持久程度取决于 PRAGMA synchronous，见 db.py）；
+#   - 提交失败时同批所有操作都收到异常，没有一个生效；
+#   - 队列已满（等 WRITE_BEHIND_TIMEOUT 秒仍放不进去）时抛出 WriterBusy，操作没有执行；
+#   - 等待提交超过 WRITE_BEHIND_TIMEOUT 秒也抛出 WriterBusy，这时操作可能仍会在稍后提交，结果未知；
+#     路由把 WriterBusy 当作"服务器繁忙"提示给用户（HTML 页面 flash，JSON 接口 503）；
+#   - 进程崩溃时，还没提交的批次对应的请求都没有收到响应，SQLite 重启时按 WAL 丢弃未提交的事务，
+#     不会出现"返回成功但没写进去"或半批写入的情况，也就不需要额外的重放日志。
+# 崩溃恢复：写线程里的异常会让当前批次全部失败并重建连接；写线程意外退出后，下一次提交会
+# 重新启动它（fork 之后按 pid 重启）；进程正常退出时（atexit）先把队列里剩下的操作提交完。
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import concurrency
+import db
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('WRITE_BEHIND', 'off') == 'on'
+# 收到一批的第一个操作后最多再等这么久凑批；设为 0 时只取已经排队的操作，并发不高时几乎每批只有一个
+FLUSH_MS = float(os.environ.get('WRITE_BEHIND_MS', 2))
+BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH', 64))
+MAX_PENDING = int(os.environ.get('WRITE_BEHIND_QUEUE', 1000))
+TIMEOUT = float(os.environ.get('WRITE_BEHIND_TIMEOUT', 10))
+BEGIN_RETRIES = 5
+
+_STOP = object()
+
+
+class WriterBusy(Exception):
+    pass
+
+
+class _BatchConnection:
+    """交给批量事务里每个操作的连接：BEGIN / commit 不生效，rollback 只回滚到该操作的保存点。"""
+
+    in_transaction = True
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, sql, params=()):
+        if sql.lstrip()[:5].upper() == 'BEGIN':
+            return None
+        return self._conn.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._conn.executemany(sql, seq_of_params)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self._conn.execute("ROLLBACK TO write_behind_op")
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class Writer(threading.Thread):
+    def __init__(self):
+        super().__init__(name='write-behind', daemon=True)
+        self.pid = os.getpid()
+        self.queue = queue.Queue(maxsize=MAX_PENDING)
+        self.lock = threading.Lock()
+        self.totals = {'ops': 0, 'failed': 0, 'batches': 0, 'max_batch': 0, 'commit_errors': 0,
+                       'commit_ms': 0.0}
+
+    def submit(self, fn):
+        future = Future()
+        # 队列满时阻塞请求线程（背压），而不是无限堆积
+        self.queue.put((fn, future), timeout=TIMEOUT)
+        return future
+
+    def stop(self, timeout=None):
+        self.queue.put(_STOP)
+        self.join(timeout)
+
+    def run(self):
+        conn = db.connect()
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            if not batch:
+                continue
+            try:
+                self._flush(conn, batch)
+            except Exception as e:
+                log.exception('write-behind batch failed')
+                _fail(batch, e)
+                conn.close()
+                conn = db.connect()
+        conn.close()
+
+    def _collect(self):
+        """阻塞等第一个操作，之后在 FLUSH_MS 内尽量多收（已排队的立即取走），返回 (批次, 是否收到停止信号)。"""
+        item = self.queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + FLUSH_MS / 1000
+        while len(batch) < BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _begin(self, conn):
+        for attempt in range(BEGIN_RETRIES):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                return
+            except Exception as e:
+                if not concurrency.is_busy(e) or attempt == BEGIN_RETRIES - 1:
+                    raise
+                time.sleep(concurrency.backoff(attempt))
+
+    def _flush(self, conn, batch):
+        started = time.monotonic()
+        self._begin(conn)
+        proxy = _BatchConnection(conn)
+        outcomes = []
+        try:
+            for fn, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT write_behind_op")
+                try:
+                    outcomes.append((future, fn(proxy), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_behind_op")
+                    outcomes.append((future, None, e))
+                conn.execute("RELEASE write_behind_op")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            with self.lock:
+                self.totals['commit_errors'] += 1
+            raise
+
+        failed = 0
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+                failed += 1
+        with self.lock:
+            self.totals['ops'] += len(outcomes)
+            self.totals['failed'] += failed
+            self.totals['batches'] += 1
+            self.totals['max_batch'] = max(self.totals['max_batch'], len(outcomes))
+            self.totals['commit_ms'] += (time.monotonic() - started) * 1000
+
+
+def _fail(batch, error):
+    for _, future in batch:
+        if not future.done():
+            future.set_exception(error)
+
+
+_writer = None
+_start_lock = threading.Lock()
+
+
+def get_writer():
+    """本进程的写线程；还没启动、已经退出或 fork 之后都会重新启动一个。"""
+    global _writer
+    writer = _writer
+    if writer is not None and writer.pid == os.getpid() and writer.is_alive():
+        return writer
+    with _start_lock:
+        if _writer is None or _writer.pid != os.getpid() or not _writer.is_alive():
+            _writer = Writer()
+            _writer.start()
+        return _writer
+
+
+def run(fn):
+    """执行写操作 fn(conn) 并返回它的结果，异常原样抛出。
+
+    未开启时直接用当前请求的连接执行；开启后交给写线程批量提交，阻塞到所在批次 COMMIT 成功才返回，
+    返回时数据已经提交，和未开启时持久程度相同。
+    fn 在写线程里执行，不能使用 Flask 的 request / session / g（需要的值先在请求线程里取好）。
+    队列满或等待提交超时抛出 WriterBusy（后者操作可能稍后仍会提交）。
+    进程正常退出时 drain() 先提交队列里剩下的操作，等待中的调用照常拿到结果；
+    进程崩溃时未提交批次里的调用不会返回，这些操作也都没有生效。
+    """
+    if not ENABLED:
+        return fn(db.get_db())
+    try:
+        future = get_writer().submit(fn)
+    except queue.Full:
+        raise WriterBusy('服务器繁忙，请稍后再试')
+    try:
+        return future.result(TIMEOUT)
+    except FutureTimeout:
+        if future.done():
+            raise
+        raise WriterBusy('服务器繁忙，操作可能稍后才生效，请刷新确认')
+
+
+def stats():
+    writer = _writer
+    if writer is None:
+        return {'enabled': ENABLED, 'running': False}
+    with writer.lock:
+        totals = dict(writer.totals)
+    return dict(totals, enabled=ENABLED, running=writer.is_alive(), pending=writer.queue.qsize(),
+                flush_ms=FLUSH_MS, batch_size=BATCH_SIZE,
+                avg_batch=round(totals['ops'] / totals['batches'], 2) if totals['batches'] else 0.0)
+
+
+@atexit.register
+def drain():
+    """把队列里剩下的操作提交完再停止写线程（进程退出时调用）。"""
+    writer = _writer
+    if writer is not None and writer.pid == os.getpid() and writer.is_alive():
+        writer.stop(TIMEOUT)